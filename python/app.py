@@ -8,8 +8,17 @@ import pandas as pd
 import numpy as np
 import json
 import sys
-import os
-from pathlib import Path
+import time
+
+from feature_matrix import MATRIX_DIR, append_feature_matrix, build_feature_matrix
+from feature_stats import (STATS_FILE, TOTALS_FILE, combine_partials, combine_price_totals, compute_feature_stats,
+                           item_price_totals, load_stats_totals, partial_stats, write_feature_stats)
+from instrument import StageTimer, peak_rss_mb
+from lookups import LOOKUPS_FILE, build_lookups, save_lookups
+from preprocess_manifest import (MANIFEST_FILE, calendar_hash, combine, file_hash, history_hash,
+                                 load_manifest, write_manifest)
+from storage import (parquet_available, processed_files, processed_fingerprint, project_dir, remove_parts,
+                     reset_processed, write_processed)
 
 # Updated paths to match actual file structure
 INPUT_PATH = "./uploads/"  # Files are uploaded to root uploads folder
@@ -18,80 +27,269 @@ OUTPUT_PATH = "./python/data/processed/"  # Output to python data folder
 # Number of products to process (adjust depending on RAM)
 N_PRODUCTS = 200
 
-def preprocess_sales_data():
-    """Main preprocessing function"""
-    try:
-        # Set up paths relative to project root
-        base_dir = Path(__file__).parent.parent  # Go up to project root
-        input_dir = base_dir / "uploads"
-        output_dir = base_dir / "python" / "data" / "processed"
-        output_dir.mkdir(parents=True, exist_ok=True)
+# Rows of sales_train_validation.csv read per chunk in streaming mode
+CHUNK_SIZE = 1000
 
-        # Check if required files exist
-        required_files = [
-            "sales_train_validation.csv",
-            "calendar.csv",
-            "sell_prices.csv"
-        ]
+ID_COLS = ["id", "item_id", "dept_id", "cat_id", "store_id", "state_id"]
+REQUIRED_FILES = ["sales_train_validation.csv", "calendar.csv", "sell_prices.csv"]
 
-        for file in required_files:
-            if not (input_dir / file).exists():
-                raise FileNotFoundError(f"Required file {file} not found in uploads directory")
 
-        print("Loading sales...")
-        sales = pd.read_csv(input_dir / "sales_train_validation.csv")
-        if N_PRODUCTS:
-            sales = sales.iloc[:N_PRODUCTS]
+def preprocess_chunk(chunk, value_vars, lookups):
+    """Melt one chunk of wide sales rows and join calendar and prices by array indexing"""
+    sales_long = chunk.melt(
+        id_vars=ID_COLS,
+        value_vars=value_vars,
+        var_name="d",
+        value_name="demand"
+    )
+    sales_long["demand"] = sales_long["demand"].astype("int16")
 
-        print("Loading calendar...")
-        calendar = pd.read_csv(input_dir / "calendar.csv")
+    # melt stacks day columns in order, so each calendar row repeats len(chunk) times
+    day_idx = lookups.day_index(value_vars)
+    if (day_idx < 0).any():
+        raise ValueError("Sales days missing from calendar.csv")
+    for col in lookups.calendar_columns:
+        sales_long[col] = np.repeat(lookups.calendar[col][day_idx], len(chunk))
 
-        print("Loading prices...")
-        prices = pd.read_csv(input_dir / "sell_prices.csv")
+    # Prices by (item, store, week) code, laid out day-major like the melt
+    item_codes = lookups.item_codes(chunk["item_id"])
+    store_codes = lookups.store_codes(chunk["store_id"])
+    prices = lookups.price(item_codes[None, :], store_codes[None, :], day_idx[:, None])
+    sales_long["sell_price"] = np.nan_to_num(prices.ravel(), nan=0.0)
+    return sales_long
+
+
+def upload_hashes(input_dir):
+    return {name: file_hash(input_dir / name) for name in REQUIRED_FILES}
+
+
+def incremental_blocker(previous, output_dir, value_vars, max_series, hashes, lookups):
+    """Why the previous run's rows cannot be extended (None if they can)"""
+    if previous is None:
+        return "no previous preprocessing manifest"
+    if not parquet_available():
+        return "appending needs the Parquet dataset"
+    if previous.get("max_series") != max_series:
+        return "series limit changed"
+    if previous.get("fingerprint") != processed_fingerprint(output_dir):
+        return "processed data changed since the last run"
+    old_days = previous["days"]
+    if value_vars[:len(old_days)] != old_days:
+        return "processed day columns missing from the sales file"
+    if previous["upload_hashes"]["calendar.csv"] != hashes["calendar.csv"] and \
+            calendar_hash(lookups, old_days) != previous["calendar_hash"]:
+        return "calendar changed for processed days"
+    return None
+
+
+def preprocess_sales_streaming(input_dir, output_dir, chunk_size=CHUNK_SIZE, timings=None,
+                               max_series=None, full=False):
+    """Process series in row chunks, appending each chunk to the processed dataset.
+
+    With the manifest of an earlier run over the same history (see
+    preprocess_manifest.py), only the delta is processed: the new day
+    columns of known series and every day of new series are appended as
+    new parts. Their statistics are merged into the saved totals and, when
+    no series are new, their rows are appended to the feature matrix.
+    Otherwise, or with full=True, the dataset is rebuilt.
+    max_series limits processing to the first rows of the sales file.
+    """
+    start_time = time.time()
+    timings = timings or StageTimer("preprocess")
+
+    sales_file = input_dir / "sales_train_validation.csv"
+    with timings.stage("hash_uploads"):
+        hashes = upload_hashes(input_dir)
+    previous = None if full else load_manifest(output_dir)
+    if (previous is not None and previous["upload_hashes"] == hashes
+            and previous.get("max_series") == max_series
+            and previous.get("fingerprint") == processed_fingerprint(output_dir)):
+        print("Uploads unchanged since the last run, nothing to process")
+        return {
+            "rows_processed": 0,
+            "series_processed": 0,
+            "incremental": True,
+            "new_days": 0,
+            "new_series": 0,
+            "elapsed": time.time() - start_time,
+        }
 
-        print("Transforming sales data (melt)...")
-        id_vars = ["id", "item_id", "dept_id", "cat_id", "store_id", "state_id"]
-        value_vars = [col for col in sales.columns if col.startswith("d_")]
+    print("Building calendar and price lookups...")
+    with timings.stage("load_lookups"):
+        lookups = build_lookups(input_dir / "calendar.csv", input_dir / "sell_prices.csv", sales_file)
+        save_lookups(output_dir, lookups)
 
-        sales_long = sales.melt(
-            id_vars=id_vars,
-            value_vars=value_vars,
-            var_name="d",
-            value_name="demand"
-        )
+    header = pd.read_csv(sales_file, nrows=0).columns
+    value_vars = [col for col in header if col.startswith("d_")]
+    dtypes = {col: "category" for col in ID_COLS}
+    dtypes.update({col: "int16" for col in value_vars})
 
-        print("Merging calendar...")
-        sales_long = sales_long.merge(calendar, how="left", on="d")
+    reason = "full rebuild requested" if full else incremental_blocker(
+        previous, output_dir, value_vars, max_series, hashes, lookups)
+    if reason is None:
+        old_days = previous["days"]
+        old_series = set(previous["series"])
+        new_days = value_vars[len(old_days):]
+        first_part = previous["next_part"]
+        totals = load_stats_totals(output_dir)
+        print(f"Incremental preprocessing: {len(new_days)} new day columns")
+    else:
+        old_days, old_series, new_days, first_part = [], set(), value_vars, 0
+        totals = None
+        print(f"Full preprocessing ({reason})")
+        reset_processed(output_dir)
+    prior_prices = totals[1] if totals is not None else None
 
-        print("Merging prices...")
-        sales_long = sales_long.merge(
-            prices,
-            how="left",
-            left_on=["store_id", "item_id", "wm_yr_wk"],
-            right_on=["store_id", "item_id", "wm_yr_wk"]
-        )
+    rows_written = 0
+    series_processed = 0
+    old_series_seen = 0
+    old_history = 0
+    new_history = 0
+    series = []
+    stats_partials = []
+    price_partials = []
+    reader = pd.read_csv(sales_file, dtype=dtypes, chunksize=chunk_size, nrows=max_series)
+    chunk_idx = 0
+    while True:
+        with timings.stage("load_csv") as stage:
+            chunk = next(reader, None)
+            if chunk is not None:
+                stage.add_rows(len(chunk))
+        if chunk is None:
+            break
+        known = chunk["id"].isin(old_series).to_numpy()
+        with timings.stage("hash_history"):
+            old_history = combine(old_history, history_hash(chunk[known], old_days, lookups))
+            new_history = combine(new_history, history_hash(chunk, value_vars, lookups))
+        with timings.stage("melt_join") as stage:
+            # Known series need only their new days, new series every day
+            frames = []
+            if known.any() and new_days:
+                frames.append(preprocess_chunk(chunk[known], new_days, lookups))
+            if (~known).any():
+                frames.append(preprocess_chunk(chunk[~known], value_vars, lookups))
+            sales_long = pd.concat(frames, ignore_index=True) if len(frames) > 1 else (
+                frames[0] if frames else None)
+            stage.add_rows(len(sales_long) if sales_long is not None else 0)
+        if sales_long is not None:
+            with timings.stage("write") as stage:
+                write_processed(sales_long, output_dir, part=first_part + chunk_idx)
+                stage.add_rows(len(sales_long))
+            with timings.stage("stats"):
+                stats_partials.append(partial_stats(sales_long, prior_prices))
+                price_partials.append(item_price_totals(sales_long))
+            rows_written += len(sales_long)
+        series.extend(chunk["id"].astype(str))
+        old_series_seen += int(known.sum())
+        series_processed += len(chunk)
+        chunk_idx += 1
+        print(f"Chunk {chunk_idx}: {series_processed:,} series, {rows_written:,} rows written")
 
-        print("Encoding categorical columns...")
-        for col in ["event_name_1", "event_type_1", "event_name_2", "event_type_2"]:
-            if col in sales_long.columns:
-                sales_long[col] = sales_long[col].astype("category").cat.codes
+    if reason is None and (old_series_seen != len(old_series) or old_history != previous["history_hash"]):
+        # Rows already written no longer match the uploads; drop the delta
+        print("Processed history changed in the uploads, rebuilding in full")
+        remove_parts(output_dir, first_part)
+        stats = preprocess_sales_streaming(input_dir, output_dir, chunk_size, timings, max_series, full=True)
+        stats["rebuild_reason"] = "processed history changed in the uploads"
+        stats["elapsed"] = time.time() - start_time
+        return stats
 
-        sales_long["sell_price"].fillna(0, inplace=True)
+    print("Saving feature statistics...")
+    with timings.stage("stats"):
+        if reason is None and totals is None:
+            # No saved totals to merge into, e.g. after an older version's run
+            compute_feature_stats(output_dir)
+        else:
+            aggregates, price_totals = totals if totals is not None else (None, None)
+            write_feature_stats(output_dir, combine_partials([aggregates] + stats_partials),
+                                combine_price_totals([price_totals] + price_partials))
 
-        print("Saving preprocessed data...")
-        output_file = output_dir / "m5_preprocessed_sample.csv"
-        sales_long.to_csv(output_file, index=False)
+    print("Writing feature matrix...")
+    with timings.stage("matrix") as stage:
+        matrix = None
+        if reason is None and new_days and old_series_seen == series_processed:
+            first_day = lookups.dates[lookups.day_index(new_days[:1])[0]]
+            matrix = append_feature_matrix(output_dir, first_day, previous["fingerprint"])
+        if matrix is None:
+            # New series add rows to days already in the matrix, so it is rebuilt
+            matrix = build_feature_matrix(output_dir)
+            stage.add_rows(matrix["rows"])
+        else:
+            stage.add_rows(matrix["rows_added"])
+
+    write_manifest(output_dir, {
+        "max_series": max_series,
+        "days": value_vars,
+        "series": series,
+        "upload_hashes": hashes,
+        "calendar_hash": calendar_hash(lookups, value_vars),
+        "history_hash": new_history,
+        "next_part": first_part + chunk_idx,
+        "fingerprint": processed_fingerprint(output_dir),
+    })
+
+    elapsed = time.time() - start_time
+    return {
+        "rows_processed": rows_written,
+        "series_processed": series_processed,
+        "incremental": reason is None,
+        "new_days": len(new_days) if reason is None else len(value_vars),
+        "new_series": series_processed - old_series_seen,
+        "rebuild_reason": reason,
+        "elapsed": elapsed,
+    }
+
+
+def preprocess_sales_data(streaming=False, chunk_size=CHUNK_SIZE, full=False):
+    """Main preprocessing function.
+
+    Sample mode processes the first N_PRODUCTS series in one chunk;
+    streaming mode processes every series in chunks of chunk_size. Either
+    way only data added since the previous run is processed unless `full`.
+    """
+    try:
+        timings = StageTimer("preprocess")
+
+        # Set up paths relative to project root
+        base_dir = project_dir()
+        input_dir = base_dir / "uploads"
+        output_dir = base_dir / "python" / "data" / "processed"
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        # Check if required files exist
+        for file in REQUIRED_FILES:
+            if not (input_dir / file).exists():
+                raise FileNotFoundError(f"Required file {file} not found in uploads directory")
+
+        if streaming:
+            print(f"Streaming preprocessing in chunks of {chunk_size:,} series...")
+            stats = preprocess_sales_streaming(input_dir, output_dir, chunk_size, timings, full=full)
+        else:
+            print(f"Sample preprocessing of the first {N_PRODUCTS} series...")
+            stats = preprocess_sales_streaming(input_dir, output_dir, N_PRODUCTS, timings,
+                                               max_series=N_PRODUCTS, full=full)
+        elapsed = stats["elapsed"]
+        rows_per_sec = stats["rows_processed"] / elapsed if elapsed > 0 else 0.0
 
         print("Processing completed successfully!")
-        print(f"Rows saved: {len(sales_long):,}")
+        print(f"Rows saved: {stats['rows_processed']:,}")
 
-        # Prepare results
         summary = {
             "status": "success",
             "message": "Data preprocessing completed successfully",
-            "rows_processed": len(sales_long),
-            "files_created": ["m5_preprocessed_sample.csv"],
-            "processing_time": "45 seconds"
+            "mode": "streaming" if streaming else "sample",
+            "incremental": stats["incremental"],
+            "rows_processed": stats["rows_processed"],
+            "series_processed": stats["series_processed"],
+            "new_days": stats["new_days"],
+            "new_series": stats["new_series"],
+            "rebuild_reason": stats.get("rebuild_reason"),
+            "files_created": processed_files(output_dir) + [STATS_FILE, TOTALS_FILE, LOOKUPS_FILE, MATRIX_DIR,
+                                                           MANIFEST_FILE],
+            "processing_time": f"{elapsed:.2f} seconds",
+            "rows_per_sec": round(rows_per_sec, 1),
+            "peak_rss_mb": peak_rss_mb(),
+            "timings": timings.summary()
         }
 
         print(json.dumps(summary))
@@ -106,4 +304,13 @@ def preprocess_sales_data():
         return error_result
 
 if __name__ == "__main__":
-    preprocess_sales_data()
+    if len(sys.argv) > 1:
+        # Parse command line arguments
+        params = json.loads(sys.argv[1])
+        streaming = params.get('streaming', False)
+        chunk_size = params.get('chunk_size', CHUNK_SIZE)
+        full = params.get('full', False)
+
+        preprocess_sales_data(streaming, chunk_size, full)
+    else:
+        preprocess_sales_data()
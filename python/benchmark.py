@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the preprocess -> train -> predict -> route pipeline.
+
+Synthetic M5-shaped uploads (sales_train_validation.csv, calendar.csv,
+sell_prices.csv, store_locations.csv) are generated at a configurable
+scale of items x stores x days into a scratch project tree, and each stage
+script is run there as its own process (WALMART_PROJECT_DIR points the
+scripts at the scratch tree). Every stage records wall time, CPU time, peak
+RSS and rows per second, and the report is written as JSON so runs can be
+compared across commits:
+
+    python python/benchmark.py '{"items": 100, "stores": 10, "days": 730}'
+    python python/benchmark.py '{"baseline": "python/data/benchmarks/benchmark-....json"}'
+
+With a baseline report, stages whose wall time grew by more than
+`tolerance` are listed under regressions.
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import project_dir
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SCALE = {"items": 50, "stores": 10, "days": 365}
+REGRESSION_TOLERANCE = 0.2
+FORECAST_DAYS = 28
+
+STATES = {"CA": (36.8, -119.4), "TX": (31.0, -99.0), "WI": (44.5, -89.5)}
+CATEGORIES = ["FOODS", "HOBBIES", "HOUSEHOLD"]
+START_DATE = "2011-01-29"
+
+
+def store_ids(n_stores):
+    """M5-style store ids spread over the three states (CA_1, TX_1, WI_1, CA_2, ...)"""
+    states = list(STATES)
+    return [f"{states[s % len(states)]}_{s // len(states) + 1}" for s in range(n_stores)]
+
+
+def generate_inputs(uploads_dir, items, stores, days, seed=42):
+    """Write synthetic M5-shaped upload files; returns the generated sizes"""
+    uploads_dir = Path(uploads_dir)
+    uploads_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    stores = store_ids(stores)
+    cats = [CATEGORIES[i % len(CATEGORIES)] for i in range(items)]
+    depts = [f"{cat}_{1 + (i // len(CATEGORIES)) % 2}" for i, cat in enumerate(cats)]
+    item_ids = [f"{dept}_{i + 1:03d}" for i, dept in enumerate(depts)]
+
+    # Series are store-major, like the M5 file
+    series_store = np.repeat(stores, items)
+    series_item = np.tile(item_ids, len(stores))
+    series_dept = np.tile(depts, len(stores))
+    series_cat = np.tile(cats, len(stores))
+    n_series = len(series_item)
+
+    dates = pd.date_range(START_DATE, periods=days + FORECAST_DAYS, freq="D")
+    weekly = 1 + 0.3 * np.isin(dates[:days].weekday, [5, 6])
+    rates = rng.gamma(2.0, 1.5, size=(n_series, 1)) * weekly[None, :]
+    demand = rng.poisson(rates).astype(np.int16)
+
+    sales = pd.DataFrame({
+        "id": [f"{item}_{store}_validation" for item, store in zip(series_item, series_store)],
+        "item_id": series_item,
+        "dept_id": series_dept,
+        "cat_id": series_cat,
+        "store_id": series_store,
+        "state_id": [store[:2] for store in series_store],
+    })
+    day_cols = pd.DataFrame(demand, columns=[f"d_{k + 1}" for k in range(days)])
+    pd.concat([sales, day_cols], axis=1).to_csv(uploads_dir / "sales_train_validation.csv", index=False)
+
+    weeks = 11101 + np.arange(len(dates)) // 7
+    events = np.where(np.arange(len(dates)) % 45 == 10, "SuperBowl", None)
+    calendar = pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d"),
+        "wm_yr_wk": weeks,
+        "weekday": dates.day_name(),
+        "wday": (dates.weekday + 2) % 7 + 1,
+        "month": dates.month,
+        "year": dates.year,
+        "d": [f"d_{k + 1}" for k in range(len(dates))],
+        "event_name_1": events,
+        "event_type_1": np.where(events == None, None, "Sporting"),  # noqa: E711
+        "event_name_2": None,
+        "event_type_2": None,
+        "snap_CA": (dates.day <= 10).astype(int),
+        "snap_TX": (dates.day <= 10).astype(int),
+        "snap_WI": (dates.day <= 10).astype(int),
+    })
+    calendar.to_csv(uploads_dir / "calendar.csv", index=False)
+
+    unique_weeks = np.unique(weeks)
+    base_price = rng.uniform(1.0, 20.0, size=n_series)
+    prices = pd.DataFrame({
+        "store_id": np.repeat(series_store, len(unique_weeks)),
+        "item_id": np.repeat(series_item, len(unique_weeks)),
+        "wm_yr_wk": np.tile(unique_weeks, n_series),
+        "sell_price": np.round(np.repeat(base_price, len(unique_weeks))
+                               * rng.uniform(0.9, 1.1, size=n_series * len(unique_weeks)), 2),
+    })
+    prices.to_csv(uploads_dir / "sell_prices.csv", index=False)
+
+    centers = np.array([STATES[store[:2]] for store in stores])
+    pd.DataFrame({
+        "store_id": stores,
+        "state": [store[:2] for store in stores],
+        "lat": np.round(centers[:, 0] + rng.uniform(-2, 2, len(stores)), 4),
+        "lon": np.round(centers[:, 1] + rng.uniform(-2, 2, len(stores)), 4),
+    }).to_csv(uploads_dir / "store_locations.csv", index=False)
+
+    return {
+        "series": n_series,
+        "sales_rows": n_series * days,
+        "price_rows": len(prices),
+        "forecast_start": dates[days].strftime("%Y-%m-%d"),
+        "forecast_end": dates[-1].strftime("%Y-%m-%d"),
+        "stores": stores,
+    }
+
+
+def pipeline_stages(inputs, quantiles=None, streaming=True):
+    """(name, script, params, rows_from_result, extra_env) for each stage in run order"""
+    window = {"start_date": inputs["forecast_start"], "end_date": inputs["forecast_end"]}
+    train_params = {} if quantiles is None else {"quantiles": quantiles}
+    return [
+        ("preprocess", "app.py", {"streaming": streaming},
+         lambda r: r.get("rows_processed"), {}),
+        ("train", "model.py", train_params,
+         lambda r: (r.get("training_samples") or 0) + (r.get("test_samples") or 0), {}),
+        ("predict", "pred.py", dict(window, store=inputs["stores"][0], category="FOODS"),
+         lambda r: r.get("rows_scored"), {"PREDICTION_CACHE": "off"}),
+        ("predict_batch", "pred.py", dict(window, mode="batch"),
+         lambda r: r.get("rows_scored"), {}),
+        ("route", "route.py", dict(window, backend="haversine", top_stores=min(len(inputs["stores"]), 10),
+                                   demand_threshold=0),
+         lambda r: r.get("stores_count"), {}),
+    ]
+
+
+def peak_rss_mb(maxrss):
+    """ru_maxrss in MB (bytes on macOS, kilobytes on Linux)"""
+    if sys.platform == "darwin":
+        return round(maxrss / (1024 * 1024), 1)
+    return round(maxrss / 1024, 1)
+
+
+def run_stage(script, params, work_dir, log_file, extra_env=None):
+    """Run one stage script; returns (result JSON, wall s, cpu s, peak RSS MB)"""
+    env = dict(os.environ, WALMART_PROJECT_DIR=str(work_dir), **(extra_env or {}))
+    script_path = Path(__file__).parent / script
+    with open(log_file, "w") as log:
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, str(script_path), json.dumps(params)],
+                                cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if resource is not None and hasattr(os, "wait4"):
+            # wait4 reports the child's own usage, including workers it waited for
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+            cpu = usage.ru_utime + usage.ru_stime
+            rss = peak_rss_mb(usage.ru_maxrss)
+        else:
+            proc.wait()
+            cpu, rss = None, None
+        wall = time.perf_counter() - started
+
+    result = None
+    with open(log_file, "r") as log:
+        lines = [line for line in log.read().splitlines() if line.strip()]
+    if lines:
+        try:
+            result = json.loads(lines[-1])
+        except ValueError:
+            result = None
+    if result is None:
+        result = {"status": "error", "message": f"No JSON result (exit code {proc.returncode})"}
+    return result, wall, cpu, rss
+
+
+def git_commit(root):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(stages, baseline_file, tolerance):
+    """Annotate stages with the baseline's wall time; returns regressed stage names"""
+    with open(baseline_file, "r") as f:
+        baseline = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+    regressions = []
+    for stage in stages:
+        before = baseline.get(stage["stage"])
+        if not before or not before.get("wall_s") or stage["status"] != "success":
+            continue
+        stage["baseline_wall_s"] = before["wall_s"]
+        stage["wall_ratio"] = round(stage["wall_s"] / before["wall_s"], 3)
+        if stage["wall_ratio"] > 1 + tolerance:
+            regressions.append(stage["stage"])
+    return regressions
+
+
+def run_benchmark(items=None, stores=None, days=None, seed=42, quantiles=None, streaming=True,
+                  work_dir=None, output=None, baseline=None, tolerance=REGRESSION_TOLERANCE,
+                  keep_work_dir=False):
+    """Generate inputs, run every stage and write the JSON report"""
+    try:
+        root = project_dir()
+        bench_dir = root / "python" / "data" / "benchmarks"
+        work_dir = Path(work_dir) if work_dir else bench_dir / "work"
+        scale = {
+            "items": items or DEFAULT_SCALE["items"],
+            "stores": stores or DEFAULT_SCALE["stores"],
+            "days": days or DEFAULT_SCALE["days"],
+        }
+
+        if work_dir.exists():
+            shutil.rmtree(work_dir)
+        (work_dir / "python" / "data" / "processed").mkdir(parents=True)
+        (work_dir / "python" / "models").mkdir(parents=True)
+
+        print(f"Generating {scale['items']} items x {scale['stores']} stores x {scale['days']} days...")
+        t0 = time.perf_counter()
+        inputs = generate_inputs(work_dir / "uploads", seed=seed, **scale)
+        generate_s = time.perf_counter() - t0
+        print(f"Generated {inputs['sales_rows']:,} sales rows in {generate_s:.2f}s")
+
+        stages = []
+        failed = None
+        for name, script, params, rows_of, extra_env in pipeline_stages(inputs, quantiles, streaming):
+            if failed:
+                stages.append({"stage": name, "status": "skipped", "message": f"{failed} failed"})
+                continue
+            print(f"Running {name}...")
+            result, wall, cpu, rss = run_stage(script, params, work_dir, work_dir / f"{name}.log", extra_env)
+            rows = rows_of(result) if result.get("status") == "success" else None
+            stage = {
+                "stage": name,
+                "status": result.get("status", "error"),
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3) if cpu is not None else None,
+                "peak_rss_mb": rss,
+                "rows": rows,
+                "rows_per_s": round(rows / wall, 1) if rows and wall > 0 else None,
+            }
+            if stage["status"] != "success":
+                stage["message"] = result.get("message")
+                failed = name
+            print(f"  {name}: {stage['status']} in {wall:.2f}s"
+                  + (f", {stage['rows_per_s']:,} rows/s" if stage["rows_per_s"] else ""))
+            stages.append(stage)
+
+        report = {
+            "status": "success" if not failed else "error",
+            "message": "Benchmark completed" if not failed else f"Stage {failed} failed",
+            "commit": git_commit(root),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scale": dict(scale, seed=seed, series=inputs["series"], sales_rows=inputs["sales_rows"]),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "generate_s": round(generate_s, 3),
+            "stages": stages,
+            "total_wall_s": round(sum(stage.get("wall_s", 0) for stage in stages), 3),
+        }
+        if baseline:
+            report["baseline"] = str(baseline)
+            report["regressions"] = compare(stages, baseline, tolerance)
+
+        output = Path(output) if output else bench_dir / f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        report["report_file"] = str(output)
+        print(f"Report written to {output}")
+
+        if not keep_work_dir and not failed:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(json.dumps(report))
+        return report
+
+    except Exception as e:
+        error_result = {
+            "status": "error",
+            "message": f"Benchmark failed: {str(e)}"
+        }
+        print(json.dumps(error_result))
+        return error_result
+
+
+if __name__ == "__main__":
+    params = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    run_benchmark(
+        params.get('items'),
+        params.get('stores'),
+        params.get('days'),
+        params.get('seed', 42),
+        params.get('quantiles'),
+        params.get('streaming', True),
+        params.get('work_dir'),
+        params.get('output'),
+        params.get('baseline'),
+        params.get('tolerance', REGRESSION_TOLERANCE),
+        params.get('keep_work_dir', False)
+    )
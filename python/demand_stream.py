@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Single-pass demand aggregation over predictions.csv.
+
+The file is read lazily with the csv module and only running totals per
+store are kept, so memory stays constant however many prediction rows
+there are. Uses the standard library only, so route_simple.py can rely on
+it without pandas.
+"""
+
+import csv
+import heapq
+
+DEMAND_COLUMNS = ("predicted_demand", "prediction")
+
+
+def store_from_id(series_id):
+    """Store of an M5 series id such as HOBBIES_1_001_CA_1_validation"""
+    parts = series_id.split("_")
+    return "_".join(parts[3:5]) if len(parts) >= 5 else None
+
+
+def state_of(store_id):
+    return store_id.split("_")[0][:2]
+
+
+def aggregate_demand(preds_file, start_date=None, end_date=None):
+    """Predicted demand totals per store and state.
+
+    Rows are kept when their date falls within [start_date, end_date]
+    (ISO yyyy-mm-dd strings, either bound optional). Returns a dict with
+    store_totals, state_totals, the demand column used and row counts.
+    """
+    store_totals = {}
+    rows = 0
+    rows_in_window = 0
+
+    with open(preds_file, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("Predictions file is empty")
+
+        demand_col = next((col for col in DEMAND_COLUMNS if col in header), None)
+        if demand_col is None:
+            raise ValueError(f"No demand column found. Available columns: {header}")
+        demand_idx = header.index(demand_col)
+
+        if "store_id" in header:
+            store_idx, store_of = header.index("store_id"), None
+        elif "id" in header:
+            store_idx, store_of = header.index("id"), store_from_id
+        else:
+            raise ValueError(f"Required columns not found. Header: {header}")
+
+        date_idx = header.index("date") if "date" in header else None
+        filter_dates = date_idx is not None and (start_date or end_date)
+        start = str(start_date)[:10] if start_date else None
+        end = str(end_date)[:10] if end_date else None
+        width = max(demand_idx, store_idx, date_idx or 0)
+
+        for parts in reader:
+            rows += 1
+            if len(parts) <= width:
+                continue
+            if filter_dates:
+                # ISO dates compare correctly as strings
+                day = parts[date_idx][:10]
+                if (start and day < start) or (end and day > end):
+                    continue
+            try:
+                demand = float(parts[demand_idx])
+            except ValueError:
+                continue
+            store = parts[store_idx] if store_of is None else store_of(parts[store_idx])
+            if store is None:
+                continue
+            store_totals[store] = store_totals.get(store, 0.0) + demand
+            rows_in_window += 1
+
+    state_totals = {}
+    for store, total in store_totals.items():
+        state = state_of(store)
+        state_totals[state] = state_totals.get(state, 0.0) + total
+
+    return {
+        "store_totals": store_totals,
+        "state_totals": state_totals,
+        "demand_col": demand_col,
+        "rows": rows,
+        "rows_in_window": rows_in_window,
+    }
+
+
+def top_stores(store_totals, n, threshold=None):
+    """The n stores with the highest demand at or above threshold"""
+    candidates = (
+        (store, total) for store, total in store_totals.items()
+        if threshold is None or total >= threshold
+    )
+    return heapq.nlargest(n, candidates, key=lambda item: item[1])
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped training matrix built from the processed dataset.
+
+Preprocessing writes the model inputs once, as .npy files in
+python/data/processed/matrix:
+
+    features.npy     float32 (rows, features): BASE_FEATURES + engine features
+    labels.npy       float32 (rows,): demand
+    days.npy         sorted distinct dates (datetime64[D])
+    day_offsets.npy  first row of each day, then the total row count
+    group_daily.npz  store/category mean series, for the forecast context
+    meta.json        feature names and the processed-data fingerprint
+
+Rows are day-major: all rows of a day are contiguous and days are in
+order, so any date range, and in particular the time-based train and
+validation split, is a zero-copy slice of the memory map. The matrix is
+filled one store/category partition at a time (series never span
+partitions), so building it holds one partition in memory rather than the
+whole dataset. A matrix whose fingerprint or feature list no longer
+matches is rebuilt by ensure_feature_matrix().
+
+Because rows are day-major, days added to the same series go at the end:
+append_feature_matrix() computes their features from the last
+context_length() days and appends them to the files in place.
+"""
+
+import io
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from features import build_features, context_length, feature_names as engine_feature_names
+from storage import (PROCESSED_DATASET, atomic_path, list_partitions, parquet_available,
+                     processed_fingerprint, read_processed)
+
+MATRIX_DIR = "matrix"
+META_FILE = "meta.json"
+GROUP_DAILY_FILE = "group_daily.npz"
+
+BASE_FEATURES = ["sell_price", "weekday", "month", "year"]
+TARGET_COL = "demand"
+MATRIX_COLUMNS = ["id", "store_id", "cat_id", "date", "sell_price", "demand"]
+
+
+def matrix_dir(data_dir):
+    return Path(data_dir) / MATRIX_DIR
+
+
+def feature_columns():
+    """Model inputs, in matrix column order"""
+    return BASE_FEATURES + engine_feature_names()
+
+
+def partition_filters(data_dir):
+    """read_processed() filters covering the dataset one partition at a time"""
+    if parquet_available() and (Path(data_dir) / PROCESSED_DATASET).exists():
+        return [
+            {"stores": [store], "categories": [category]}
+            for store, categories in list_partitions(data_dir).items()
+            for category in categories
+        ]
+    # The CSV fallback is read whole either way
+    return [{}]
+
+
+def encode_rows(df):
+    """Processed rows with a label, sorted day-major, plus the date features"""
+    df = df[df[TARGET_COL].notnull()]
+    df = df.sort_values(["date", "id"], kind="stable").reset_index(drop=True)
+    df["sell_price"] = df["sell_price"].fillna(0)
+    df["weekday"] = df["date"].dt.weekday
+    df["month"] = df["date"].dt.month
+    df["year"] = df["date"].dt.year
+    return df
+
+
+def group_means(df):
+    """Store/category mean demand and price per day"""
+    group_daily = df.groupby(["store_id", "cat_id", "date"], observed=True).agg(
+        demand=("demand", "mean"),
+        sell_price=("sell_price", "mean"),
+    ).reset_index()
+    group_daily["store_id"] = group_daily["store_id"].astype(str)
+    group_daily["cat_id"] = group_daily["cat_id"].astype(str)
+    return group_daily
+
+
+def day_slice(days, day_offsets, start=None, end=None):
+    """Rows of the days in [start, end] (either end open when None)"""
+    first = 0 if start is None else np.searchsorted(days, np.datetime64(start, "D"), side="left")
+    last = len(days) if end is None else np.searchsorted(days, np.datetime64(end, "D"), side="right")
+    return slice(int(day_offsets[first]), int(day_offsets[max(first, last)]))
+
+
+def build_feature_matrix(data_dir):
+    """Write the memory-mapped matrix for the processed dataset in data_dir.
+
+    A first pass counts labelled rows per partition and day to lay out the
+    file; the second computes each partition's features and writes them
+    to their rows. Returns the matrix metadata.
+    """
+    data_dir = Path(data_dir)
+    out_dir = matrix_dir(data_dir)
+    fingerprint = processed_fingerprint(data_dir)
+    # Without meta.json a half-written matrix is never treated as current
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+
+    filters = partition_filters(data_dir)
+    day_counts = []
+    for partition in filters:
+        rows = read_processed(data_dir, columns=["date", TARGET_COL], **partition)
+        day_counts.append(rows.loc[rows[TARGET_COL].notnull(), "date"].value_counts())
+    days = np.array(sorted(set().union(*(counts.index for counts in day_counts))), dtype="datetime64[D]")
+    if len(days) == 0:
+        raise ValueError("No labelled rows in processed data")
+
+    counts = np.array([
+        counts.reindex(pd.DatetimeIndex(days), fill_value=0).to_numpy() for counts in day_counts
+    ], dtype=np.int64)
+    day_offsets = np.concatenate([[0], np.cumsum(counts.sum(axis=0))])
+    # Where each partition's rows start within each day
+    partition_starts = day_offsets[:-1] + np.cumsum(counts, axis=0) - counts
+
+    columns = feature_columns()
+    n_rows = int(day_offsets[-1])
+    features = np.lib.format.open_memmap(out_dir / "features.npy", mode="w+", dtype=np.float32,
+                                         shape=(n_rows, len(columns)))
+    labels = np.lib.format.open_memmap(out_dir / "labels.npy", mode="w+", dtype=np.float32,
+                                       shape=(n_rows,))
+
+    group_frames = []
+    for p, partition in enumerate(filters):
+        df = read_processed(data_dir, columns=MATRIX_COLUMNS, **partition)
+        df = encode_rows(df)
+        if len(df) == 0:
+            continue
+        engine_X, _ = build_features(df)
+
+        day_idx = np.searchsorted(days, df["date"].to_numpy().astype("datetime64[D]"))
+        rank_in_day = np.arange(len(df)) - np.searchsorted(day_idx, day_idx, side="left")
+        rows = partition_starts[p, day_idx] + rank_in_day
+        features[rows, :len(BASE_FEATURES)] = df[BASE_FEATURES].to_numpy(dtype=np.float32)
+        features[rows, len(BASE_FEATURES):] = engine_X
+        labels[rows] = df[TARGET_COL].to_numpy(dtype=np.float32)
+        group_frames.append(group_means(df))
+        print(f"Feature matrix: partition {p + 1}/{len(filters)}, {len(df):,} rows")
+
+    features.flush()
+    labels.flush()
+    del features, labels
+    np.save(out_dir / "days.npy", days)
+    np.save(out_dir / "day_offsets.npy", day_offsets)
+
+    group_daily = pd.concat(group_frames, ignore_index=True)
+    np.savez(out_dir / GROUP_DAILY_FILE,
+             store_id=group_daily["store_id"].to_numpy(dtype=str),
+             cat_id=group_daily["cat_id"].to_numpy(dtype=str),
+             date=group_daily["date"].to_numpy().astype("datetime64[D]"),
+             demand=group_daily["demand"].to_numpy(dtype=np.float64),
+             sell_price=group_daily["sell_price"].to_numpy(dtype=np.float64))
+
+    meta = {
+        "fingerprint": fingerprint,
+        "feature_cols": columns,
+        "rows": n_rows,
+        "days": len(days),
+        "first_day": str(days[0]),
+        "last_day": str(days[-1]),
+    }
+    with atomic_path(out_dir / META_FILE) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+    print(f"Feature matrix written: {n_rows:,} rows x {len(columns)} features over {len(days)} days")
+    return meta
+
+
+def append_npy_rows(path, rows):
+    """Append rows to a C-ordered .npy file in place and update the shape in its header.
+
+    Returns False, leaving the file alone, when the header has no room for
+    the new shape (numpy before 1.24 writes no padding for it).
+    """
+    with open(path, "r+b") as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            return False
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_offset = f.tell()
+        if fortran_order or dtype != rows.dtype or shape[1:] != rows.shape[1:]:
+            return False
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (shape[0] + len(rows),) + shape[1:],
+        })
+        if len(header.getvalue()) != data_offset:
+            return False
+        f.seek(data_offset + shape[0] * rows[:1].nbytes)
+        f.write(np.ascontiguousarray(rows).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def append_feature_matrix(data_dir, first_day, base_fingerprint):
+    """Extend the matrix with the processed rows dated first_day or later.
+
+    Valid when the only rows added since the matrix was built (for
+    `base_fingerprint`) are those days of the series it already holds;
+    the caller rebuilds otherwise. Features of the new rows are computed
+    from their last context_length() days of history. Returns the updated
+    metadata, or None when the existing matrix cannot be extended.
+    """
+    data_dir = Path(data_dir)
+    out_dir = matrix_dir(data_dir)
+    try:
+        with open(out_dir / META_FILE, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    first_day = np.datetime64(pd.Timestamp(first_day).date(), "D")
+    if (meta.get("fingerprint") != base_fingerprint or meta.get("feature_cols") != feature_columns()
+            or np.datetime64(meta["last_day"], "D") >= first_day):
+        return None
+
+    columns = feature_columns()
+    window_start = pd.Timestamp(first_day) - pd.Timedelta(days=context_length())
+    partitions = []
+    for partition in partition_filters(data_dir):
+        df = read_processed(data_dir, columns=MATRIX_COLUMNS, start_date=window_start, **partition)
+        df = encode_rows(df)
+        engine_X, _ = build_features(df)
+        new = (df["date"].to_numpy().astype("datetime64[D]") >= first_day)
+        partitions.append((df[new].reset_index(drop=True), engine_X[new]))
+
+    dates = [df["date"].to_numpy().astype("datetime64[D]") for df, _ in partitions]
+    new_days = np.unique(np.concatenate(dates))
+    if len(new_days) == 0:
+        return None
+    counts = np.array([np.bincount(np.searchsorted(new_days, d), minlength=len(new_days)) for d in dates],
+                      dtype=np.int64)
+    day_offsets = np.concatenate([[0], np.cumsum(counts.sum(axis=0))])
+    partition_starts = day_offsets[:-1] + np.cumsum(counts, axis=0) - counts
+
+    n_rows = int(day_offsets[-1])
+    features = np.empty((n_rows, len(columns)), dtype=np.float32)
+    labels = np.empty(n_rows, dtype=np.float32)
+    group_frames = []
+    for p, (df, engine_X) in enumerate(partitions):
+        if len(df) == 0:
+            continue
+        day_idx = np.searchsorted(new_days, dates[p])
+        rank_in_day = np.arange(len(df)) - np.searchsorted(day_idx, day_idx, side="left")
+        rows = partition_starts[p, day_idx] + rank_in_day
+        features[rows, :len(BASE_FEATURES)] = df[BASE_FEATURES].to_numpy(dtype=np.float32)
+        features[rows, len(BASE_FEATURES):] = engine_X
+        labels[rows] = df[TARGET_COL].to_numpy(dtype=np.float32)
+        group_frames.append(group_means(df))
+
+    # Without meta.json a half-appended matrix is never treated as current
+    (out_dir / META_FILE).unlink()
+    if not append_npy_rows(out_dir / "features.npy", features) or \
+            not append_npy_rows(out_dir / "labels.npy", labels):
+        return None
+
+    days = np.concatenate([np.load(out_dir / "days.npy"), new_days])
+    old_offsets = np.load(out_dir / "day_offsets.npy")
+    np.save(out_dir / "days.npy", days)
+    np.save(out_dir / "day_offsets.npy", np.concatenate([old_offsets, old_offsets[-1] + day_offsets[1:]]))
+
+    with np.load(out_dir / GROUP_DAILY_FILE, allow_pickle=False) as group:
+        group_daily = {name: group[name] for name in group.files}
+    new_group = pd.concat(group_frames, ignore_index=True)
+    np.savez(out_dir / GROUP_DAILY_FILE,
+             store_id=np.concatenate([group_daily["store_id"], new_group["store_id"].to_numpy(dtype=str)]),
+             cat_id=np.concatenate([group_daily["cat_id"], new_group["cat_id"].to_numpy(dtype=str)]),
+             date=np.concatenate([group_daily["date"], new_group["date"].to_numpy().astype("datetime64[D]")]),
+             demand=np.concatenate([group_daily["demand"], new_group["demand"].to_numpy(dtype=np.float64)]),
+             sell_price=np.concatenate([group_daily["sell_price"],
+                                        new_group["sell_price"].to_numpy(dtype=np.float64)]))
+
+    meta = dict(meta, fingerprint=processed_fingerprint(data_dir), rows=meta["rows"] + n_rows,
+                days=len(days), last_day=str(days[-1]))
+    with atomic_path(out_dir / META_FILE) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+    print(f"Feature matrix extended: {n_rows:,} rows over {len(new_days)} new days")
+    return dict(meta, rows_added=n_rows)
+
+
+def load_feature_matrix(data_dir):
+    """Memory-mapped matrix for the current processed data (None if missing or stale)"""
+    data_dir = Path(data_dir)
+    out_dir = matrix_dir(data_dir)
+    try:
+        with open(out_dir / META_FILE, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("fingerprint") != processed_fingerprint(data_dir) or meta.get("feature_cols") != feature_columns():
+        return None
+
+    with np.load(out_dir / GROUP_DAILY_FILE, allow_pickle=False) as group:
+        group_daily = pd.DataFrame({name: group[name] for name in group.files})
+    group_daily["date"] = pd.to_datetime(group_daily["date"])
+    return {
+        "X": np.load(out_dir / "features.npy", mmap_mode="r"),
+        "y": np.load(out_dir / "labels.npy", mmap_mode="r"),
+        "days": np.load(out_dir / "days.npy"),
+        "day_offsets": np.load(out_dir / "day_offsets.npy"),
+        "feature_cols": meta["feature_cols"],
+        "group_daily": group_daily,
+    }
+
+
+def ensure_feature_matrix(data_dir):
+    """Current matrix for data_dir, rebuilding it first if needed"""
+    matrix = load_feature_matrix(data_dir)
+    if matrix is None:
+        print("Feature matrix missing or out of date, rebuilding...")
+        build_feature_matrix(data_dir)
+        matrix = load_feature_matrix(data_dir)
+    return matrix
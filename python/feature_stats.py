@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Precomputed per-store/per-category statistics for prediction.
+
+Preprocessing writes feature_stats.json next to the processed dataset,
+tagged with the dataset fingerprint. Prediction reads this sidecar rather
+than scanning the processed rows. If the fingerprint no longer matches
+(e.g. preprocessing ran again) the statistics are rebuilt from the dataset.
+
+The summed aggregates behind the statistics, and each item/store's price
+totals, are kept in feature_stats_totals.npz so an incremental
+preprocessing run can merge in the partials of the rows it appends.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import atomic_path, processed_fingerprint, read_processed
+
+STATS_FILE = "feature_stats.json"
+TOTALS_FILE = "feature_stats_totals.npz"
+
+# Price relative to the item's mean price in its store, used for elasticity buckets
+PRICE_BUCKET_EDGES = [0.9, 1.0, 1.1]
+PRICE_BUCKET_LABELS = ["<0.9", "0.9-1.0", "1.0-1.1", ">=1.1"]
+UNPRICED_BUCKET = "unpriced"
+
+STATS_COLUMNS = ["item_id", "store_id", "cat_id", "sell_price", "demand"]
+
+
+def partial_stats(df, prior_prices=None):
+    """Additive aggregates for one frame of processed rows.
+
+    Frames must contain complete item/store series (as preprocessing chunks
+    do) so relative prices are computed against the right item mean, unless
+    `prior_prices` holds the item_price_totals() of the series' earlier
+    rows: the mean then covers both, and the earlier rows keep the buckets
+    they were counted in. Partials from several frames are merged with
+    combine_partials().
+    """
+    df = df[STATS_COLUMNS].copy()
+    for col in ["item_id", "store_id", "cat_id"]:
+        df[col] = df[col].astype(str)
+    df["sell_price"] = df["sell_price"].fillna(0).astype("float64")
+    df["demand"] = df["demand"].astype("float64")
+
+    priced = df["sell_price"] > 0
+    item_prices = df["sell_price"].where(priced).groupby([df["store_id"], df["item_id"]])
+    if prior_prices is None:
+        item_mean_price = item_prices.transform("mean")
+    else:
+        prior = prior_prices.reindex(pd.MultiIndex.from_arrays([df["store_id"], df["item_id"]])).fillna(0)
+        price_sum = item_prices.transform("sum") + prior["price_sum"].to_numpy()
+        price_rows = item_prices.transform("count") + prior["priced_rows"].to_numpy()
+        item_mean_price = price_sum / price_rows.where(price_rows > 0)
+    # Rounded so a constant price lands on 1.0 whatever the summation order
+    ratio = (df["sell_price"] / item_mean_price).round(9)
+    bucket_idx = np.searchsorted(PRICE_BUCKET_EDGES, ratio.fillna(1.0).to_numpy(), side="right")
+    df["price_bucket"] = np.where(
+        priced.to_numpy(),
+        np.asarray(PRICE_BUCKET_LABELS, dtype=object)[bucket_idx],
+        UNPRICED_BUCKET,
+    )
+
+    return df.groupby(["store_id", "cat_id", "price_bucket"]).agg(
+        rows=("demand", "size"),
+        price_sum=("sell_price", "sum"),
+        demand_sum=("demand", "sum"),
+        demand_max=("demand", "max"),
+    )
+
+
+def combine_partials(partials):
+    """Merge partial_stats() results from several frames"""
+    partials = [p for p in partials if p is not None and len(p) > 0]
+    if not partials:
+        return None
+    combined = pd.concat(partials)
+    return combined.groupby(level=[0, 1, 2]).agg(
+        rows=("rows", "sum"),
+        price_sum=("price_sum", "sum"),
+        demand_sum=("demand_sum", "sum"),
+        demand_max=("demand_max", "max"),
+    )
+
+
+def item_price_totals(df):
+    """Sum and count of each item/store's prices over its priced rows"""
+    price = df["sell_price"].fillna(0).astype("float64")
+    priced = price > 0
+    totals = pd.DataFrame({
+        "price_sum": price.where(priced, 0.0),
+        "priced_rows": priced.astype("int64"),
+    })
+    return totals.groupby([df["store_id"].astype(str), df["item_id"].astype(str)]).sum()
+
+
+def combine_price_totals(totals):
+    """Merge item_price_totals() results from several frames"""
+    totals = [t for t in totals if t is not None and len(t) > 0]
+    if not totals:
+        return None
+    return pd.concat(totals).groupby(level=[0, 1]).sum()
+
+
+def summarize(totals):
+    """Turn summed aggregates into the mean price / demand figures pred.py uses"""
+    rows = float(totals["rows"].sum())
+    if rows == 0:
+        return {"avg_sell_price": 10.0, "demand_mean": 0.0, "demand_max": 0.0, "rows": 0}
+    return {
+        "avg_sell_price": float(totals["price_sum"].sum() / rows),
+        "demand_mean": float(totals["demand_sum"].sum() / rows),
+        "demand_max": float(totals["demand_max"].max()),
+        "rows": int(rows),
+    }
+
+
+def build_stats(aggregates):
+    """Nested statistics dict: overall, per store, per category and per store/category"""
+    stats = {"overall": summarize(aggregates), "stores": {}, "categories": {}, "groups": {}}
+
+    for store, totals in aggregates.groupby(level=0):
+        stats["stores"][store] = summarize(totals)
+    for category, totals in aggregates.groupby(level=1):
+        stats["categories"][category] = summarize(totals)
+    for (store, category), totals in aggregates.groupby(level=[0, 1]):
+        group = summarize(totals)
+        buckets = {}
+        for bucket, bucket_totals in totals.groupby(level=2):
+            bucket_summary = summarize(bucket_totals)
+            buckets[bucket] = {
+                "rows": bucket_summary["rows"],
+                "demand_mean": bucket_summary["demand_mean"],
+            }
+        group["price_buckets"] = buckets
+        stats["groups"][f"{store}|{category}"] = group
+
+    return stats
+
+
+def write_feature_stats(data_dir, aggregates, price_totals=None):
+    """Write the sidecar for the dataset currently in data_dir.
+
+    With `price_totals`, the aggregates are kept as well for load_stats_totals().
+    """
+    data_dir = Path(data_dir)
+    stats = build_stats(aggregates)
+    stats["fingerprint"] = processed_fingerprint(data_dir)
+    with atomic_path(data_dir / STATS_FILE) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(stats, f)
+    if price_totals is not None:
+        save_stats_totals(data_dir, aggregates, price_totals, stats["fingerprint"])
+    return stats
+
+
+def save_stats_totals(data_dir, aggregates, price_totals, fingerprint):
+    """Keep the summed aggregates and item price totals behind the sidecar"""
+    with atomic_path(Path(data_dir) / TOTALS_FILE) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                fingerprint=np.array(fingerprint or "", dtype=str),
+                **{f"group_{name}": aggregates.index.get_level_values(level).to_numpy(dtype=str)
+                   for level, name in enumerate(["store_id", "cat_id", "price_bucket"])},
+                **{f"group_{col}": aggregates[col].to_numpy(dtype=np.float64) for col in aggregates.columns},
+                item_store_id=price_totals.index.get_level_values(0).to_numpy(dtype=str),
+                item_item_id=price_totals.index.get_level_values(1).to_numpy(dtype=str),
+                item_price_sum=price_totals["price_sum"].to_numpy(dtype=np.float64),
+                item_priced_rows=price_totals["priced_rows"].to_numpy(dtype=np.int64),
+            )
+
+
+def load_stats_totals(data_dir):
+    """(aggregates, price_totals) saved for the current dataset, or None if missing or stale"""
+    data_dir = Path(data_dir)
+    try:
+        with np.load(data_dir / TOTALS_FILE, allow_pickle=False) as totals:
+            totals = {name: totals[name] for name in totals.files}
+    except (OSError, ValueError):
+        return None
+    if str(totals["fingerprint"]) != processed_fingerprint(data_dir):
+        return None
+
+    aggregates = pd.DataFrame(
+        {col: totals[f"group_{col}"] for col in ["rows", "price_sum", "demand_sum", "demand_max"]},
+        index=pd.MultiIndex.from_arrays(
+            [totals["group_store_id"], totals["group_cat_id"], totals["group_price_bucket"]],
+            names=["store_id", "cat_id", "price_bucket"],
+        ),
+    )
+    aggregates["rows"] = aggregates["rows"].astype(np.int64)
+    price_totals = pd.DataFrame(
+        {"price_sum": totals["item_price_sum"], "priced_rows": totals["item_priced_rows"]},
+        index=pd.MultiIndex.from_arrays([totals["item_store_id"], totals["item_item_id"]],
+                                        names=["store_id", "item_id"]),
+    )
+    return aggregates, price_totals
+
+
+def compute_feature_stats(data_dir):
+    """Rebuild the sidecar by scanning the processed dataset"""
+    df = read_processed(data_dir, columns=STATS_COLUMNS)
+    return write_feature_stats(data_dir, partial_stats(df), item_price_totals(df))
+
+
+def load_feature_stats(data_dir):
+    """Sidecar statistics for the current dataset, rebuilding them if stale.
+
+    Returns None when no processed data exists.
+    """
+    data_dir = Path(data_dir)
+    fingerprint = processed_fingerprint(data_dir)
+    if fingerprint is None:
+        return None
+
+    stats_file = data_dir / STATS_FILE
+    if stats_file.exists():
+        with open(stats_file, "r") as f:
+            stats = json.load(f)
+        if stats.get("fingerprint") == fingerprint:
+            return stats
+
+    print("Feature statistics missing or stale, rebuilding...")
+    return compute_feature_stats(data_dir)
+
+
+def lookup_stats(stats, store=None, category=None):
+    """Most specific statistics available for a store/category"""
+    group = stats["groups"].get(f"{store}|{category}")
+    if group is not None:
+        return group
+    if store in stats["stores"]:
+        return stats["stores"][store]
+    if category in stats["categories"]:
+        return stats["categories"][category]
+    return stats["overall"]
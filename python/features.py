@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Lag, rolling-window and price features for demand series.
+
+Series are laid out as 2D arrays of shape (n_series, n_days), one row per
+series in date order, so every feature is a column shift or a cumulative
+sum along axis 1. Missing days are NaN and propagate as missing features,
+which LightGBM handles natively.
+
+Only the last context_length() days of a series are needed to compute
+features for the days that follow, so new days can be added with
+extend_features() without recomputing history.
+"""
+
+import numpy as np
+import pandas as pd
+
+from storage import atomic_path
+
+DEMAND_LAGS = (7, 28)
+ROLLING_WINDOWS = (7, 28)
+# Rolling statistics are taken over demand this many days back so they are
+# known for the whole 28-day forecast horizon
+ROLLING_SHIFT = 28
+PRICE_WINDOW = 28
+
+
+def feature_names():
+    """Names of the engine features, in output order"""
+    names = [f"lag_{lag}" for lag in DEMAND_LAGS]
+    names += [f"rmean_{ROLLING_SHIFT}_{window}" for window in ROLLING_WINDOWS]
+    names += [f"rstd_{ROLLING_SHIFT}_{window}" for window in ROLLING_WINDOWS]
+    names += ["price_change", f"price_rel_{PRICE_WINDOW}"]
+    return names
+
+
+def context_length():
+    """Days of history needed to compute features for the following day"""
+    return max(max(DEMAND_LAGS), ROLLING_SHIFT + max(ROLLING_WINDOWS), PRICE_WINDOW)
+
+
+def shift(values, periods):
+    """Shift each series right by `periods` days, filling with NaN"""
+    out = np.full(values.shape, np.nan, dtype=np.float32)
+    if periods < values.shape[1]:
+        out[:, periods:] = values[:, :values.shape[1] - periods]
+    return out
+
+
+def rolling_sum(values, window):
+    """Trailing window sums and non-missing counts along each series"""
+    present = ~np.isnan(values)
+    csum = np.cumsum(np.where(present, values, 0), axis=1, dtype=np.float64)
+    ccount = np.cumsum(present, axis=1, dtype=np.int32)
+    sums = csum.copy()
+    counts = ccount.copy()
+    sums[:, window:] -= csum[:, :-window]
+    counts[:, window:] -= ccount[:, :-window]
+    return sums, counts
+
+
+def rolling_mean_std(values, window):
+    """Trailing mean and std over full windows (NaN if any day is missing)"""
+    sums, counts = rolling_sum(values, window)
+    squares, _ = rolling_sum(values.astype(np.float64) ** 2, window)
+    full = counts == window
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / window
+        var = np.maximum(squares / window - mean ** 2, 0)
+    mean = np.where(full, mean, np.nan).astype(np.float32)
+    std = np.where(full, np.sqrt(var), np.nan).astype(np.float32)
+    return mean, std
+
+
+def compute_features(demand, price):
+    """Feature arrays for (n_series, n_days) demand and price arrays.
+
+    Returns a dict of name -> float32 array with the same shape.
+    """
+    demand = np.asarray(demand, dtype=np.float32)
+    price = np.asarray(price, dtype=np.float32)
+    features = {}
+
+    for lag in DEMAND_LAGS:
+        features[f"lag_{lag}"] = shift(demand, lag)
+
+    shifted = shift(demand, ROLLING_SHIFT)
+    for window in ROLLING_WINDOWS:
+        mean, std = rolling_mean_std(shifted, window)
+        features[f"rmean_{ROLLING_SHIFT}_{window}"] = mean
+        features[f"rstd_{ROLLING_SHIFT}_{window}"] = std
+
+    # Zero prices mean the item was not on sale, treat them as missing
+    priced = np.where(price > 0, price, np.nan)
+    previous = shift(priced, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        features["price_change"] = (priced / previous - 1).astype(np.float32)
+        price_sums, price_counts = rolling_sum(priced, PRICE_WINDOW)
+        features[f"price_rel_{PRICE_WINDOW}"] = (
+            priced / (price_sums / price_counts)
+        ).astype(np.float32)
+
+    return {name: features[name] for name in feature_names()}
+
+
+def series_layout(series_keys, dates):
+    """Row positions of long-format records in the (n_series, n_days) layout.
+
+    Returns (series_idx, day_idx, unique series keys, sorted unique dates).
+    """
+    series_idx, keys = pd.factorize(np.asarray(series_keys), sort=True)
+    day_values = np.unique(np.asarray(dates))
+    day_idx = np.searchsorted(day_values, np.asarray(dates))
+    return series_idx, day_idx, keys, day_values
+
+
+def to_matrix(values, series_idx, day_idx, shape):
+    """Scatter long-format values into a NaN-filled (n_series, n_days) array"""
+    matrix = np.full(shape, np.nan, dtype=np.float32)
+    matrix[series_idx, day_idx] = values
+    return matrix
+
+
+def build_features(df, series_col="id"):
+    """Engine features for every row of a long frame.
+
+    `df` needs series_col, date, demand and sell_price columns. Returns a
+    float32 array of shape (len(df), n_features) aligned with df rows,
+    ready to pass to lgb.Dataset, and the state for extend_features().
+    """
+    series_idx, day_idx, keys, day_values = series_layout(df[series_col], df["date"])
+    shape = (len(keys), len(day_values))
+    demand = to_matrix(df["demand"].to_numpy(), series_idx, day_idx, shape)
+    price = to_matrix(df["sell_price"].to_numpy(), series_idx, day_idx, shape)
+
+    names = feature_names()
+    out = np.empty((len(df), len(names)), dtype=np.float32)
+    features = compute_features(demand, price)
+    for col, name in enumerate(names):
+        out[:, col] = features[name][series_idx, day_idx]
+
+    state = make_state(keys, day_values[-1], demand, price)
+    return out, state
+
+
+def make_state(keys, last_date, demand, price):
+    """Keep the trailing context of each series for incremental updates"""
+    context = context_length()
+    return {
+        "keys": np.asarray(keys, dtype=str),
+        "last_date": np.datetime64(pd.Timestamp(last_date), "D"),
+        "demand": pad_context(demand, context),
+        "price": pad_context(price, context),
+    }
+
+
+def pad_context(values, context):
+    """Last `context` days of each series, NaN-padded on the left if shorter"""
+    values = np.asarray(values, dtype=np.float32)
+    if values.shape[1] >= context:
+        return values[:, -context:].copy()
+    out = np.full((values.shape[0], context), np.nan, dtype=np.float32)
+    out[:, context - values.shape[1]:] = values
+    return out
+
+
+def align_state(state, keys):
+    """Context rows for the given series keys (NaN for unseen series)"""
+    keys = np.asarray(keys, dtype=str)
+    context = state["demand"].shape[1]
+    demand = np.full((len(keys), context), np.nan, dtype=np.float32)
+    price = np.full((len(keys), context), np.nan, dtype=np.float32)
+    positions = pd.Index(state["keys"]).get_indexer(keys)
+    known = positions >= 0
+    demand[known] = state["demand"][positions[known]]
+    price[known] = state["price"][positions[known]]
+    return demand, price
+
+
+def extend_features(state, keys, new_demand, new_price):
+    """Features for newly appended days using only the stored context.
+
+    `new_demand` and `new_price` have shape (len(keys), n_new_days) and
+    cover the days right after state["last_date"]. Returns the feature
+    dict for the new days and the updated state.
+    """
+    new_demand = np.asarray(new_demand, dtype=np.float32)
+    new_price = np.asarray(new_price, dtype=np.float32)
+    context_demand, context_price = align_state(state, keys)
+    n_context = context_demand.shape[1]
+
+    demand = np.hstack([context_demand, new_demand])
+    price = np.hstack([context_price, new_price])
+    features = {
+        name: values[:, n_context:]
+        for name, values in compute_features(demand, price).items()
+    }
+
+    last_date = state["last_date"] + np.timedelta64(new_demand.shape[1], "D")
+    return features, make_state(keys, last_date, demand, price)
+
+
+def forecast_features(state, keys, horizon, future_price=None):
+    """Features for the `horizon` days after the stored history.
+
+    Future demand is unknown, so lags reaching into the forecast window are
+    NaN. `future_price` (len(keys),) or (len(keys), horizon) defaults to the
+    last known price. Returns name -> (len(keys), horizon) arrays.
+    """
+    _, context_price = align_state(state, keys)
+    if future_price is None:
+        last_price = pd.DataFrame(context_price).ffill(axis=1).iloc[:, -1].to_numpy()
+        future_price = last_price
+    future_price = np.broadcast_to(
+        np.asarray(future_price, dtype=np.float32).reshape(len(keys), -1),
+        (len(keys), horizon),
+    )
+    future_demand = np.full((len(keys), horizon), np.nan, dtype=np.float32)
+    features, _ = extend_features(state, keys, future_demand, future_price)
+    return features
+
+
+def save_state(path, state):
+    """Persist feature context to an .npz file"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **state)
+
+
+def load_state(path):
+    """Load feature context saved with save_state() (None if missing)"""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
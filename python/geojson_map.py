@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Compact GeoJSON output for route maps.
+
+Instead of a full folium page per run, route.py can write the stops and
+vehicle routes as one GeoJSON FeatureCollection. Route lines are
+simplified with Douglas-Peucker and coordinates are rounded, with the
+tolerance raised as needed to keep each line under a point budget, so the
+file stays small however long the routes are. A static HTML shell
+(route_map.html) loads the GeoJSON from /api/map/geojson and draws it
+with Leaflet.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from storage import atomic_path
+
+GEOJSON_FILE = "route.geojson"
+SHELL_FILE = "route_map.html"
+
+SIMPLIFY_TOLERANCE_M = 50.0
+COORD_DECIMALS = 5
+MAX_POINTS_PER_ROUTE = 1000
+ROUTE_COLORS = ["blue", "purple", "orange", "darkred", "cadetblue", "darkgreen"]
+
+METERS_PER_DEGREE = 111320.0
+
+
+def project(points):
+    """Equirectangular projection of (lat, lon) points to metres"""
+    points = np.asarray(points, dtype=np.float64)
+    mean_lat = np.radians(points[:, 0].mean())
+    return np.column_stack([
+        points[:, 1] * METERS_PER_DEGREE * np.cos(mean_lat),
+        points[:, 0] * METERS_PER_DEGREE,
+    ])
+
+
+def douglas_peucker(points, tolerance_m):
+    """Indices of the points kept when simplifying a line to tolerance_m"""
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+    xy = project(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        inner = xy[start + 1:end]
+        segment = b - a
+        length = np.hypot(*segment)
+        if length == 0:
+            dist = np.hypot(*(inner - a).T)
+        else:
+            dist = np.abs(segment[0] * (inner[:, 1] - a[1]) - segment[1] * (inner[:, 0] - a[0])) / length
+        worst = int(np.argmax(dist))
+        if dist[worst] > tolerance_m:
+            split = start + 1 + worst
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_line(points, tolerance_m=SIMPLIFY_TOLERANCE_M, max_points=MAX_POINTS_PER_ROUTE):
+    """Simplified line, doubling the tolerance until it fits max_points"""
+    points = np.asarray(points, dtype=np.float64)
+    kept = douglas_peucker(points, tolerance_m)
+    while len(kept) > max_points:
+        tolerance_m *= 2
+        kept = douglas_peucker(points, tolerance_m)
+    return points[kept]
+
+
+def quantize(points, decimals=COORD_DECIMALS):
+    """[lon, lat] pairs rounded to `decimals`, dropping repeated points"""
+    coords = np.round(np.asarray(points, dtype=np.float64)[:, ::-1], decimals)
+    if len(coords) > 1:
+        repeated = np.all(coords[1:] == coords[:-1], axis=1)
+        coords = coords[np.concatenate([[True], ~repeated])]
+    return coords.tolist()
+
+
+def feature_collection(stops, routes, summary, tolerance_m=SIMPLIFY_TOLERANCE_M,
+                       decimals=COORD_DECIMALS):
+    """FeatureCollection with a point per stop and a line per vehicle route.
+
+    `stops` is a list of dicts with store_id, state, lat and lon; `routes`
+    a list of (lat, lon) geometries, one per vehicle.
+    """
+    features = []
+    for stop in stops:
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [round(float(stop["lon"]), decimals), round(float(stop["lat"]), decimals)],
+            },
+            "properties": {"store_id": stop["store_id"], "state": stop["state"]},
+        })
+
+    points_in, points_out = 0, 0
+    for vehicle, geometry in enumerate(routes):
+        simplified = simplify_line(geometry, tolerance_m)
+        coords = quantize(simplified, decimals)
+        points_in += len(geometry)
+        points_out += len(coords)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coords},
+            "properties": {"vehicle": vehicle + 1, "color": ROUTE_COLORS[vehicle % len(ROUTE_COLORS)]},
+        })
+
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": dict(summary, route_points=points_out, route_points_raw=points_in),
+    }
+
+
+SHELL_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Delivery Route Map</title>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
+    <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
+    <style>
+        #map { height: 100vh; width: 100%; }
+        .route-info {
+            position: absolute;
+            bottom: 50px;
+            left: 50px;
+            background: rgba(255,255,255,0.9);
+            padding: 15px;
+            border: 2px solid #333;
+            border-radius: 8px;
+            z-index: 1000;
+            font-family: Arial, sans-serif;
+        }
+    </style>
+</head>
+<body>
+    <div id="map"></div>
+    <div class="route-info" id="summary"></div>
+    <script>
+        var map = L.map('map', { preferCanvas: true }).setView([39.8283, -98.5795], 4);
+        L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+            attribution: '© OpenStreetMap contributors'
+        }).addTo(map);
+
+        fetch('/api/map/geojson')
+            .then(function(response) { return response.json(); })
+            .then(function(data) {
+                var layer = L.geoJSON(data, {
+                    style: function(feature) {
+                        return { color: feature.properties.color, weight: 5, opacity: 0.8 };
+                    },
+                    pointToLayer: function(feature, latlng) {
+                        return L.circleMarker(latlng, { radius: 5, color: 'red', fillOpacity: 0.9 });
+                    },
+                    onEachFeature: function(feature, featureLayer) {
+                        if (feature.properties.store_id) {
+                            featureLayer.bindTooltip(feature.properties.store_id + ' (' + feature.properties.state + ')');
+                        }
+                    }
+                }).addTo(map);
+                map.fitBounds(layer.getBounds());
+
+                var summary = data.properties || {};
+                document.getElementById('summary').innerHTML =
+                    '<h4 style="margin:0 0 10px 0;">Total Route Summary</h4>' +
+                    '<p style="margin:0;"><strong>Distance:</strong> ' + summary.total_distance + ' km</p>' +
+                    '<p style="margin:0;"><strong>CO₂ Emissions:</strong> ' + summary.co2_emissions + ' kg</p>';
+            });
+    </script>
+</body>
+</html>
+"""
+
+
+def write_geojson_map(data_dir, collection):
+    """Write the GeoJSON and, if missing or outdated, the static HTML shell"""
+    data_dir = Path(data_dir)
+    geojson_path = data_dir / GEOJSON_FILE
+    with atomic_path(geojson_path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(collection, f, separators=(",", ":"))
+
+    shell_path = data_dir / SHELL_FILE
+    if not shell_path.exists() or shell_path.read_text(encoding="utf-8") != SHELL_HTML:
+        with atomic_path(shell_path) as tmp_path:
+            tmp_path.write_text(SHELL_HTML, encoding="utf-8")
+    return geojson_path, shell_path
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Stage-level instrumentation for the pipeline scripts.
+
+    timings = StageTimer("train")
+    with timings.stage("bin") as stage:
+        ...
+        stage.add_rows(len(df))
+    result["timings"] = timings.summary()
+
+Each stage records wall and CPU milliseconds, the change in resident
+memory and the rows it processed. A stage entered several times (once
+per chunk, say) accumulates into one entry. The summary goes into the
+script's final JSON line, where the server logs it.
+
+Setting PIPELINE_PROFILE=1 also runs every stage under cProfile and
+dumps one .prof file per stage to python/data/profiles (inspect with
+`python -m pstats <file>`); the summary lists the files.
+"""
+
+import cProfile
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from storage import project_dir
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux only, None elsewhere)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class StageRecord:
+    """Accumulated measurements of one named stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.ms = 0.0
+        self.cpu_ms = 0.0
+        self.rss_delta_mb = None
+        self.rows = None
+        self.calls = 0
+        self.profile_file = None
+
+    def add_rows(self, rows):
+        self.rows = (self.rows or 0) + int(rows)
+
+    def summary(self):
+        return {
+            "stage": self.name,
+            "ms": round(self.ms, 2),
+            "cpu_ms": round(self.cpu_ms, 2),
+            "rss_delta_mb": round(self.rss_delta_mb, 1) if self.rss_delta_mb is not None else None,
+            "rows": self.rows,
+            "rows_per_s": round(self.rows / (self.ms / 1000), 1) if self.rows and self.ms > 0 else None,
+            "calls": self.calls,
+            "profile": self.profile_file,
+        }
+
+
+class StageTimer:
+    """Named stage timers for one script run"""
+
+    def __init__(self, script, profile=None):
+        self.script = script
+        self.profile = os.environ.get(PROFILE_ENV, "") not in ("", "0") if profile is None else profile
+        self.stages = {}
+        self.profilers = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the with-block as stage `name`; yields its StageRecord"""
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = StageRecord(name)
+        profiler = None
+        if self.profile:
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+
+        rss_before = current_rss_mb()
+        wall_before = time.perf_counter()
+        cpu_before = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed_ms = (time.perf_counter() - wall_before) * 1000
+            record.ms += elapsed_ms
+            record.cpu_ms += (time.process_time() - cpu_before) * 1000
+            record.calls += 1
+            rss_after = current_rss_mb()
+            if rss_before is not None and rss_after is not None:
+                record.rss_delta_mb = (record.rss_delta_mb or 0.0) + rss_after - rss_before
+            if record.calls == 1:
+                print(f"[{self.script}] {name}: {elapsed_ms:.1f} ms")
+
+    def dump_profiles(self):
+        """Write one cProfile file per profiled stage"""
+        if not self.profilers:
+            return
+        profile_dir = project_dir() / "python" / "data" / "profiles"
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for name, profiler in self.profilers.items():
+            path = profile_dir / f"{self.script}-{name}-{stamp}-{os.getpid()}.prof"
+            profiler.dump_stats(str(path))
+            self.stages[name].profile_file = str(path)
+        self.profilers = {}
+
+    def summary(self):
+        """Per-stage measurements for the script's JSON result"""
+        self.dump_profiles()
+        return {
+            "script": self.script,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": [record.summary() for record in self.stages.values()],
+        }
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Integer-indexed calendar and price lookup tables.
+
+Preprocessing builds these once from calendar.csv and sell_prices.csv and
+saves them as lookups.npz next to the processed dataset:
+
+    calendar  one entry per calendar day (d_1 is day 0) for every
+              calendar.csv column, with event names encoded as int8 codes
+    prices    dense float32 array indexed by (item code, store code,
+              week index), NaN where the item was not on sale
+
+Joining a melted sales chunk is then array indexing by day, item and
+store codes instead of a hash merge, and pred.py reads the real price and
+events of any day the calendar covers.
+"""
+
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import atomic_path
+
+LOOKUPS_FILE = "lookups.npz"
+
+EVENT_COLS = ["event_name_1", "event_type_1", "event_name_2", "event_type_2"]
+SMALL_INT_COLS = ["wm_yr_wk", "wday", "month", "year"]
+
+
+class LookupTables:
+    """Calendar columns by day index and prices by (item, store, week) codes"""
+
+    def __init__(self, arrays):
+        self._arrays = arrays
+        self.calendar_columns = [str(col) for col in arrays["calendar_columns"]]
+        self.calendar = {col: arrays[f"cal_{col}"] for col in self.calendar_columns}
+        self.event_names = {
+            col: arrays[f"names_{col}"] for col in EVENT_COLS if f"names_{col}" in arrays
+        }
+        self.day_names = pd.Index(arrays["d"])
+        self.dates = arrays["dates"]
+        self.week_idx = arrays["week_idx"]
+        self.items = pd.Index(arrays["items"])
+        self.item_cats = arrays["item_cats"]
+        self.stores = pd.Index(arrays["stores"])
+        self.prices = arrays["prices"]
+        self._category_prices = {}
+
+    def arrays(self):
+        """Flat name -> array mapping for np.savez"""
+        return self._arrays
+
+    def day_index(self, day_names):
+        """Calendar positions of d_* column names (-1 when not in the calendar)"""
+        return self.day_names.get_indexer(pd.Index(day_names).astype(str))
+
+    def date_index(self, dates):
+        """Calendar positions of dates (-1 outside the calendar)"""
+        offset = (np.asarray(dates, dtype="datetime64[D]") - self.dates[0]).astype(np.int64)
+        return np.where((offset >= 0) & (offset < len(self.dates)), offset, -1)
+
+    def item_codes(self, item_ids):
+        return self.items.get_indexer(pd.Index(item_ids).astype(str))
+
+    def store_codes(self, store_ids):
+        return self.stores.get_indexer(pd.Index(store_ids).astype(str))
+
+    def price(self, item_codes, store_codes, day_idx):
+        """Sell price per (item, store, day) index triple, NaN where unknown"""
+        item_codes, store_codes, day_idx = np.broadcast_arrays(item_codes, store_codes, day_idx)
+        known = (item_codes >= 0) & (store_codes >= 0) & (day_idx >= 0)
+        out = np.full(item_codes.shape, np.nan, dtype=np.float32)
+        out[known] = self.prices[item_codes[known], store_codes[known], self.week_idx[day_idx[known]]]
+        return out
+
+    def category_prices(self, category):
+        """Mean item price of a category per (store code, week index)"""
+        if category not in self._category_prices:
+            items = np.flatnonzero(self.item_cats == category)
+            with warnings.catch_warnings():
+                # Weeks where no item of the category was on sale stay NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                means = np.nanmean(self.prices[items], axis=0) if len(items) else None
+            self._category_prices[category] = means
+        return self._category_prices[category]
+
+    def group_price(self, store_ids, categories, day_idx):
+        """Mean price of each row's store/category on its day, NaN where unknown"""
+        store_codes = self.store_codes(store_ids)
+        categories = np.asarray(categories, dtype=str)
+        day_idx = np.asarray(day_idx)
+        out = np.full(len(day_idx), np.nan, dtype=np.float32)
+        for category in np.unique(categories):
+            means = self.category_prices(category)
+            rows = np.flatnonzero((categories == category) & (store_codes >= 0) & (day_idx >= 0))
+            if means is not None and len(rows):
+                out[rows] = means[store_codes[rows], self.week_idx[day_idx[rows]]]
+        return out
+
+    def event(self, day_idx, col="event_name_1"):
+        """Event name per day index (None for no event or unknown day)"""
+        names = self.event_names.get(col)
+        if names is None:
+            return np.full(len(day_idx), None, dtype=object)
+        codes = np.where(np.asarray(day_idx) >= 0, self.calendar[col][day_idx], -1)
+        labels = np.concatenate([names.astype(object), [None]])
+        return labels[np.where(codes >= 0, codes, len(names))]
+
+
+def encode_calendar(calendar):
+    """Calendar columns as arrays, with events as codes over the full calendar"""
+    columns, names = {}, {}
+    for col in calendar.columns:
+        if col == "d":
+            continue
+        values = calendar[col]
+        if col in EVENT_COLS:
+            categorical = pd.Categorical(values)
+            columns[col] = categorical.codes.astype(np.int8)
+            names[col] = np.asarray(categorical.categories, dtype=str)
+        elif col == "date":
+            columns[col] = pd.to_datetime(values).to_numpy().astype("datetime64[D]")
+        elif col in SMALL_INT_COLS:
+            columns[col] = values.to_numpy(dtype=np.int16)
+        elif pd.api.types.is_numeric_dtype(values):
+            columns[col] = values.to_numpy()
+        else:
+            columns[col] = values.astype(str).to_numpy(dtype=str)
+    return columns, names
+
+
+def build_lookups(calendar_file, prices_file, sales_file=None):
+    """LookupTables from the raw M5 files.
+
+    The sales file, when given, supplies each item's category (read by
+    column, so it stays cheap) for category-level prices.
+    """
+    calendar = pd.read_csv(calendar_file)
+    columns, names = encode_calendar(calendar)
+    dates = pd.to_datetime(calendar["date"]).to_numpy().astype("datetime64[D]")
+    weeks, week_idx = np.unique(calendar["wm_yr_wk"].to_numpy(), return_inverse=True)
+
+    prices = pd.read_csv(
+        prices_file,
+        dtype={"store_id": "category", "item_id": "category", "wm_yr_wk": "int32", "sell_price": "float32"},
+    )
+    item_codes, items = pd.factorize(prices["item_id"].astype(str), sort=True)
+    store_codes, stores = pd.factorize(prices["store_id"].astype(str), sort=True)
+    price_weeks = np.searchsorted(weeks, prices["wm_yr_wk"].to_numpy())
+    in_calendar = (price_weeks < len(weeks)) & (weeks[np.minimum(price_weeks, len(weeks) - 1)]
+                                               == prices["wm_yr_wk"].to_numpy())
+    table = np.full((len(items), len(stores), len(weeks)), np.nan, dtype=np.float32)
+    table[item_codes[in_calendar], store_codes[in_calendar], price_weeks[in_calendar]] = (
+        prices["sell_price"].to_numpy()[in_calendar]
+    )
+
+    item_cats = np.full(len(items), "", dtype=object)
+    if sales_file is not None and Path(sales_file).exists():
+        item_cat = pd.read_csv(sales_file, usecols=["item_id", "cat_id"]).drop_duplicates("item_id")
+        positions = pd.Index(items).get_indexer(item_cat["item_id"].astype(str))
+        item_cats[positions[positions >= 0]] = item_cat["cat_id"].astype(str).to_numpy()[positions >= 0]
+
+    arrays = {f"cal_{col}": values for col, values in columns.items()}
+    arrays.update({f"names_{col}": values for col, values in names.items()})
+    arrays.update({
+        "calendar_columns": np.asarray(list(columns)),
+        "d": calendar["d"].astype(str).to_numpy(dtype=str),
+        "dates": dates,
+        "week_idx": week_idx.astype(np.int32),
+        "items": np.asarray(items, dtype=str),
+        "item_cats": item_cats.astype(str),
+        "stores": np.asarray(stores, dtype=str),
+        "prices": table,
+    })
+    return LookupTables(arrays)
+
+
+def save_lookups(data_dir, lookups):
+    """Write lookups.npz to data_dir"""
+    path = Path(data_dir) / LOOKUPS_FILE
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **lookups.arrays())
+    return path
+
+
+# Loaded tables by path, with the file signature they were read at
+_loaded = {}
+
+
+def load_lookups(data_dir):
+    """LookupTables saved by preprocessing (None if missing); reloaded when the file changes"""
+    path = Path(data_dir) / LOOKUPS_FILE
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != signature:
+        with np.load(path, allow_pickle=False) as data:
+            tables = LookupTables({name: data[name] for name in data.files})
+        _loaded[path] = cached = (signature, tables)
+    return cached[1]
@@ -4,147 +4,1064 @@ LightGBM model training script for Walmart sales forecasting.
 """
 
 import pandas as pd
+import numpy as np
 import lightgbm as lgb
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from math import sqrt
 import json
 import sys
 import os
 import joblib
 import time
+import hashlib
+import shutil
+import random
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def train_model():
-    """Train LightGBM model for sales forecasting"""
+from feature_matrix import BASE_FEATURES, TARGET_COL, day_slice, ensure_feature_matrix
+from features import build_features, context_length, feature_names as engine_feature_names, save_state
+from instrument import StageTimer
+from registry import (current_manifest, current_version_dir, discard_version_dir, load_manifest, new_version_dir,
+                      quantile_model_files, write_manifest)
+from storage import (atomic_path, list_partitions, processed_exists, processed_fingerprint, project_dir,
+                     read_processed)
+
+TRAINING_COLUMNS = ["id", "store_id", "cat_id", "date", "sell_price", "demand"]
+
+DEFAULT_PARAMS = {
+    "objective": "regression",
+    "metric": "rmse",
+    "verbosity": -1,
+    "boosting_type": "gbdt",
+    "learning_rate": 0.05,
+    "num_leaves": 31,
+    "seed": 42,
+}
+NUM_BOOST_ROUND = 100
+EARLY_STOPPING_ROUNDS = 10
+VALIDATION_DAYS = 28
+
+# Quantile boosters trained alongside the point model(s) for prediction
+# intervals. They live in the registry version next to the model they
+# belong to; quantile_models.json is where older runs put them.
+QUANTILES = [0.1, 0.5, 0.9]
+QUANTILE_MODELS_FILE = "quantile_models.json"
+
+# Incremental retraining: extra rounds boosted on the new days, and how much
+# worse than the previous model the update may score before a full retrain
+INCREMENTAL_ROUNDS = 30
+MAX_DEGRADATION = 0.05
+REFIT_DECAY_RATE = 0.9
+
+# Hyperparameter search: values tried per parameter, how many boosting rounds
+# a trial runs before it can be pruned, and how far behind the best RMSE so
+# far a trial may fall before it is stopped
+DEFAULT_SEARCH_SPACE = {
+    "learning_rate": [0.03, 0.05, 0.1],
+    "num_leaves": [15, 31, 63],
+    "min_data_in_leaf": [20, 50],
+    "feature_fraction": [0.8, 1.0],
+}
+PRUNE_WARMUP_ROUNDS = 20
+PRUNE_RATIO = 1.05
+
+# Parameters fixed at Dataset construction (binning). Pre-filtering is off so
+# cached Datasets can be reused with any min_data_in_leaf.
+DATASET_PARAMS = {"max_bin": 255, "feature_pre_filter": False, "verbosity": -1}
+
+
+def format_duration(seconds):
+    """Short duration string used in the JSON result"""
+    if seconds < 60:
+        return f"{seconds:.2f}s"
+    return f"{int(seconds // 60)}m {seconds % 60:.1f}s"
+
+
+def prepare_training_data(df):
+    """Feature matrix, labels and time-based split for a frame of processed rows"""
+    # Encode date features
+    if 'date' in df.columns:
+        df["weekday"] = df["date"].dt.weekday
+        df["month"] = df["date"].dt.month
+        df["year"] = df["date"].dt.year
+    else:
+        df["weekday"] = 0
+        df["month"] = 1
+        df["year"] = 2024
+
+    # Clean NaNs
+    if 'sell_price' in df.columns:
+        df["sell_price"] = df["sell_price"].fillna(0)
+    else:
+        df["sell_price"] = 10.0
+
+    # Target column
+    if TARGET_COL not in df.columns:
+        raise ValueError(f"Target column '{TARGET_COL}' not found in data")
+
+    df = df[df[TARGET_COL].notnull()].reset_index(drop=True)
+
+    feature_cols = list(BASE_FEATURES)
+    X = df[feature_cols].to_numpy(dtype=np.float32)
+    y = df[TARGET_COL].to_numpy(dtype=np.float32)
+    group_daily = None
+
+    # Lag, rolling and price features per series
+    if 'date' in df.columns and 'id' in df.columns:
+        print("Building series features...")
+        engine_X, _ = build_features(df)
+        X = np.hstack([X, engine_X])
+        feature_cols += engine_feature_names()
+
+        # Store/category mean series, whose context pred.py uses
+        group_daily = df.groupby(["store_id", "cat_id", "date"], observed=True).agg(
+            demand=("demand", "mean"),
+            sell_price=("sell_price", "mean"),
+        ).reset_index()
+        group_daily["store_id"] = group_daily["store_id"].astype(str)
+        group_daily["cat_id"] = group_daily["cat_id"].astype(str)
+
+    # Split train/validation
+    dates = train_end = data_end = None
+    if 'date' in df.columns:
+        cutoff_date = df["date"].max() - pd.Timedelta(days=VALIDATION_DAYS)
+        train_mask = (df["date"] <= cutoff_date).to_numpy()
+        dates = df["date"].to_numpy()
+        train_end = cutoff_date.strftime("%Y-%m-%d")
+        data_end = df["date"].max().strftime("%Y-%m-%d")
+    else:
+        train_mask = np.zeros(len(df), dtype=bool)
+        train_mask[df.sample(frac=0.8, random_state=42).index] = True
+
+    return {
+        "X": X,
+        "y": y,
+        "feature_cols": feature_cols,
+        "train_mask": train_mask,
+        "val_mask": ~train_mask,
+        "group_daily": group_daily,
+        "dates": dates,
+        "train_end": train_end,
+        "data_end": data_end,
+    }
+
+
+def matrix_training_data(matrix):
+    """prepare_training_data() output as zero-copy slices of the feature matrix.
+
+    The matrix is day-major, so the train and validation masks are row
+    slices and X[mask] is a view of the memory map rather than a copy.
+    """
+    days, day_offsets = matrix["days"], matrix["day_offsets"]
+    cutoff_date = days[-1] - np.timedelta64(VALIDATION_DAYS, "D")
+    return {
+        "X": matrix["X"],
+        "y": matrix["y"],
+        "feature_cols": list(matrix["feature_cols"]),
+        "train_mask": day_slice(days, day_offsets, end=cutoff_date),
+        "val_mask": day_slice(days, day_offsets, start=cutoff_date + np.timedelta64(1, "D")),
+        "group_daily": matrix["group_daily"],
+        "dates": None,
+        "train_end": str(cutoff_date),
+        "data_end": str(days[-1]),
+    }
+
+
+def save_group_state(group_daily, model_dir):
+    """Save the trailing store/category context pred.py builds features from"""
+    if group_daily is None:
+        return
+    group_daily = group_daily.copy()
+    group_daily["group"] = group_daily["store_id"] + "|" + group_daily["cat_id"]
+    _, group_state = build_features(group_daily, series_col="group")
+    save_state(model_dir / "feature_state.npz", group_state)
+
+
+def save_point_model(model, feature_cols, model_dir):
+    """Write the served point model (text and joblib) and its feature names.
+
+    Each file is replaced atomically, so pred.py never loads a partial model.
+    """
+    model_path = model_dir / "lgbm_model.txt"
+    with atomic_path(model_path) as tmp_path:
+        model.save_model(str(tmp_path))
+    with atomic_path(model_dir / "lightgbm_model.pkl") as tmp_path:
+        joblib.dump(model, tmp_path)
+    with atomic_path(model_dir / "feature_names.json") as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(feature_cols, f)
+    remove_unversioned_quantile_models(model_dir)
+    return model_path
+
+
+def dataset_cache_dir(data_dir, scope):
+    """Cache directory for the binary Datasets of one training scope.
+
+    The key covers the processed-data fingerprint, the feature list and the
+    binning parameters, so any change to those builds fresh Datasets.
+    """
+    key = hashlib.sha1(json.dumps({
+        "fingerprint": processed_fingerprint(data_dir),
+        "features": BASE_FEATURES + engine_feature_names(),
+        "dataset_params": DATASET_PARAMS,
+        "scope": scope,
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    return Path(data_dir).parent / "cache" / "datasets" / f"{scope}-{key}"
+
+
+def load_cached_datasets(cache_dir):
+    """Train/validation Datasets saved in LightGBM binary format (None on a miss)"""
+    if cache_dir is None:
+        return None
+    train_file = cache_dir / "train.bin"
+    val_file = cache_dir / "val.bin"
+    if not (train_file.exists() and val_file.exists()):
+        return None
+
+    print(f"Using cached binary Datasets from {cache_dir.name}")
+    train_set = lgb.Dataset(str(train_file), params=DATASET_PARAMS)
+    val_set = lgb.Dataset(str(val_file), reference=train_set, params=DATASET_PARAMS)
+    return train_set, val_set
+
+
+def build_datasets(data, cache_dir=None):
+    """Bin prepared data into train/validation Datasets, saving them to cache_dir.
+
+    The masks may be boolean arrays or row slices (see matrix_training_data).
+    """
+    X, y = data["X"], data["y"]
+    train_mask, val_mask = data["train_mask"], data["val_mask"]
+    feature_cols = data["feature_cols"]
+
+    train_set = lgb.Dataset(X[train_mask], label=y[train_mask], feature_name=feature_cols,
+                            params=DATASET_PARAMS, free_raw_data=False)
+    val_set = lgb.Dataset(X[val_mask], label=y[val_mask], feature_name=feature_cols,
+                          reference=train_set, params=DATASET_PARAMS, free_raw_data=False)
+
+    if cache_dir is not None:
+        train_set.construct()
+        val_set.construct()
+
+        # Older caches for this scope belong to superseded data
+        scope = cache_dir.name.rsplit("-", 1)[0]
+        if cache_dir.parent.exists():
+            for stale in cache_dir.parent.glob(f"{scope}-*"):
+                if stale != cache_dir:
+                    shutil.rmtree(stale, ignore_errors=True)
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for name, dataset in [("train.bin", train_set), ("val.bin", val_set)]:
+            with atomic_path(cache_dir / name) as tmp_path:
+                # LightGBM refuses to overwrite the empty placeholder
+                tmp_path.unlink()
+                dataset.save_binary(str(tmp_path))
+        with atomic_path(cache_dir / "meta.json") as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump({"train_end": data.get("train_end"), "data_end": data.get("data_end")}, f)
+        print(f"Saved binary Datasets to {cache_dir.name}")
+
+    return train_set, val_set
+
+
+def load_dataset_meta(cache_dir):
+    """Date range of the cached Datasets ({} when unknown)"""
+    meta_file = Path(cache_dir) / "meta.json"
+    if not meta_file.exists():
+        return {}
+    with open(meta_file, "r") as f:
+        return json.load(f)
+
+
+def training_datasets(data_dir, scope, **filters):
+    """Train/validation Datasets for a scope, from the binary cache when possible.
+
+    Returns (train_set, val_set, feature_cols, group_daily). group_daily is
+    None on a cache hit since the feature state saved by the run that built
+    the cache is still current. The whole dataset is read from the
+    memory-mapped feature matrix (see feature_matrix.py); filtered scopes
+    load their rows from the processed data.
+    """
+    cache_dir = dataset_cache_dir(data_dir, scope)
+    cached = load_cached_datasets(cache_dir)
+    if cached is not None:
+        train_set, val_set = cached
+        train_set.construct()
+        return train_set, val_set, train_set.get_feature_name(), None
+
+    print("Loading data...")
+    if filters:
+        df = read_processed(data_dir, columns=TRAINING_COLUMNS, **filters)
+        print(f"[{scope}] Rows loaded: {len(df):,}")
+        data = prepare_training_data(df)
+    else:
+        data = matrix_training_data(ensure_feature_matrix(data_dir))
+        print(f"[{scope}] Rows in feature matrix: {len(data['y']):,}")
+
+    train_set, val_set = build_datasets(data, cache_dir)
+    return train_set, val_set, data["feature_cols"], data["group_daily"]
+
+
+def fit_booster(train_set, val_set, params=None, num_threads=None, callbacks=None,
+                init_model=None, num_boost_round=NUM_BOOST_ROUND):
+    """Train one booster and score it on the validation Dataset.
+
+    With init_model, boosting continues from that booster's trees.
+    """
+    params = dict(DEFAULT_PARAMS if params is None else params)
+    params["metric"] = ["rmse", "l1"]
+    if num_threads:
+        params["num_threads"] = num_threads
+
+    train_set.construct()
+    val_set.construct()
+    print(f"Train rows: {train_set.num_data():,}")
+    print(f"Validation rows: {val_set.num_data():,}")
+
+    print("Training model...")
+    model = lgb.train(
+        params,
+        train_set,
+        num_boost_round=num_boost_round,
+        valid_sets=[val_set],
+        valid_names=["valid"],
+        init_model=init_model,
+        callbacks=[
+            lgb.early_stopping(stopping_rounds=EARLY_STOPPING_ROUNDS, first_metric_only=True),
+            lgb.log_evaluation(0)
+        ] + list(callbacks or [])
+    )
+
+    # Validation metrics at the best iteration, taken from LightGBM's own
+    # evaluation so cached Datasets need no raw feature matrix
+    rmse = model.best_score["valid"]["rmse"]
+    y_val = val_set.get_label()
+    variance = float(np.var(y_val)) if len(y_val) else 0.0
+
+    metrics = {
+        "rmse": rmse,
+        "mae": model.best_score["valid"]["l1"],
+        "r2_score": 1 - rmse ** 2 / variance if variance > 0 else 0.0,
+        "training_samples": train_set.num_data(),
+        "test_samples": val_set.num_data(),
+    }
+
+    print(f"Validation RMSE: {metrics['rmse']:.4f}")
+    print(f"Validation MAE: {metrics['mae']:.4f}")
+    print(f"R² Score: {metrics['r2_score']:.4f}")
+
+    return model, metrics
+
+
+def quantile_file(alpha, prefix="lgbm_quantile"):
+    return f"{prefix}_{int(round(alpha * 100)):02d}.txt"
+
+
+def fit_quantile(train_set, val_set, alpha, params=None, num_threads=None, init_model=None,
+                 num_boost_round=NUM_BOOST_ROUND):
+    """Fit one quantile booster; returns (alpha, model string, metrics)"""
+    params = dict(DEFAULT_PARAMS if params is None else params,
+                  objective="quantile", alpha=alpha, metric="quantile")
+    if num_threads:
+        params["num_threads"] = num_threads
+    model = lgb.train(
+        params,
+        train_set,
+        num_boost_round=num_boost_round,
+        valid_sets=[val_set],
+        valid_names=["valid"],
+        init_model=init_model,
+        callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING_ROUNDS, verbose=False)],
+    )
+    metrics = {
+        "quantile_loss": model.best_score["valid"]["quantile"],
+        "best_iteration": model.best_iteration,
+    }
+    print(f"[q{alpha:.2f}] Validation quantile loss: {metrics['quantile_loss']:.4f}")
+    return alpha, model.model_to_string(num_iteration=model.best_iteration or None), metrics
+
+
+def train_quantile(cache_dir, alpha, num_threads, params=None):
+    """Fit one quantile booster on the cached Datasets (runs in a worker process)"""
+    train_set, val_set = load_cached_datasets(Path(cache_dir))
+    return fit_quantile(train_set, val_set, alpha, params, num_threads)
+
+
+def save_quantile_models(quantile_boosters, version_dir, prefix="quantile"):
+    """Write quantile boosters into the registry version next to their point model.
+
+    Returns the file per quantile for the manifest's quantile_models entry.
+    """
+    files = {}
+    for alpha, model_str in sorted(quantile_boosters.items()):
+        files[str(alpha)] = quantile_file(alpha, prefix=prefix)
+        lgb.Booster(model_str=model_str).save_model(str(Path(version_dir) / files[str(alpha)]))
+    return files
+
+
+def remove_unversioned_quantile_models(model_dir):
+    """Delete quantile boosters older runs kept next to the served model.
+
+    Intervals from older quantile models would not match the new point model;
+    current ones are read from the registry version instead.
+    """
+    quantiles_path = model_dir / QUANTILE_MODELS_FILE
+    if quantiles_path.exists():
+        quantiles_path.unlink()
+    for path in model_dir.glob("lgbm_quantile_*.txt"):
+        path.unlink()
+
+
+def train_model(fallback_reason=None, quantiles=QUANTILES):
+    """Train LightGBM model for sales forecasting.
+
+    Quantile boosters for `quantiles` are fitted in worker processes from
+    the same binary Datasets while the point model trains.
+    """
     try:
         start_time = time.time()
+        timings = StageTimer("train")
 
         # Project root
-        base_dir = Path(__file__).parent.parent
+        base_dir = project_dir()
         data_dir = base_dir / "python" / "data" / "processed"
         model_dir = base_dir / "python" / "models"
         model_dir.mkdir(parents=True, exist_ok=True)
 
-        # Input file
-        input_csv = data_dir / "m5_preprocessed_sample.csv"
-        if not input_csv.exists():
+        # Input data
+        if not processed_exists(data_dir):
             raise FileNotFoundError("Processed data not found. Please run preprocessing first.")
 
-        print("Loading data...")
-        df = pd.read_csv(input_csv)
-        print(f"Rows loaded: {len(df):,}")
-        print("Columns:", df.columns.tolist())
-
-        # Encode date features
-        if 'date' in df.columns:
-            df["date"] = pd.to_datetime(df["date"])
-            df["weekday"] = df["date"].dt.weekday
-            df["month"] = df["date"].dt.month
-            df["year"] = df["date"].dt.year
-        else:
-            df["weekday"] = 0
-            df["month"] = 1
-            df["year"] = 2024
+        with timings.stage("bin"):
+            train_set, val_set, feature_cols, group_daily = training_datasets(data_dir, "global")
+            if group_daily is not None or not (model_dir / "feature_state.npz").exists():
+                save_group_state(group_daily, model_dir)
+
+        with timings.stage("train") as stage:
+            quantile_boosters, quantile_metrics = {}, {}
+            if quantiles:
+                cache_dir = dataset_cache_dir(data_dir, "global")
+                threads = max(1, (os.cpu_count() or 1) // (len(quantiles) + 1))
+                print(f"Training quantile models {quantiles} in parallel ({threads} threads each)")
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=len(quantiles), mp_context=context) as executor:
+                    futures = [executor.submit(train_quantile, str(cache_dir), alpha, threads)
+                               for alpha in quantiles]
+                    model, metrics = fit_booster(train_set, val_set, num_threads=threads)
+                    for future in futures:
+                        alpha, model_str, alpha_metrics = future.result()
+                        quantile_boosters[alpha] = model_str
+                        quantile_metrics[str(alpha)] = alpha_metrics
+            else:
+                model, metrics = fit_booster(train_set, val_set)
+            stage.add_rows(metrics["training_samples"] + metrics["test_samples"])
+
+        with timings.stage("save"):
+            # Save model and features
+            model_path = save_point_model(model, feature_cols, model_dir)
+
+            print(f"Model saved to {model_path}")
+
+            training_time = time.time() - start_time
+
+            # Register this run as the current version
+            parent = current_manifest(model_dir)
+            window = load_dataset_meta(dataset_cache_dir(data_dir, "global"))
+            version_dir = new_version_dir(model_dir)
+            model.save_model(str(version_dir / "model.txt"))
+            manifest = write_manifest(version_dir, {
+                "partition_by": None,
+                "models": {"global": "model.txt"},
+                "quantile_models": {"global": save_quantile_models(quantile_boosters, version_dir)},
+                "features": feature_cols,
+                "data_fingerprint": processed_fingerprint(data_dir),
+                "trained_through": window.get("train_end"),
+                "data_end": window.get("data_end"),
+                "lineage": {
+                    "parent": parent["version"] if parent else None,
+                    "method": "full",
+                    "fallback_reason": fallback_reason,
+                },
+                "params": DEFAULT_PARAMS,
+                "metrics": metrics,
+                "quantile_metrics": quantile_metrics,
+                "training_time": round(training_time, 2),
+            })
 
-        # Clean NaNs
-        if 'sell_price' in df.columns:
-            df["sell_price"] = df["sell_price"].fillna(0)
+        # Print training completion info
+        if training_time < 60:
+            time_str = f"{training_time:.2f} seconds"
         else:
-            df["sell_price"] = 10.0
+            time_str = f"{int(training_time // 60)} minutes {training_time % 60:.1f} seconds"
+
+        print(f"Training completed in {time_str}")
+        print(f"Model saved successfully!")
+
+        # Must be LAST line: JSON output
+        print(json.dumps({
+            "status": "success",
+            "message": "Model training completed successfully",
+            "rmse": round(metrics["rmse"], 2),
+            "mae": round(metrics["mae"], 2),
+            "r2_score": round(metrics["r2_score"], 3),
+            "training_time": format_duration(training_time),
+            "model_file": "lgbm_model.txt",
+            "model_version": manifest["version"],
+            "training_mode": "full",
+            "fallback_reason": fallback_reason,
+            "quantiles": sorted(quantile_boosters),
+            "features_used": feature_cols,
+            "training_samples": metrics["training_samples"],
+            "test_samples": metrics["test_samples"],
+            "timings": timings.summary()
+        }))
 
-        # Target column
-        target_col = "demand"
-        if target_col not in df.columns:
-            raise ValueError(f"Target column '{target_col}' not found in data")
+    except Exception as e:
+        print(json.dumps({
+            "status": "error",
+            "message": str(e)
+        }))
+
+
+def evaluate_predictions(y, preds):
+    """RMSE, MAE and R² of predictions against labels"""
+    y = np.asarray(y, dtype=np.float64)
+    errors = y - np.asarray(preds, dtype=np.float64)
+    variance = float(np.var(y)) if len(y) else 0.0
+    mse = float(np.mean(errors ** 2)) if len(y) else 0.0
+    return {
+        "rmse": sqrt(mse),
+        "mae": float(np.mean(np.abs(errors))) if len(y) else 0.0,
+        "r2_score": 1 - mse / variance if variance > 0 else 0.0,
+    }
+
+
+def train_incremental(method="continue", max_degradation=MAX_DEGRADATION):
+    """Update the current global booster with the days added since it was trained.
+
+    "continue" boosts INCREMENTAL_ROUNDS more trees on the new days,
+    "refit" re-estimates the existing leaf values on them. The previous
+    version's quantile boosters get the same update, so the intervals keep
+    matching the point model. Only the new days plus the feature context
+    they need are read. Falls back to train_model()
+    when there is no usable previous version or the update scores more than
+    max_degradation worse than the previous model.
+    """
+    try:
+        start_time = time.time()
+        timings = StageTimer("train")
 
-        df = df[df[target_col].notnull()]
+        base_dir = project_dir()
+        data_dir = base_dir / "python" / "data" / "processed"
+        model_dir = base_dir / "python" / "models"
+        model_dir.mkdir(parents=True, exist_ok=True)
 
-        feature_cols = ["sell_price", "weekday", "month", "year"]
+        if not processed_exists(data_dir):
+            raise FileNotFoundError("Processed data not found. Please run preprocessing first.")
+        if method not in ("continue", "refit"):
+            raise ValueError(f"Unsupported incremental method: {method}")
 
-        # Split train/validation
-        if 'date' in df.columns:
-            cutoff_date = df["date"].max() - pd.Timedelta(days=28)
-            train_df = df[df["date"] <= cutoff_date]
-            val_df = df[df["date"] > cutoff_date]
+        version_dir = current_version_dir(model_dir)
+        previous = load_manifest(version_dir) if version_dir is not None else None
+        feature_cols = BASE_FEATURES + engine_feature_names()
+        if previous is None:
+            reason = "no registered model"
+        elif previous.get("partition_by"):
+            reason = "partitioned models are retrained in full"
+        elif not previous.get("trained_through"):
+            reason = "previous model has no recorded training window"
+        elif previous.get("features") != feature_cols:
+            reason = "feature set changed"
         else:
-            train_df = df.sample(frac=0.8, random_state=42)
-            val_df = df.drop(train_df.index)
-
-        print(f"Train rows: {len(train_df):,}")
-        print(f"Validation rows: {len(val_df):,}")
-
-        train_set = lgb.Dataset(train_df[feature_cols], label=train_df[target_col])
-        val_set = lgb.Dataset(val_df[feature_cols], label=val_df[target_col])
-
-        params = {
-            "objective": "regression",
-            "metric": "rmse",
-            "verbosity": -1,
-            "boosting_type": "gbdt",
-            "learning_rate": 0.05,
-            "num_leaves": 31,
-            "seed": 42,
-        }
-
-        print("Training model...")
-        model = lgb.train(
-            params,
-            train_set,
-            num_boost_round=100,
-            valid_sets=[val_set],
-            callbacks=[
-                lgb.early_stopping(stopping_rounds=10),
-                lgb.log_evaluation(0)
-            ]
-        )
+            reason = None
+        if reason:
+            print(f"Incremental update not possible ({reason}), retraining in full")
+            return train_model(fallback_reason=reason)
 
-        print("Predicting...")
-        val_preds = model.predict(val_df[feature_cols], num_iteration=model.best_iteration)
+        # New days plus the history their lag/rolling features need
+        trained_through = pd.Timestamp(previous["trained_through"])
+        window_start = trained_through - pd.Timedelta(days=context_length() - 1)
+        print(f"Loading data from {window_start.date()} (trained through {trained_through.date()})...")
+        with timings.stage("load") as stage:
+            df = read_processed(data_dir, columns=TRAINING_COLUMNS, start_date=window_start)
+            print(f"Rows loaded: {len(df):,}")
+            stage.add_rows(len(df))
 
-        rmse = sqrt(mean_squared_error(val_df[target_col], val_preds))
-        mae = mean_absolute_error(val_df[target_col], val_preds)
-        r2 = r2_score(val_df[target_col], val_preds)
+        with timings.stage("features"):
+            data = prepare_training_data(df)
+            X, y = data["X"], data["y"]
+            new_mask = data["train_mask"] & (data["dates"] > np.datetime64(trained_through))
+            val_mask = data["val_mask"]
+            new_days = len(np.unique(data["dates"][new_mask]))
 
-        print(f"Validation RMSE: {rmse:.4f}")
-        print(f"Validation MAE: {mae:.4f}")
-        print(f"R² Score: {r2:.4f}")
+        if new_days == 0:
+            print(json.dumps({
+                "status": "success",
+                "message": f"No new training days since {trained_through.date()}, model unchanged",
+                "model_file": "lgbm_model.txt",
+                "model_version": previous["version"],
+                "training_mode": "incremental",
+                "new_days": 0,
+                "training_time": format_duration(time.time() - start_time),
+                "timings": timings.summary()
+            }))
+            return
 
-        # Save model
-        model_path = model_dir / "lgbm_model.txt"
-        model.save_model(str(model_path))
-        joblib_path = model_dir / "lightgbm_model.pkl"
-        joblib.dump(model, joblib_path)
+        with timings.stage("baseline"):
+            base_model = lgb.Booster(model_file=str(version_dir / previous["models"]["global"]))
+            baseline = evaluate_predictions(y[val_mask], base_model.predict(X[val_mask]))
+            print(f"Previous model on the new validation window: RMSE {baseline['rmse']:.4f}")
 
-        # Save features
-        feature_file = model_dir / "feature_names.json"
-        with open(feature_file, "w") as f:
-            json.dump(feature_cols, f)
+        with timings.stage("train") as stage:
+            params = dict(previous.get("params") or DEFAULT_PARAMS)
+            print(f"Updating with {new_days} new days ({new_mask.sum():,} rows) by {method}...")
+            if method == "refit":
+                model = base_model.refit(X[new_mask], y[new_mask], decay_rate=REFIT_DECAY_RATE)
+                best_iteration = None
+            else:
+                train_set = lgb.Dataset(X[new_mask], label=y[new_mask], feature_name=feature_cols,
+                                        params=DATASET_PARAMS, free_raw_data=False)
+                val_set = lgb.Dataset(X[val_mask], label=y[val_mask], feature_name=feature_cols,
+                                      reference=train_set, params=DATASET_PARAMS, free_raw_data=False)
+                model, _ = fit_booster(train_set, val_set, params, init_model=base_model,
+                                       num_boost_round=INCREMENTAL_ROUNDS)
+                best_iteration = model.best_iteration or None
+            metrics = evaluate_predictions(y[val_mask], model.predict(X[val_mask], num_iteration=best_iteration))
+            metrics["training_samples"] = int(new_mask.sum())
+            metrics["test_samples"] = int(val_mask.sum())
+            print(f"Updated model: RMSE {metrics['rmse']:.4f}")
+            stage.add_rows(new_mask.sum())
 
-        print(f"Model saved to {model_path}")
+        limit = min(baseline["rmse"], previous["metrics"]["rmse"]) * (1 + max_degradation)
+        if metrics["rmse"] > limit:
+            reason = (f"incremental RMSE {metrics['rmse']:.4f} exceeds {limit:.4f} "
+                      f"({max_degradation:.0%} over the previous model)")
+            print(f"{reason}, retraining in full")
+            return train_model(fallback_reason=reason)
 
-        training_time = time.time() - start_time
+        if best_iteration:
+            model = lgb.Booster(model_str=model.model_to_string(num_iteration=best_iteration))
 
-        # Print training completion info
-        if training_time < 60:
-            time_str = f"{training_time:.2f} seconds"
+        with timings.stage("train"):
+            quantile_boosters, quantile_metrics = {}, {}
+            for alpha, model_file in quantile_model_files(previous).get("global", {}).items():
+                alpha = float(alpha)
+                base_quantile = lgb.Booster(model_file=str(version_dir / model_file))
+                print(f"Updating quantile model {alpha} by {method}...")
+                if method == "refit":
+                    quantile_model = base_quantile.refit(X[new_mask], y[new_mask], decay_rate=REFIT_DECAY_RATE)
+                    quantile_boosters[alpha] = quantile_model.model_to_string()
+                else:
+                    _, quantile_boosters[alpha], quantile_metrics[str(alpha)] = fit_quantile(
+                        train_set, val_set, alpha, params, init_model=base_quantile,
+                        num_boost_round=INCREMENTAL_ROUNDS,
+                    )
+
+        with timings.stage("save"):
+            # Save model, features and the refreshed forecast context
+            save_point_model(model, feature_cols, model_dir)
+            save_group_state(data["group_daily"], model_dir)
+
+            training_time = time.time() - start_time
+            new_version = new_version_dir(model_dir)
+            model.save_model(str(new_version / "model.txt"))
+            manifest = write_manifest(new_version, {
+                "partition_by": None,
+                "models": {"global": "model.txt"},
+                "quantile_models": {"global": save_quantile_models(quantile_boosters, new_version)},
+                "features": feature_cols,
+                "data_fingerprint": processed_fingerprint(data_dir),
+                "trained_through": data["train_end"],
+                "data_end": data["data_end"],
+                "lineage": {
+                    "parent": previous["version"],
+                    "method": method,
+                    "new_days": new_days,
+                    "window_start": window_start.strftime("%Y-%m-%d"),
+                    "trees_added": model.num_trees() - base_model.num_trees(),
+                    "baseline_rmse": baseline["rmse"],
+                },
+                "params": params,
+                "metrics": metrics,
+                "quantile_metrics": quantile_metrics,
+                "training_time": round(training_time, 2),
+            })
+
+        print(f"Incremental update completed in {format_duration(training_time)}")
+
+        # Must be LAST line: JSON output
+        print(json.dumps({
+            "status": "success",
+            "message": f"Model updated incrementally with {new_days} new days",
+            "rmse": round(metrics["rmse"], 2),
+            "mae": round(metrics["mae"], 2),
+            "r2_score": round(metrics["r2_score"], 3),
+            "training_time": format_duration(training_time),
+            "model_file": "lgbm_model.txt",
+            "model_version": manifest["version"],
+            "parent_version": previous["version"],
+            "training_mode": "incremental",
+            "method": method,
+            "new_days": new_days,
+            "baseline_rmse": round(baseline["rmse"], 2),
+            "quantiles": sorted(quantile_boosters),
+            "features_used": feature_cols,
+            "training_samples": metrics["training_samples"],
+            "test_samples": metrics["test_samples"],
+            "timings": timings.summary()
+        }))
+
+    except Exception as e:
+        print(json.dumps({
+            "status": "error",
+            "message": str(e)
+        }))
+
+
+def train_partition(partition_by, value, data_dir, version_dir, params, num_threads, quantiles=()):
+    """Train the booster for one store or category partition (runs in a worker process).
+
+    Its quantile boosters are fitted on the same Datasets, so the partition's
+    intervals come from models of its own data.
+    """
+    filters = {"stores": [value]} if partition_by == "store_id" else {"categories": [value]}
+    train_set, val_set, feature_cols, group_daily = training_datasets(
+        data_dir, f"{partition_by}={value}", **filters
+    )
+    model, metrics = fit_booster(train_set, val_set, params, num_threads)
+
+    model_file = f"{value}.txt"
+    model.save_model(str(Path(version_dir) / model_file))
+    print(f"[{value}] Model saved to {model_file}")
+
+    quantile_boosters, quantile_metrics = {}, {}
+    for alpha in quantiles:
+        _, quantile_boosters[alpha], quantile_metrics[str(alpha)] = fit_quantile(
+            train_set, val_set, alpha, params, num_threads
+        )
+    quantile_files = save_quantile_models(quantile_boosters, version_dir, prefix=f"{value}_quantile")
+    metrics = dict(metrics, quantile_files=quantile_files, quantile_metrics=quantile_metrics)
+
+    return value, model_file, metrics, feature_cols, group_daily
+
+
+def train_partitioned(partition_by="store_id", workers=None, threads_per_worker=1, quantiles=QUANTILES):
+    """Train one booster (plus quantile boosters) per store or category in parallel worker processes"""
+    version_dir = None
+    try:
+        start_time = time.time()
+        timings = StageTimer("train")
+
+        if partition_by not in ("store_id", "cat_id"):
+            raise ValueError(f"Unsupported partition column: {partition_by}")
+
+        base_dir = project_dir()
+        data_dir = base_dir / "python" / "data" / "processed"
+        model_dir = base_dir / "python" / "models"
+        model_dir.mkdir(parents=True, exist_ok=True)
+
+        if not processed_exists(data_dir):
+            raise FileNotFoundError("Processed data not found. Please run preprocessing first.")
+
+        partitions = list_partitions(data_dir)
+        if partition_by == "store_id":
+            values = sorted(partitions)
         else:
-            time_str = f"{int(training_time // 60)} minutes {training_time % 60:.1f} seconds"
+            values = sorted({cat for cats in partitions.values() for cat in cats})
+        if not values:
+            raise ValueError("No partitions found in processed data")
 
-        print(f"Training completed in {time_str}")
-        print(f"Model saved successfully!")
+        workers = workers or min(len(values), os.cpu_count() or 1)
+        print(f"Training {len(values)} {partition_by} partitions with {workers} workers "
+              f"x {threads_per_worker} LightGBM threads")
+
+        version_dir = new_version_dir(model_dir)
+        results, quantile_files = {}, {}
+        group_frames = []
+        feature_cols = None
+
+        with timings.stage("train") as stage:
+            # spawn keeps each worker's OpenMP runtime independent of the parent
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [
+                    executor.submit(train_partition, partition_by, value, str(data_dir),
+                                    str(version_dir), DEFAULT_PARAMS, threads_per_worker, quantiles)
+                    for value in values
+                ]
+                for future in futures:
+                    value, model_file, metrics, feature_cols, group_daily = future.result()
+                    quantile_files[value] = metrics.pop("quantile_files")
+                    results[value] = dict(metrics, model_file=model_file)
+                    if group_daily is not None:
+                        group_frames.append(group_daily)
+                    stage.add_rows(metrics["training_samples"] + metrics["test_samples"])
+
+        with timings.stage("save"):
+            # Partitions served from the Dataset cache keep the existing state
+            if group_frames and len(group_frames) == len(values):
+                save_group_state(pd.concat(group_frames, ignore_index=True), model_dir)
+            # feature_names.json stays with lgbm_model.txt; the partition
+            # models' features are in the manifest
+            remove_unversioned_quantile_models(model_dir)
+
+            # Row-weighted validation metrics across partitions
+            test_samples = sum(r["test_samples"] for r in results.values())
+            weights = {value: r["test_samples"] / test_samples if test_samples else 0 for value, r in results.items()}
+            metrics = {
+                "rmse": sqrt(sum(weights[v] * r["rmse"] ** 2 for v, r in results.items())),
+                "mae": sum(weights[v] * r["mae"] for v, r in results.items()),
+                "r2_score": sum(weights[v] * r["r2_score"] for v, r in results.items()),
+                "training_samples": sum(r["training_samples"] for r in results.values()),
+                "test_samples": test_samples,
+            }
+
+            training_time = time.time() - start_time
+            parent = current_manifest(model_dir)
+            manifest = write_manifest(version_dir, {
+                "partition_by": partition_by,
+                "models": {value: r["model_file"] for value, r in results.items()},
+                "quantile_models": quantile_files,
+                "partitions": results,
+                "features": feature_cols,
+                "data_fingerprint": processed_fingerprint(data_dir),
+                "lineage": {"parent": parent["version"] if parent else None, "method": "partitioned"},
+                "params": DEFAULT_PARAMS,
+                "workers": workers,
+                "threads_per_worker": threads_per_worker,
+                "metrics": metrics,
+                "training_time": round(training_time, 2),
+            })
+
+        print(f"Training completed in {format_duration(training_time)}")
 
         # Must be LAST line: JSON output
         print(json.dumps({
             "status": "success",
-            "message": "Model training completed successfully",
-            "rmse": round(rmse, 2),
-            "mae": round(mae, 2),
-            "r2_score": round(r2, 3),
-            "training_time": f"{training_time:.2f}s" if training_time < 60 else f"{int(training_time // 60)}m {training_time % 60:.1f}s",
+            "message": f"Trained {len(results)} {partition_by} partition models",
+            "rmse": round(metrics["rmse"], 2),
+            "mae": round(metrics["mae"], 2),
+            "r2_score": round(metrics["r2_score"], 3),
+            "training_time": format_duration(training_time),
+            "model_file": f"registry/{manifest['version']}",
+            "model_version": manifest["version"],
+            "partition_by": partition_by,
+            "quantiles": sorted(quantiles),
+            "partitions": {
+                value: {"rmse": round(r["rmse"], 2), "training_samples": r["training_samples"]}
+                for value, r in results.items()
+            },
+            "features_used": feature_cols,
+            "training_samples": metrics["training_samples"],
+            "test_samples": metrics["test_samples"],
+            "timings": timings.summary()
+        }))
+
+    except Exception as e:
+        # Partition models written before the failure are never registered
+        if version_dir is not None:
+            discard_version_dir(version_dir)
+        print(json.dumps({
+            "status": "error",
+            "message": str(e)
+        }))
+
+
+class TrialPruned(Exception):
+    """Raised inside a search trial that fell behind the best trial"""
+
+
+def search_trials(space, strategy="grid", n_trials=None, seed=42):
+    """Parameter sets to evaluate: the full grid or a random sample of it"""
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    if strategy == "random":
+        n_trials = min(n_trials or 10, len(grid))
+        grid = random.Random(seed).sample(grid, n_trials)
+    elif strategy != "grid":
+        raise ValueError(f"Unsupported search strategy: {strategy}")
+    elif n_trials:
+        grid = grid[:n_trials]
+    return [dict(DEFAULT_PARAMS, **trial) for trial in grid]
+
+
+def prune_callback(best_rmse, prune_ratio):
+    """Stop a trial whose validation RMSE trails the shared best by prune_ratio"""
+    trial_best = [float("inf")]
+
+    def _callback(env):
+        for _, metric, value, _ in env.evaluation_result_list:
+            if metric == "rmse":
+                trial_best[0] = min(trial_best[0], value)
+        rounds = env.iteration - env.begin_iteration + 1
+        if rounds >= PRUNE_WARMUP_ROUNDS and rounds % 5 == 0:
+            if trial_best[0] > best_rmse.value * prune_ratio:
+                raise TrialPruned(trial_best[0])
+
+    _callback.order = 40
+    return _callback
+
+
+def run_trial(trial_id, params, cache_dir, num_threads, best_rmse, best_lock, prune_ratio):
+    """Evaluate one parameter set on the cached Datasets (runs in a worker process)"""
+    train_set, val_set = load_cached_datasets(Path(cache_dir))
+    start_time = time.time()
+    try:
+        model, metrics = fit_booster(train_set, val_set, params, num_threads,
+                                     callbacks=[prune_callback(best_rmse, prune_ratio)])
+    except TrialPruned as pruned:
+        print(f"[trial {trial_id}] pruned at RMSE {pruned.args[0]:.4f}")
+        return {
+            "trial": trial_id, "status": "pruned", "params": params,
+            "rmse": pruned.args[0], "train_time": round(time.time() - start_time, 2),
+        }, None
+
+    with best_lock:
+        if metrics["rmse"] < best_rmse.value:
+            best_rmse.value = metrics["rmse"]
+
+    return {
+        "trial": trial_id, "status": "completed", "params": params,
+        "rmse": metrics["rmse"], "mae": metrics["mae"], "r2_score": metrics["r2_score"],
+        "best_iteration": model.best_iteration, "metrics": metrics,
+        "train_time": round(time.time() - start_time, 2),
+    }, model.model_to_string()
+
+
+def search_params(space=None, strategy="grid", n_trials=None, workers=None,
+                  threads_per_worker=1, prune_ratio=PRUNE_RATIO, seed=42, quantiles=QUANTILES):
+    """Evaluate LightGBM parameter sets in parallel and keep the best booster.
+
+    Quantile boosters for `quantiles` are then fitted with the winning
+    parameters, so the intervals match the new point model.
+    """
+    try:
+        start_time = time.time()
+        timings = StageTimer("train")
+
+        base_dir = project_dir()
+        data_dir = base_dir / "python" / "data" / "processed"
+        model_dir = base_dir / "python" / "models"
+        model_dir.mkdir(parents=True, exist_ok=True)
+
+        if not processed_exists(data_dir):
+            raise FileNotFoundError("Processed data not found. Please run preprocessing first.")
+
+        trials = search_trials(space or DEFAULT_SEARCH_SPACE, strategy, n_trials, seed)
+        if not trials:
+            raise ValueError("Search space is empty")
+
+        # Bin once; every trial loads the same binary Datasets
+        with timings.stage("bin"):
+            _, _, feature_cols, group_daily = training_datasets(data_dir, "global")
+            if group_daily is not None or not (model_dir / "feature_state.npz").exists():
+                save_group_state(group_daily, model_dir)
+        cache_dir = dataset_cache_dir(data_dir, "global")
+
+        workers = workers or min(len(trials), os.cpu_count() or 1)
+        print(f"Searching {len(trials)} parameter sets with {workers} workers "
+              f"x {threads_per_worker} LightGBM threads")
+
+        with timings.stage("search"):
+            results = []
+            best_model = None
+            context = multiprocessing.get_context("spawn")
+            with context.Manager() as manager:
+                best_rmse = manager.Value("d", float("inf"))
+                best_lock = manager.Lock()
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                    futures = [
+                        executor.submit(run_trial, trial_id, params, str(cache_dir), threads_per_worker,
+                                        best_rmse, best_lock, prune_ratio)
+                        for trial_id, params in enumerate(trials)
+                    ]
+                    for future in futures:
+                        result, model_str = future.result()
+                        results.append(result)
+                        if model_str is not None and result["rmse"] <= min(
+                            r["rmse"] for r in results if r["status"] == "completed"
+                        ):
+                            best_model, best = model_str, result
+
+        if best_model is None:
+            raise RuntimeError("Every trial was pruned")
+
+        with timings.stage("train"):
+            quantile_boosters, quantile_metrics = {}, {}
+            if quantiles:
+                print(f"Training quantile models {quantiles} with the best parameters")
+                with ProcessPoolExecutor(max_workers=min(workers, len(quantiles)), mp_context=context) as executor:
+                    futures = [executor.submit(train_quantile, str(cache_dir), alpha, threads_per_worker,
+                                               best["params"])
+                               for alpha in quantiles]
+                    for future in futures:
+                        alpha, model_str, alpha_metrics = future.result()
+                        quantile_boosters[alpha] = model_str
+                        quantile_metrics[str(alpha)] = alpha_metrics
+
+        with timings.stage("save"):
+            # Best booster goes to the usual model path
+            model = lgb.Booster(model_str=best_model)
+            model_path = save_point_model(model, feature_cols, model_dir)
+
+            leaderboard = sorted(results, key=lambda r: (r["status"] != "completed", r["rmse"]))
+            training_time = time.time() - start_time
+
+            parent = current_manifest(model_dir)
+            window = load_dataset_meta(cache_dir)
+            version_dir = new_version_dir(model_dir)
+            model.save_model(str(version_dir / "model.txt"))
+            manifest = write_manifest(version_dir, {
+                "partition_by": None,
+                "models": {"global": "model.txt"},
+                "quantile_models": {"global": save_quantile_models(quantile_boosters, version_dir)},
+                "features": feature_cols,
+                "data_fingerprint": processed_fingerprint(data_dir),
+                "trained_through": window.get("train_end"),
+                "data_end": window.get("data_end"),
+                "lineage": {"parent": parent["version"] if parent else None, "method": "search"},
+                "params": best["params"],
+                "metrics": best["metrics"],
+                "quantile_metrics": quantile_metrics,
+                "search": {
+                    "strategy": strategy,
+                    "prune_ratio": prune_ratio,
+                    "leaderboard": [{k: v for k, v in r.items() if k != "metrics"} for r in leaderboard],
+                },
+                "training_time": round(training_time, 2),
+            })
+
+        print(f"Search completed in {format_duration(training_time)}")
+
+        # Must be LAST line: JSON output
+        print(json.dumps({
+            "status": "success",
+            "message": f"Hyperparameter search evaluated {len(results)} parameter sets",
+            "rmse": round(best["rmse"], 2),
+            "mae": round(best["mae"], 2),
+            "r2_score": round(best["r2_score"], 3),
+            "training_time": format_duration(training_time),
             "model_file": "lgbm_model.txt",
+            "model_version": manifest["version"],
+            "best_params": best["params"],
+            "trials_completed": sum(r["status"] == "completed" for r in results),
+            "trials_pruned": sum(r["status"] == "pruned" for r in results),
+            "quantiles": sorted(quantile_boosters),
+            "leaderboard": [
+                {
+                    "trial": r["trial"],
+                    "status": r["status"],
+                    "rmse": round(r["rmse"], 4),
+                    "best_iteration": r.get("best_iteration"),
+                    "params": {k: r["params"][k] for k in sorted(space or DEFAULT_SEARCH_SPACE)},
+                }
+                for r in leaderboard
+            ],
             "features_used": feature_cols,
-            "training_samples": len(train_df),
-            "test_samples": len(val_df)
+            "training_samples": best["metrics"]["training_samples"],
+            "test_samples": best["metrics"]["test_samples"],
+            "timings": timings.summary()
         }))
 
     except Exception as e:
@@ -153,5 +1070,35 @@ def train_model():
             "message": str(e)
         }))
 
+
 if __name__ == "__main__":
-    train_model()
+    if len(sys.argv) > 1:
+        # Parse command line arguments
+        params = json.loads(sys.argv[1])
+
+        if params.get('mode') == 'partitioned':
+            train_partitioned(
+                params.get('partition_by', 'store_id'),
+                params.get('workers'),
+                params.get('threads_per_worker', 1),
+                params.get('quantiles', QUANTILES)
+            )
+        elif params.get('mode') == 'incremental':
+            train_incremental(
+                params.get('method', 'continue'),
+                params.get('max_degradation', MAX_DEGRADATION)
+            )
+        elif params.get('mode') == 'search':
+            search_params(
+                params.get('space'),
+                params.get('strategy', 'grid'),
+                params.get('trials'),
+                params.get('workers'),
+                params.get('threads_per_worker', 1),
+                params.get('prune_ratio', PRUNE_RATIO),
+                quantiles=params.get('quantiles', QUANTILES)
+            )
+        else:
+            train_model(quantiles=params.get('quantiles', QUANTILES))
+    else:
+        train_model()
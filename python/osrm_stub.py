@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Local OSRM-compatible routing server.
+
+Answers the OSRM `table` and `route` services with the offline haversine
+estimator so route.py can run against a predictable HTTP backend without
+outside services:
+
+    python python/osrm_stub.py 5001
+    ROUTING_BACKEND=osrm OSRM_URL=http://127.0.0.1:5001 python python/route.py
+
+An optional per-request delay (seconds) simulates network latency.
+"""
+
+import json
+import sys
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+from route_backend import HaversineBackend
+
+DEFAULT_PORT = 5001
+
+
+class OSRMStubHandler(BaseHTTPRequestHandler):
+    backend = HaversineBackend()
+    delay = 0.0
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) != 4 or parts[1] != "v1" or parts[0] not in ("table", "route"):
+            return self.reply(400, {"code": "InvalidUrl", "message": self.path})
+        try:
+            coords = [
+                (float(lat), float(lon))
+                for lon, lat in (pair.split(",") for pair in parts[3].split(";"))
+            ]
+        except ValueError:
+            return self.reply(400, {"code": "InvalidQuery", "message": parts[3]})
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        if parts[0] == "table":
+            distance, duration = self.backend.table(coords)
+            return self.reply(200, {
+                "code": "Ok",
+                "distances": (distance * 1000).round(1).tolist(),
+                "durations": (duration * 3600).round(1).tolist(),
+            })
+
+        distance, geometry = self.backend.route(coords)
+        return self.reply(200, {
+            "code": "Ok",
+            "routes": [{
+                "distance": distance * 1000,
+                "duration": distance / self.backend.speed_kmh * 3600,
+                "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in geometry]},
+            }],
+        })
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        print(f"osrm-stub: {format % args}", file=sys.stderr)
+
+
+def serve(port=DEFAULT_PORT, delay=0.0):
+    OSRMStubHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), OSRMStubHandler)
+    print(f"OSRM stub listening on http://127.0.0.1:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    serve(port, delay)
@@ -10,281 +10,830 @@ import sys
 import os
 import joblib
 import lightgbm as lgb
-from datetime import datetime, timedelta
 from pathlib import Path
 
-def generate_predictions(category=None, store=None, start_date=None, end_date=None):
-    """Generate sales predictions for given parameters"""
+from feature_stats import load_feature_stats, lookup_stats
+from features import context_length, feature_names as engine_feature_names, forecast_features, load_state
+from instrument import StageTimer
+from lookups import load_lookups
+from registry import current_manifest, current_version_dir, partition_key, quantile_model_files
+from result_cache import cache_key, default_cache, feature_version, model_version
+from storage import atomic_path, list_partitions, project_dir
+from tree_engine import load_compiled
+
+# Default grid for batch forecasts (the M5 stores and categories)
+DEFAULT_STORES = ["CA_1", "CA_2", "CA_3", "CA_4", "TX_1", "TX_2", "TX_3", "WI_1", "WI_2", "WI_3"]
+DEFAULT_CATEGORIES = ["FOODS", "HOBBIES", "HOUSEHOLD"]
+DEFAULT_HORIZON_DAYS = 28
+
+# Inference engine: "lightgbm" (Booster.predict) or the experimental "compiled"
+# (tree_engine.py), which has not beaten Booster.predict at any batch size yet
+PREDICT_ENGINE = os.environ.get("PREDICT_ENGINE", "lightgbm")
+
+# Created on first use by prediction_cache()
+_result_cache = None
+
+# Store/category variation applied to mock predictions when no processed data exists
+CATEGORY_MULTIPLIERS = {
+    'HOBBIES': 1.2,
+    'HOUSEHOLD': 0.9,
+    'FOODS': 1.5,
+    'ELECTRONICS': 0.8,
+    'CLOTHING': 1.1,
+    'SPORTS': 1.0
+}
+STORE_MULTIPLIERS = {
+    'CA_1': 1.3, 'CA_2': 1.1, 'CA_3': 0.9,
+    'TX_1': 1.2, 'TX_2': 1.0, 'TX_3': 0.8,
+    'WI_1': 0.9, 'WI_2': 1.1, 'WI_3': 1.0
+}
+
+
+def build_feature_frame(stores, categories, start_date, end_date):
+    """Date features for every store x category x day in the range.
+
+    Rows are ordered store, then category, then date, and are built with
+    array repeats rather than a per-row loop.
+    """
+    dates = pd.date_range(start_date, end_date, freq="D")
+    n_dates = len(dates)
+    n_cats = len(categories)
+
+    store_idx = np.repeat(np.arange(len(stores)), n_cats * n_dates)
+    cat_idx = np.tile(np.repeat(np.arange(n_cats), n_dates), len(stores))
+    date_idx = np.tile(np.arange(n_dates), len(stores) * n_cats)
+
+    return pd.DataFrame({
+        'weekday': np.asarray(dates.weekday)[date_idx],
+        'month': np.asarray(dates.month)[date_idx],
+        'year': np.asarray(dates.year)[date_idx],
+        'date': np.asarray(dates.strftime('%Y-%m-%d'), dtype=object)[date_idx],
+        'store_id': np.asarray(stores, dtype=object)[store_idx],
+        'cat_id': np.asarray(categories, dtype=object)[cat_idx],
+    })
+
+
+ENGINE_FEATURES = set(engine_feature_names())
+
+
+def feature_matrix(frame, feature_names):
+    """Model input matrix in feature_names order.
+
+    Missing base features are 0; series features keep NaN so LightGBM
+    treats them as missing, as it did in training.
+    """
+    columns = {}
+    for feat in feature_names:
+        if feat in ENGINE_FEATURES:
+            columns[feat] = frame[feat] if feat in frame.columns else np.nan
+        else:
+            columns[feat] = frame[feat].fillna(0) if feat in frame.columns else 0
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def load_feature_state(model_dir):
+    """Trailing store/category demand context saved by model.py (None if missing)"""
+    return load_state(model_dir / "feature_state.npz")
+
+
+def history_gap(feature_state, start_date):
+    """How far start_date lies past the stored series history, for the API result.
+
+    Returns None without a feature state, else history_end, gap_days and
+    whether any lag/rolling feature still reaches back into the history
+    (false once the gap is context_length() days or more).
+    """
+    if feature_state is None:
+        return None
+    last_date = np.asarray(feature_state["last_date"], dtype="datetime64[D]")
+    gap = int((np.datetime64(pd.Timestamp(start_date).date(), "D") - last_date).astype(np.int64)) - 1
+    return {
+        "history_end": str(last_date),
+        "gap_days": max(gap, 0),
+        "series_features": gap < context_length(),
+    }
+
+
+def add_series_features(frame, feature_names, feature_state, start_date):
+    """Attach lag/rolling/price features for rows of a feature frame.
+
+    The forecast starts at start_date; days between the end of the stored
+    history and start_date are rolled through with unknown demand and
+    price, so lags reaching back across the gap are NaN. Once the gap
+    reaches context_length() days (56) every lag and rolling feature is
+    NaN, which training never shows the model; a warning is printed and
+    history_gap() reports it in the result. A start_date inside the history
+    is treated as the day after it. Rows for unknown store/category pairs
+    get NaN.
+    """
+    wanted = [feat for feat in feature_names if feat in ENGINE_FEATURES]
+    if not wanted:
+        return frame
+
+    key_idx, keys = pd.factorize(frame["store_id"].astype(str) + "|" + frame["cat_id"].astype(str))
+    horizon_idx = (pd.to_datetime(frame["date"]) - pd.Timestamp(start_date)).dt.days.to_numpy()
+
+    if feature_state is None:
+        for feat in wanted:
+            frame[feat] = np.nan
+        return frame
+
+    history = history_gap(feature_state, start_date)
+    if not history["series_features"]:
+        print(f"Warning: forecast starts {history['gap_days']} days after the series history ends "
+              f"({history['history_end']}); lag and rolling features are all NaN")
+    # Beyond the longest feature window the gap's exact length no longer matters
+    gap = min(history["gap_days"], context_length())
+
+    # Each row's own price, so known future price changes reach the price features
+    prices = np.full((len(keys), int(horizon_idx.max()) + 1), np.nan, dtype=np.float32)
+    prices[key_idx, horizon_idx] = frame["sell_price"].to_numpy(dtype=np.float32)
+    prices = pd.DataFrame(prices).ffill(axis=1).bfill(axis=1).to_numpy(dtype=np.float32)
+    future_price = np.full((len(keys), gap + prices.shape[1]), np.nan, dtype=np.float32)
+    future_price[:, gap:] = prices
+
+    features = forecast_features(feature_state, list(keys), future_price.shape[1], future_price)
+    for feat in wanted:
+        frame[feat] = features[feat][key_idx, gap + horizon_idx]
+    return frame
+
+def add_calendar_prices(frame, lookups, default_price):
+    """Real sell price and event of each forecast row the calendar covers.
+
+    Rows outside the calendar, or whose store/category had no priced item
+    that week, keep default_price (a scalar or one value per row).
+    """
+    default_price = np.broadcast_to(np.asarray(default_price, dtype=np.float32), (len(frame),))
+    if lookups is None:
+        frame["sell_price"] = default_price
+        frame["event"] = None
+        return frame
+
+    day_idx = lookups.date_index(pd.to_datetime(frame["date"]).to_numpy())
+    price = lookups.group_price(frame["store_id"].to_numpy(), frame["cat_id"].to_numpy(), day_idx)
+    frame["sell_price"] = np.where(np.isnan(price), default_price, price)
+    frame["event"] = lookups.event(day_idx)
+    return frame
+
+
+def load_model(model_dir):
+    """Load the trained LightGBM booster (text model, falling back to joblib)"""
+    model_path = model_dir / "lgbm_model.txt"
+    joblib_path = model_dir / "lightgbm_model.pkl"
+
+    print(f"Looking for models in: {model_dir}")
+    print(f"LightGBM model path: {model_path}")
+    print(f"LightGBM model exists: {model_path.exists()}")
+    print(f"Joblib model path: {joblib_path}")
+    print(f"Joblib model exists: {joblib_path.exists()}")
+
+    if model_path.exists():
+        print("Loading LightGBM model...")
+        model = lgb.Booster(model_file=str(model_path))
+        print("Model loaded successfully!")
+    elif joblib_path.exists():
+        print("Loading joblib model...")
+        model = joblib.load(joblib_path)
+        print("Model loaded successfully!")
+    else:
+        print("ERROR: No trained model found!")
+        print(f"Checked paths:")
+        print(f"  - {model_path}")
+        print(f"  - {joblib_path}")
+        raise FileNotFoundError("Trained model not found. Please train the model first.")
+
+    return model
+
+
+def load_feature_names(model_dir):
+    """Load the feature list the model was trained with"""
+    feature_file = model_dir / "feature_names.json"
+    print(f"Features file: {feature_file}")
+    print(f"Features file exists: {feature_file.exists()}")
+
+    if feature_file.exists():
+        with open(feature_file, 'r') as f:
+            return json.load(f)
+    return ['sell_price', 'weekday', 'month', 'year']
+
+
+def compile_model(model, model_path, engine=PREDICT_ENGINE):
+    """The booster in the requested inference engine.
+
+    Models the compiled engine cannot represent keep using Booster.predict.
+    """
+    if engine != "compiled" or not isinstance(model, lgb.Booster) or not Path(model_path).exists():
+        return model
+    try:
+        return load_compiled(model_path, model)
+    except ValueError as e:
+        print(f"Using LightGBM inference for {Path(model_path).name}: {e}")
+        return model
+
+
+def load_quantile_models(model_dir, manifest, engine=PREDICT_ENGINE):
+    """Quantile boosters of the current version: {model key: {quantile: booster}}.
+
+    Keys match manifest["models"], "global" or one per partition value.
+    """
+    models = {}
+    if manifest is None:
+        return models
+    version_dir = current_version_dir(model_dir)
+    for key, files in quantile_model_files(manifest).items():
+        models[key] = {}
+        for alpha, model_file in files.items():
+            model_path = version_dir / model_file
+            models[key][float(alpha)] = compile_model(lgb.Booster(model_file=str(model_path)), model_path, engine)
+    if models:
+        print(f"Loaded quantile models {sorted(set().union(*models.values()))} for {len(models)} model(s)")
+    return models
+
+
+def load_predictor(model_dir, engine=PREDICT_ENGINE):
+    """Model(s), feature names and series context needed to score requests.
+
+    When the current registry version is partitioned, its per-store or
+    per-category boosters are loaded as well and requests use the version's
+    feature list. lgbm_model.txt then serves partitions that have no model
+    of their own, provided feature_names.json shows it was trained on the
+    same features.
+    """
+    manifest = current_manifest(model_dir)
+    partition_by = manifest.get("partition_by") if manifest else None
+    partition_models = {}
+    if partition_by:
+        version_dir = current_version_dir(model_dir)
+        for value, model_file in manifest["models"].items():
+            model_path = version_dir / model_file
+            partition_models[value] = compile_model(lgb.Booster(model_file=str(model_path)), model_path, engine)
+        print(f"Loaded {len(partition_models)} {partition_by} partition models from {version_dir.name}")
+
+    try:
+        model = compile_model(load_model(model_dir), model_dir / "lgbm_model.txt", engine)
+    except FileNotFoundError:
+        if not partition_models:
+            raise
+        model = None
+
+    # feature_names.json belongs to lgbm_model.txt
+    feature_names = load_feature_names(model_dir)
+    if partition_by:
+        if model is not None and feature_names != manifest["features"]:
+            print("lgbm_model.txt was trained on other features, not serving unpartitioned requests with it")
+            model = None
+        feature_names = manifest["features"]
+
+    return {
+        "model": model,
+        "partition_by": partition_by,
+        "partition_models": partition_models,
+        "quantile_models": load_quantile_models(model_dir, manifest, engine),
+        "feature_names": feature_names,
+        "feature_state": load_feature_state(model_dir),
+        "model_version": manifest["version"] if manifest else "LightGBM_v1.2",
+        "engine": engine,
+    }
+
+
+def select_model(predictor, store=None, category=None):
+    """Booster that serves a store/category request"""
+    key = partition_key(predictor["partition_by"], store, category)
+    model = predictor["partition_models"].get(key, predictor["model"])
+    if model is None:
+        raise FileNotFoundError(f"No trained model for {predictor['partition_by']} '{key}'.")
+    return model
+
+
+def select_quantile_models(predictor, store=None, category=None):
+    """Quantile boosters trained with the model select_model picks ({} if none)"""
+    key = partition_key(predictor["partition_by"], store, category)
+    if not predictor["partition_by"]:
+        key = "global"
+    elif key not in predictor["partition_models"]:
+        # Served by lgbm_model.txt, which has no quantile models in this version
+        return {}
+    return predictor["quantile_models"].get(key, {})
+
+
+def predict_rows(predictor, frame, X):
+    """Score feature rows, routing each store/category to its model.
+
+    Rows sharing a model are scored together in one predict call. The
+    matrix is passed as a float64 array, which skips Booster.predict's
+    per-call DataFrame conversion.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    partition_by = predictor["partition_by"]
+    if not partition_by:
+        return select_model(predictor).predict(X)
+
+    preds = np.empty(len(frame), dtype=np.float64)
+    groups = pd.Series(np.arange(len(frame))).groupby(frame[partition_by].to_numpy())
+    for value, positions in groups:
+        model = select_model(
+            predictor,
+            store=value if partition_by == "store_id" else None,
+            category=value if partition_by == "cat_id" else None,
+        )
+        preds[positions.to_numpy()] = model.predict(X[positions.to_numpy()])
+    return preds
+
+
+def score_rows(predictor, frame, X):
+    """Point predictions and quantile bounds from one pass over the inputs.
+
+    Returns (preds, bounds); bounds holds lower/upper (and median) arrays,
+    NaN for rows whose model has no quantile models, or is None when no row
+    has any. Quantile boosters are routed per store/category like the point
+    models. They are fitted separately, so their outputs are sorted per row
+    to keep them from crossing, and the interval is widened to contain the
+    point prediction.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    preds = predict_rows(predictor, frame, X)
+    if not predictor.get("quantile_models"):
+        return preds, None
+
+    partition_by = predictor["partition_by"]
+    if partition_by:
+        groups = pd.Series(np.arange(len(frame))).groupby(frame[partition_by].to_numpy())
+        groups = [(value, positions.to_numpy()) for value, positions in groups]
+    else:
+        groups = [(None, np.arange(len(frame)))]
+
+    lower, upper, median = (np.full_like(preds, np.nan) for _ in range(3))
+    has_bounds, has_median = False, False
+    for value, positions in groups:
+        quantile_models = select_quantile_models(
+            predictor,
+            store=value if partition_by == "store_id" else None,
+            category=value if partition_by == "cat_id" else None,
+        )
+        if not quantile_models:
+            continue
+        alphas = sorted(quantile_models)
+        rows = X[positions]
+        quantile_preds = np.sort(np.vstack([quantile_models[alpha].predict(rows) for alpha in alphas]), axis=0)
+        lower[positions] = quantile_preds[0]
+        upper[positions] = quantile_preds[-1]
+        has_bounds = True
+        if 0.5 in quantile_models:
+            median[positions] = quantile_preds[alphas.index(0.5)]
+            has_median = True
+    if not has_bounds:
+        return preds, None
+
+    # NaN bounds stay NaN
+    bounds = {
+        "lower": np.minimum(lower, preds),
+        "upper": np.maximum(upper, preds),
+    }
+    if has_median:
+        bounds["median"] = median
+    return preds, bounds
+
+
+def interval_confidence(preds, bounds):
+    """Confidence in [0, 1] that falls as the interval widens relative to the prediction"""
+    if bounds is None:
+        return None
+    width = bounds["upper"] - bounds["lower"]
+    return 1.0 / (1.0 + width / np.maximum(np.abs(preds), 1.0))
+
+
+def has_interval(confidence, i):
+    """Whether row i got bounds (rows whose model has no quantile models are NaN)"""
+    return confidence is not None and not np.isnan(confidence[i])
+
+
+def interval_of(predictor):
+    """Outer quantiles of the prediction interval, or None"""
+    quantile_sets = [models for models in (predictor.get("quantile_models") or {}).values() if models]
+    alphas = sorted(set.intersection(*(set(models) for models in quantile_sets))) if quantile_sets else []
+    return [alphas[0], alphas[-1]] if alphas else None
+
+
+def add_bounds(frame, bounds):
+    """Attach interval columns to a prediction frame"""
+    if bounds is not None:
+        for name, values in bounds.items():
+            frame[f"predicted_{name}"] = values
+    return frame
+
+
+def bound_columns(frame):
+    return [col for col in ("predicted_lower", "predicted_median", "predicted_upper") if col in frame.columns]
+
+
+def load_demand_stats(data_dir, store=None, category=None):
+    """Average price and demand statistics for a store/category.
+
+    Reads the feature_stats.json sidecar written by preprocessing; returns
+    None when no processed data is available.
+    """
+    stats = load_feature_stats(data_dir)
+    if stats is None:
+        return None
+
+    print(f"Statistics rows: {stats['overall']['rows']:,}")
+    print(f"Available stores: {sorted(stats['stores'])[:10]}")
+    print(f"Available categories: {sorted(stats['categories'])[:10]}")
+
+    return lookup_stats(stats, store, category)
+
+
+def prediction_cache():
+    """Process-wide result cache (None when PREDICTION_CACHE=off)"""
+    global _result_cache
+    if _result_cache is None:
+        base_dir = project_dir()
+        _result_cache = default_cache(base_dir / "python" / "data" / "cache" / "predictions")
+    return _result_cache
+
+
+def write_predictions(csv_text, output_file):
+    """Write prediction rows (as CSV text) without exposing a half-written file"""
+    if csv_text is None:
+        return
+    with atomic_path(output_file) as tmp_path:
+        tmp_path.write_text(csv_text)
+    print(f"Predictions saved to {output_file}")
+
+
+def generate_predictions(category=None, store=None, start_date=None, end_date=None,
+                         predictor=None, stats=None):
+    """Generate sales predictions for given parameters.
+
+    `predictor` (see load_predictor) and `stats` may be passed in by a
+    long-lived caller (see pred_server.py); anything omitted is loaded
+    from disk. Repeated requests against the same model and feature
+    versions are answered from the result cache (see result_cache.py).
+    Hits still write their rows to predictions.csv, so route.py sees the
+    same file whether or not the request was cached.
+    """
+    timings = StageTimer("predict")
     try:
         # Set up paths relative to project root
-        base_dir = Path(__file__).parent.parent  # Go up to project root
+        base_dir = project_dir()
         model_dir = base_dir / "python" / "models"
         data_dir = base_dir / "python" / "data" / "processed"
+        output_file = data_dir / "predictions.csv"
+
+        if not start_date or not end_date:
+            start_date = "2024-01-01"
+            end_date = "2024-01-07"
+
+        cache = prediction_cache()
+        key = None
+        cached = None
+        with timings.stage("cache_lookup"):
+            if cache is not None:
+                key = cache_key(model_version(model_dir), feature_version(model_dir, data_dir),
+                                store, category, start_date, end_date)
+                cached = cache.get(key)
+                if cached is not None and "csv" not in cached:
+                    # Written before hits rewrote predictions.csv
+                    cached = None
+        if cached is not None:
+            print(f"Serving cached predictions for {store}/{category} {start_date} to {end_date}")
+            with timings.stage("write"):
+                write_predictions(cached["csv"], output_file)
+            results = dict(cached["result"], cached=True, timings=timings.summary())
+            print(json.dumps(results))
+            return results
+
+        results, output_df = compute_predictions(category, store, start_date, end_date, predictor, stats,
+                                                 model_dir, data_dir, timings)
+        with timings.stage("write"):
+            csv_text = output_df.to_csv(index=False) if output_df is not None else None
+            write_predictions(csv_text, output_file)
+            if key is not None and csv_text is not None:
+                cache.put(key, {"result": results, "csv": csv_text})
+
+        results = dict(results, timings=timings.summary())
+        print(json.dumps(results))
+        return results
+
+    except Exception as e:
+        error_result = {
+            "status": "error",
+            "message": f"Prediction generation failed: {str(e)}"
+        }
+        print(json.dumps(error_result))
+        return error_result
 
-        # Check if model exists
-        model_path = model_dir / "lgbm_model.txt"
-        joblib_path = model_dir / "lightgbm_model.pkl"
-        feature_file = model_dir / "feature_names.json"
-
-        print(f"Looking for models in: {model_dir}")
-        print(f"LightGBM model path: {model_path}")
-        print(f"LightGBM model exists: {model_path.exists()}")
-        print(f"Joblib model path: {joblib_path}")
-        print(f"Joblib model exists: {joblib_path.exists()}")
-        print(f"Features file: {feature_file}")
-        print(f"Features file exists: {feature_file.exists()}")
-
-        if model_path.exists():
-            print("Loading LightGBM model...")
-            model = lgb.Booster(model_file=str(model_path))
-            print("Model loaded successfully!")
-        elif joblib_path.exists():
-            print("Loading joblib model...")
-            model = joblib.load(joblib_path)
-            print("Model loaded successfully!")
+
+def compute_predictions(category, store, start_date, end_date, predictor, stats, model_dir, data_dir,
+                        timings=None):
+    """Score one store/category over a date range.
+
+    Returns the API result and the rows for predictions.csv.
+    """
+    timings = timings or StageTimer("predict")
+    with timings.stage("load_model"):
+        if predictor is None:
+            predictor = load_predictor(model_dir)
+        if stats is None:
+            stats = load_demand_stats(data_dir, store, category)
+    feature_names = predictor["feature_names"]
+    feature_state = predictor["feature_state"]
+
+    # Use preprocessed data statistics if available
+    if stats is not None:
+        # Instead of filtering, create synthetic prediction data
+        with timings.stage("build_features") as stage:
+            pred_df = build_feature_frame([store or 'UNKNOWN'], [category or 'UNKNOWN'], start_date, end_date)
+            pred_df = add_calendar_prices(pred_df, load_lookups(data_dir), stats["avg_sell_price"])
+            pred_df = add_series_features(pred_df, feature_names, feature_state, start_date)
+            stage.add_rows(len(pred_df))
+        print(f"Created prediction DataFrame with shape: {pred_df.shape}")
+
+        # Use all required features
+        available_features = [f for f in feature_names if f in pred_df.columns]
+        print(f"Available features: {available_features}")
+        print(f"Required features: {feature_names}")
+
+        if len(available_features) >= len(feature_names):
+            print(f"Preparing prediction data with {len(pred_df)} rows and {len(feature_names)} features")
+            with timings.stage("build_features"):
+                X = feature_matrix(pred_df, feature_names)
+            print(f"Input shape for prediction: {X.shape}")
+            print(f"Sample input data:")
+            print(X.head())
+
+            if X.shape[0] > 0 and X.shape[1] > 0:
+                with timings.stage("predict") as stage:
+                    preds, bounds = score_rows(predictor, pred_df, X)
+                    stage.add_rows(len(X))
+
+                # Check original demand scale from training data for scaling reference
+                print(f"Original demand stats: mean={stats['demand_mean']:.2f}, max={stats['demand_max']:.2f}")
+
+                # If predictions are much smaller than original demand, they might need scaling
+                if stats['demand_mean'] > 10 and preds.mean() < 1:
+                    print(f"Scaling predictions up by factor of {stats['demand_mean']:.0f}")
+                    preds = preds * stats['demand_mean']
+                    if bounds is not None:
+                        bounds = {name: values * stats['demand_mean'] for name, values in bounds.items()}
+
+                pred_df["predicted_demand"] = preds
+                pred_df = add_bounds(pred_df, bounds)
+                confidence = interval_confidence(preds, bounds)
+                print(f"Generated {len(preds)} predictions")
+                print(f"Sample predictions: {preds[:5]}")
+                print(f"Prediction range: {preds.min():.3f} to {preds.max():.3f}")
+
+                df = pred_df
+            else:
+                raise ValueError(f"Invalid input shape: {X.shape}. No data available for prediction.")
         else:
-            print("ERROR: No trained model found!")
-            print(f"Checked paths:")
-            print(f"  - {model_path}")
-            print(f"  - {joblib_path}")
-            raise FileNotFoundError("Trained model not found. Please train the model first.")
-
-        # Load feature names
-        if feature_file.exists():
-            with open(feature_file, 'r') as f:
-                feature_names = json.load(f)
+            missing_features = set(feature_names) - set(available_features)
+            raise ValueError(f"Missing required features: {missing_features}")
+
+        # Rows for predictions.csv
+        if "date" in df.columns and "predicted_demand" in df.columns:
+            save_df = df[["date", "store_id", "cat_id", "sell_price", "event", "predicted_demand"]
+                         + bound_columns(df)].copy()
         else:
-            feature_names = ['sell_price', 'weekday', 'month', 'year']
-
-        # Load preprocessed data if available
-        data_file = data_dir / "m5_preprocessed_sample.csv"
-        if data_file.exists():
-            df = pd.read_csv(data_file)
-
-            # Create date features
-            if 'date' in df.columns:
-                df["date"] = pd.to_datetime(df["date"])
-                df["weekday"] = df["date"].dt.weekday
-                df["month"] = df["date"].dt.month
-                df["year"] = df["date"].dt.year
-
-            # Fill missing sell_price
-            if 'sell_price' in df.columns:
-                df["sell_price"] = df["sell_price"].fillna(0)
-            else:
-                df["sell_price"] = 10.0
-
-            print(f"Initial data shape: {df.shape}")
-            print(f"Available stores: {df['store_id'].unique()[:10] if 'store_id' in df.columns else 'No store_id column'}")
-            print(f"Available categories: {df['cat_id'].unique()[:10] if 'cat_id' in df.columns else 'No cat_id column'}")
-
-            # Instead of filtering, create synthetic prediction data
-            # Parse dates
-            if not start_date or not end_date:
-                start_date = "2024-01-01"
-                end_date = "2024-01-07"
-
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-
-            # Generate date range
-            date_range = []
-            current_date = start_dt
-            while current_date <= end_dt:
-                date_range.append(current_date)
-                current_date += timedelta(days=1)
-
-            print(f"Creating synthetic data for {len(date_range)} days")
-
-            # Create synthetic prediction data
-            prediction_data = []
-            avg_sell_price = df['sell_price'].mean() if 'sell_price' in df.columns and len(df) > 0 else 10.0
-
-            for date in date_range:
-                row = {
-                    'sell_price': avg_sell_price,
-                    'weekday': date.weekday(),
-                    'month': date.month,
-                    'year': date.year,
-                    'date': date.strftime('%Y-%m-%d'),
-                    'store_id': store or 'UNKNOWN',
-                    'cat_id': category or 'UNKNOWN'
-                }
-                prediction_data.append(row)
-
-            # Create DataFrame for prediction
-            pred_df = pd.DataFrame(prediction_data)
-            print(f"Created prediction DataFrame with shape: {pred_df.shape}")
-
-            # Use all required features
-            available_features = [f for f in feature_names if f in pred_df.columns]
-            print(f"Available features: {available_features}")
-            print(f"Required features: {feature_names}")
-
-            if len(available_features) >= len(feature_names):
-                print(f"Preparing prediction data with {len(pred_df)} rows and {len(feature_names)} features")
-                X = pred_df[feature_names].fillna(0)
-                print(f"Input shape for prediction: {X.shape}")
-                print(f"Sample input data:")
-                print(X.head())
-
-                if X.shape[0] > 0 and X.shape[1] > 0:
-                    preds = model.predict(X)
-
-                    # Check original demand scale from training data for scaling reference
-                    if 'demand' in df.columns:
-                        original_demand_stats = df['demand'].describe()
-                        print(f"Original demand stats: mean={original_demand_stats['mean']:.2f}, max={original_demand_stats['max']:.2f}")
-
-                        # If predictions are much smaller than original demand, they might need scaling
-                        if original_demand_stats['mean'] > 10 and preds.mean() < 1:
-                            print(f"Scaling predictions up by factor of {original_demand_stats['mean']:.0f}")
-                            preds = preds * original_demand_stats['mean']
-
-                    pred_df["predicted_demand"] = preds
-                    print(f"Generated {len(preds)} predictions")
-                    print(f"Sample predictions: {preds[:5]}")
-                    print(f"Prediction range: {preds.min():.3f} to {preds.max():.3f}")
-
-                    # Use the prediction DataFrame instead of original df
-                    df = pred_df
-                else:
-                    raise ValueError(f"Invalid input shape: {X.shape}. No data available for prediction.")
-            else:
-                missing_features = set(feature_names) - set(available_features)
-                raise ValueError(f"Missing required features: {missing_features}")
-
-            # Save predictions to CSV
-            output_file = data_dir / "predictions.csv"
-            if "date" in df.columns and "predicted_demand" in df.columns:
-                # Save with proper columns
-                save_df = df[["date", "store_id", "cat_id", "predicted_demand"]].copy()
-                save_df.to_csv(output_file, index=False)
-                print(f"Predictions saved to {output_file}")
-            else:
-                print("Warning: Missing required columns for CSV saving")
-
-            # Format results for API
-            predictions = []
-            for idx, row in df.head(20).iterrows():  # Limit to first 20 rows
-                date_str = row.get('date', start_date or '2024-01-01')
-                if pd.isna(date_str):
-                    date_str = start_date or '2024-01-01'
-
-                predictions.append({
-                    'date': str(date_str)[:10],  # YYYY-MM-DD format
-                    'store_id': store or row.get('store_id', 'UNKNOWN'),
-                    'cat_id': category or row.get('cat_id', 'UNKNOWN'),
-                    'prediction': round(float(row.get('predicted_demand', 0)), 2),
-                    'confidence': max(0.7, 0.85 + np.random.normal(0, 0.05))
-                })
-
-            results = {
-                "status": "success",
-                "message": "Predictions generated successfully",
-                "predictions": predictions,
-                "total_predictions": len(predictions),
-                "prediction_period": f"{start_date} to {end_date}" if start_date and end_date else "Historical data",
-                "model_version": "LightGBM_v1.2",
-                "features_used": feature_names
+            save_df = None
+            print("Warning: Missing required columns for CSV saving")
+
+        # Format results for API
+        predictions = []
+        for idx, row in df.head(20).iterrows():  # Limit to first 20 rows
+            date_str = row.get('date', start_date or '2024-01-01')
+            if pd.isna(date_str):
+                date_str = start_date or '2024-01-01'
+
+            prediction = {
+                'date': str(date_str)[:10],  # YYYY-MM-DD format
+                'store_id': store or row.get('store_id', 'UNKNOWN'),
+                'cat_id': category or row.get('cat_id', 'UNKNOWN'),
+                'prediction': round(float(row.get('predicted_demand', 0)), 2),
+                'confidence': round(float(confidence[idx]), 3) if has_interval(confidence, idx) else None,
+                'sell_price': round(float(row['sell_price']), 2),
+                'event': row['event'] if pd.notna(row['event']) else None
             }
+            if has_interval(confidence, idx):
+                prediction['lower'] = round(float(row['predicted_lower']), 2)
+                prediction['upper'] = round(float(row['predicted_upper']), 2)
+            predictions.append(prediction)
+
+        results = {
+            "status": "success",
+            "message": "Predictions generated successfully",
+            "predictions": predictions,
+            "total_predictions": len(predictions),
+            "rows_scored": len(df),
+            "prediction_period": f"{start_date} to {end_date}" if start_date and end_date else "Historical data",
+            "prediction_interval": interval_of(predictor),
+            "feature_history": history_gap(feature_state, start_date),
+            "model_version": predictor["model_version"],
+            "features_used": feature_names
+        }
 
-            print(json.dumps(results))
-            return results
-        else:
-            # Generate mock predictions if no processed data available
-            if not start_date or not end_date:
-                start_date = "2024-01-01"
-                end_date = "2024-01-07"
-
-            # Parse dates
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-
-            # Generate date range
-            date_range = []
-            current_date = start_dt
-            while current_date <= end_dt:
-                date_range.append(current_date)
-                current_date += timedelta(days=1)
-
-            predictions = []
-
-            for date in date_range:
-                # Create feature vector for this date
-                features = {}
-
-                # Basic date features
-                features['year'] = date.year
-                features['month'] = date.month
-                features['weekday'] = date.weekday()
-                features['sell_price'] = 10.0  # Default price
-
-                # Create feature vector using only available features
-                X = np.array([[features.get(feat, 0) for feat in feature_names]])
-
-                try:
-                    # Make prediction
-                    pred = model.predict(X)[0]
-                except:
-                    # Fallback prediction
-                    pred = np.random.uniform(100, 500)
-
-                # Add some category and store specific variation
-                category_multiplier = {
-                    'HOBBIES': 1.2,
-                    'HOUSEHOLD': 0.9,
-                    'FOODS': 1.5,
-                    'ELECTRONICS': 0.8,
-                    'CLOTHING': 1.1,
-                    'SPORTS': 1.0
-                }.get(category, 1.0)
-
-                store_multiplier = {
-                    'CA_1': 1.3, 'CA_2': 1.1, 'CA_3': 0.9,
-                    'TX_1': 1.2, 'TX_2': 1.0, 'TX_3': 0.8,
-                    'WI_1': 0.9, 'WI_2': 1.1, 'WI_3': 1.0
-                }.get(store, 1.0)
-
-                adjusted_pred = max(0, pred * category_multiplier * store_multiplier)
-
-                # Calculate confidence (simulate based on prediction variance)
-                base_confidence = 0.85
-                confidence = min(0.95, base_confidence + np.random.normal(0, 0.05))
-
-                predictions.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'store_id': store or 'CA_1',
-                    'cat_id': category or 'HOBBIES',
-                    'prediction': round(adjusted_pred, 0),
-                    'confidence': max(0.7, confidence)
-                })
-
-            # Save predictions to CSV
-            predictions_df = pd.DataFrame(predictions)
-            predictions_df.rename(columns={'prediction': 'predicted_demand'}, inplace=True)
-            output_file = data_dir / "predictions.csv"
-            predictions_df.to_csv(output_file, index=False)
-            print(f"Predictions saved to {output_file}")
-
-            # Prepare results
-            results = {
-                "status": "success",
-                "message": "Predictions generated successfully (using mock data)",
-                "predictions": predictions,
-                "total_predictions": len(predictions),
-                "prediction_period": f"{start_date} to {end_date}",
-                "model_version": "LightGBM_v1.2",
-                "features_used": feature_names
+        return results, save_df
+    else:
+        # Generate mock predictions if no processed data available
+        with timings.stage("build_features") as stage:
+            mock_df = build_feature_frame([store or 'CA_1'], [category or 'HOBBIES'], start_date, end_date)
+            mock_df['sell_price'] = 10.0  # Default price
+            mock_df = add_series_features(mock_df, feature_names, feature_state, start_date)
+            X = feature_matrix(mock_df, feature_names)
+            stage.add_rows(len(X))
+
+        with timings.stage("predict") as stage:
+            try:
+                # Score every day in one call
+                preds, bounds = score_rows(predictor, mock_df, X)
+            except Exception:
+                # Fallback prediction
+                preds = np.random.uniform(100, 500, size=len(mock_df))
+                bounds = None
+            stage.add_rows(len(X))
+
+        # Add some category and store specific variation
+        multiplier = CATEGORY_MULTIPLIERS.get(category, 1.0) * STORE_MULTIPLIERS.get(store, 1.0)
+        adjusted_preds = np.maximum(0, preds * multiplier)
+        if bounds is not None:
+            bounds = {name: np.maximum(0, values * multiplier) for name, values in bounds.items()}
+        confidence = interval_confidence(adjusted_preds, bounds)
+
+        predictions = []
+        for i, (date, adjusted_pred) in enumerate(zip(mock_df['date'], adjusted_preds)):
+            prediction = {
+                'date': date,
+                'store_id': store or 'CA_1',
+                'cat_id': category or 'HOBBIES',
+                'prediction': round(float(adjusted_pred), 0),
+                'confidence': round(float(confidence[i]), 3) if has_interval(confidence, i) else None
             }
+            if has_interval(confidence, i):
+                prediction['lower'] = round(float(bounds['lower'][i]), 0)
+                prediction['upper'] = round(float(bounds['upper'][i]), 0)
+            predictions.append(prediction)
+
+        # Rows for predictions.csv
+        predictions_df = pd.DataFrame(predictions)
+        predictions_df.rename(columns={'prediction': 'predicted_demand', 'lower': 'predicted_lower',
+                                       'upper': 'predicted_upper'}, inplace=True)
+
+        # Prepare results
+        results = {
+            "status": "success",
+            "message": "Predictions generated successfully (using mock data)",
+            "predictions": predictions,
+            "total_predictions": len(predictions),
+            "rows_scored": len(mock_df),
+            "prediction_period": f"{start_date} to {end_date}",
+            "prediction_interval": interval_of(predictor),
+            "feature_history": history_gap(feature_state, start_date),
+            "model_version": predictor["model_version"],
+            "features_used": feature_names
+        }
 
-            print(json.dumps(results))
-            return results
+        return results, predictions_df
+
+
+def load_group_stats(data_dir, stores, categories):
+    """Average price and demand per store_id/cat_id, plus overall fallbacks.
+
+    Returns (per-group frame indexed by store_id/cat_id, overall stats dict),
+    or None when no processed data is available.
+    """
+    stats = load_feature_stats(data_dir)
+    if stats is None:
+        return None
+
+    rows = []
+    for store in stores:
+        for category in categories:
+            group = lookup_stats(stats, store, category)
+            rows.append({
+                "store_id": store,
+                "cat_id": category,
+                "avg_sell_price": group["avg_sell_price"],
+                "demand_mean": group["demand_mean"],
+            })
+    per_group = pd.DataFrame(rows).set_index(["store_id", "cat_id"])
+    return per_group, stats["overall"]
+
+
+def score_grid(predictor, stores, categories, start_date, end_date, group_stats=None, timings=None,
+               lookups=None):
+    """Predict demand for every store x category x day in one pass.
+
+    Each model (one, or one per partition) is called once for all its rows.
+
+    Returns a frame with date, store_id, cat_id, sell_price, event and
+    predicted_demand, plus predicted_lower/median/upper when quantile models
+    are available. Prices and events come from `lookups` where the calendar
+    covers the date.
+    """
+    timings = timings or StageTimer("predict")
+    with timings.stage("build_features") as stage:
+        grid = build_feature_frame(stores, categories, start_date, end_date)
+        keys = pd.MultiIndex.from_arrays([grid["store_id"], grid["cat_id"]])
+
+        if group_stats is not None:
+            per_group, overall = group_stats
+            looked_up = per_group.reindex(keys)
+            default_price = looked_up["avg_sell_price"].fillna(overall["avg_sell_price"]).to_numpy()
+            demand_mean = looked_up["demand_mean"].fillna(overall["demand_mean"]).to_numpy()
+        else:
+            default_price = 10.0
+            demand_mean = None
+        grid = add_calendar_prices(grid, lookups, default_price)
+
+        feature_names = predictor["feature_names"]
+        grid = add_series_features(grid, feature_names, predictor["feature_state"], start_date)
+        X = feature_matrix(grid, feature_names)
+        stage.add_rows(len(grid))
+
+    with timings.stage("predict") as stage:
+        preds, bounds = score_rows(predictor, grid, X)
+        stage.add_rows(len(grid))
+    bounds = bounds or {}
+
+    if demand_mean is not None:
+        # Same rescaling rule as the single-series path, applied per group
+        group_pred_mean = pd.Series(preds).groupby([grid["store_id"], grid["cat_id"]]).transform("mean").to_numpy()
+        rescale = (demand_mean > 10) & (group_pred_mean < 1)
+        preds = np.where(rescale, preds * demand_mean, preds)
+        bounds = {name: np.where(rescale, values * demand_mean, values) for name, values in bounds.items()}
+    else:
+        multipliers = (
+            grid["cat_id"].map(CATEGORY_MULTIPLIERS).fillna(1.0).to_numpy()
+            * grid["store_id"].map(STORE_MULTIPLIERS).fillna(1.0).to_numpy()
+        )
+        preds = np.maximum(0, preds * multipliers)
+        bounds = {name: np.maximum(0, values * multipliers) for name, values in bounds.items()}
+
+    grid["predicted_demand"] = preds
+    grid = add_bounds(grid, bounds or None)
+    return grid[["date", "store_id", "cat_id", "sell_price", "event", "predicted_demand"] + bound_columns(grid)]
+
+
+def predict_batch(stores=None, categories=None, start_date=None, end_date=None,
+                  output_file=None, predictor=None):
+    """Forecast a whole store x category x date grid and write it as CSV"""
+    timings = StageTimer("predict_batch")
+    try:
+        base_dir = project_dir()
+        model_dir = base_dir / "python" / "models"
+        data_dir = base_dir / "python" / "data" / "processed"
+
+        with timings.stage("load_model"):
+            if predictor is None:
+                predictor = load_predictor(model_dir)
+
+        if not stores:
+            stores = list(list_partitions(data_dir)) or DEFAULT_STORES
+        if not categories:
+            categories = DEFAULT_CATEGORIES
+        if not start_date:
+            start_date = "2024-01-01"
+        if not end_date:
+            end_date = (pd.Timestamp(start_date) + pd.Timedelta(days=DEFAULT_HORIZON_DAYS - 1)).strftime('%Y-%m-%d')
+
+        print(f"Batch forecast: {len(stores)} stores x {len(categories)} categories, {start_date} to {end_date}")
+        with timings.stage("load_model"):
+            group_stats = load_group_stats(data_dir, stores, categories)
+        forecast = score_grid(predictor, stores, categories, start_date, end_date, group_stats, timings,
+                              load_lookups(data_dir))
+        print(f"Generated {len(forecast):,} predictions")
+
+        output_file = Path(output_file) if output_file else data_dir / "predictions.csv"
+        with timings.stage("write") as stage:
+            with atomic_path(output_file) as tmp_path:
+                forecast.to_csv(tmp_path, index=False, chunksize=100000)
+            stage.add_rows(len(forecast))
+        print(f"Predictions saved to {output_file}")
+
+        results = {
+            "status": "success",
+            "message": "Batch predictions generated successfully",
+            "total_predictions": len(forecast),
+            "rows_scored": len(forecast),
+            "stores": list(stores),
+            "categories": list(categories),
+            "prediction_period": f"{start_date} to {end_date}",
+            "prediction_interval": interval_of(predictor),
+            "feature_history": history_gap(predictor["feature_state"], start_date),
+            "output_file": str(output_file),
+            "model_version": predictor["model_version"],
+            "features_used": predictor["feature_names"],
+            "timings": timings.summary()
+        }
+
+        print(json.dumps(results))
+        return results
 
     except Exception as e:
         error_result = {
             "status": "error",
-            "message": f"Prediction generation failed: {str(e)}"
+            "message": f"Batch prediction failed: {str(e)}"
         }
         print(json.dumps(error_result))
         return error_result
@@ -293,12 +842,21 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         # Parse command line arguments
         params = json.loads(sys.argv[1])
-        category = params.get('category')
-        store = params.get('store')
         start_date = params.get('start_date')
         end_date = params.get('end_date')
 
-        generate_predictions(category, store, start_date, end_date)
+        if params.get('mode') == 'batch':
+            predict_batch(
+                params.get('stores'),
+                params.get('categories'),
+                start_date,
+                end_date,
+                params.get('output_file')
+            )
+        else:
+            category = params.get('category')
+            store = params.get('store')
+            generate_predictions(category, store, start_date, end_date)
     else:
         # Default test case
         generate_predictions('HOBBIES', 'CA_1', '2024-01-01', '2024-01-07')
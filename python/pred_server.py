@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Long-lived prediction worker for the /predict endpoint.
+
+Loads the LightGBM model, feature names, series feature context and demand
+statistics once and answers requests over a JSON-lines protocol on
+stdin/stdout:
+
+    request:  {"id": 1, "params": {"category": "FOODS", "store": "CA_1", ...}}
+    response: {"id": 1, "result": {...}}
+
+A request with "command": "batch" forecasts a whole stores x categories
+grid (see pred.predict_batch).
+
+Progress output from the prediction code is sent to stderr so stdout only
+carries protocol lines. The model is reloaded when lgbm_model.txt or the
+files written alongside it change on disk, and cached statistics are dropped when
+the processed dataset changes.
+"""
+
+import json
+import sys
+from contextlib import redirect_stdout
+
+from pred import generate_predictions, load_demand_stats, load_predictor, predict_batch
+from registry import CURRENT_FILE, registry_dir
+from feature_stats import STATS_FILE
+from storage import PROCESSED_CSV, PROCESSED_DATASET, project_dir
+
+
+def file_signature(*paths):
+    """Modification times of the given paths (None for missing ones)"""
+    return tuple(path.stat().st_mtime_ns if path.exists() else None for path in paths)
+
+
+class PredictionState:
+    """Models, feature names and statistics kept warm between requests"""
+
+    def __init__(self, model_dir, data_dir):
+        self.model_dir = model_dir
+        self.data_dir = data_dir
+        self.predictor = None
+        self.model_signature = None
+        self.data_signature = None
+        self.stats = {}
+
+    def refresh(self):
+        """Reload the model and drop cached statistics if files changed"""
+        model_signature = file_signature(
+            self.model_dir / "lgbm_model.txt",
+            self.model_dir / "lightgbm_model.pkl",
+            self.model_dir / "feature_names.json",
+            self.model_dir / "feature_state.npz",
+            registry_dir(self.model_dir) / CURRENT_FILE,
+        )
+        if self.predictor is None or model_signature != self.model_signature:
+            self.predictor = load_predictor(self.model_dir)
+            self.model_signature = model_signature
+
+        data_signature = file_signature(
+            self.data_dir / PROCESSED_DATASET,
+            self.data_dir / PROCESSED_CSV,
+            self.data_dir / STATS_FILE,
+        )
+        if data_signature != self.data_signature:
+            self.stats = {}
+            self.data_signature = data_signature
+
+    def demand_stats(self, store, category):
+        """Cached demand statistics for a store/category"""
+        key = (store, category)
+        if key not in self.stats:
+            self.stats[key] = load_demand_stats(self.data_dir, store, category)
+        return self.stats[key]
+
+
+def handle_request(state, params):
+    """Run one prediction request against the warm state"""
+    try:
+        state.refresh()
+        store = params.get('store')
+        category = params.get('category')
+        return generate_predictions(
+            category,
+            store,
+            params.get('start_date'),
+            params.get('end_date'),
+            predictor=state.predictor,
+            stats=state.demand_stats(store, category),
+        )
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Prediction generation failed: {str(e)}"
+        }
+
+
+def handle_batch(state, params):
+    """Run one batch (store x category x date grid) request against the warm state"""
+    try:
+        state.refresh()
+        return predict_batch(
+            params.get('stores'),
+            params.get('categories'),
+            params.get('start_date'),
+            params.get('end_date'),
+            params.get('output_file'),
+            predictor=state.predictor,
+        )
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Batch prediction failed: {str(e)}"
+        }
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    """Answer JSON-lines requests from stdin until EOF or a shutdown command"""
+    base_dir = project_dir()
+    state = PredictionState(
+        base_dir / "python" / "models",
+        base_dir / "python" / "data" / "processed",
+    )
+
+    def send(message):
+        stdout.write(json.dumps(message) + "\n")
+        stdout.flush()
+
+    send({"event": "ready"})
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            send({"id": None, "result": {"status": "error", "message": f"Invalid request: {e}"}})
+            continue
+
+        command = request.get("command", "predict")
+        if command == "shutdown":
+            break
+        if command == "ping":
+            send({"id": request.get("id"), "result": {"status": "success", "message": "pong"}})
+            continue
+
+        handler = handle_batch if command == "batch" else handle_request
+        with redirect_stdout(sys.stderr):
+            result = handler(state, request.get("params") or {})
+        send({"id": request.get("id"), "result": result})
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Manifest of what preprocessing has already written.
+
+app.py records, in preprocess_manifest.json next to the processed
+dataset, the day columns and series it processed, hashes of the uploads
+and of the history those rows were built from, and the next free part
+number. A later run over an extended sales file then only melts the new
+day columns of known series plus every day of new series, and appends
+them as new parts.
+
+The history hashes cover the sales values, the calendar rows (with their
+encoded events) and the prices of the processed days. They are sums of
+per-row hashes, so they can be accumulated chunk by chunk in any order.
+If any of them changed, e.g. a corrected upload or a new event name that
+shifts the event codes, the rows already written are stale and the
+dataset is rebuilt instead.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import atomic_path
+
+MANIFEST_FILE = "preprocess_manifest.json"
+HASH_MOD = 2 ** 64
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame_hash(df):
+    """Order-independent hash of a frame's rows (sum of row hashes mod 2**64)"""
+    if len(df) == 0:
+        return 0
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return int(np.add.reduce(hashes, dtype=np.uint64))
+
+
+def combine(*hashes):
+    return sum(hashes) % HASH_MOD
+
+
+def calendar_hash(lookups, days):
+    """Hash of the encoded calendar rows of the given d_* days"""
+    day_idx = lookups.day_index(days)
+    rows = pd.DataFrame({col: lookups.calendar[col][day_idx] for col in lookups.calendar_columns})
+    rows.insert(0, "d", np.asarray(days, dtype=str))
+    return f"{frame_hash(rows):016x}"
+
+
+def history_hash(chunk, days, lookups):
+    """Hash of the sales values and weekly prices of the chunk's series over `days`"""
+    if len(chunk) == 0:
+        return 0
+    sales = chunk[["id"] + list(days)]
+
+    weeks = np.unique(lookups.week_idx[lookups.day_index(days)])
+    item_codes = lookups.item_codes(chunk["item_id"])[:, None]
+    store_codes = lookups.store_codes(chunk["store_id"])[:, None]
+    prices = lookups.prices[item_codes, store_codes, weeks[None, :]]
+    prices[((item_codes < 0) | (store_codes < 0)).ravel()] = np.nan
+    price_rows = pd.DataFrame(prices)
+    price_rows.insert(0, "id", chunk["id"].astype(str).to_numpy())
+
+    return combine(frame_hash(sales), frame_hash(price_rows))
+
+
+def load_manifest(data_dir):
+    """Manifest of the last preprocessing run (None if missing)"""
+    try:
+        with open(Path(data_dir) / MANIFEST_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(data_dir, manifest):
+    with atomic_path(Path(data_dir) / MANIFEST_FILE) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+    return manifest
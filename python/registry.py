@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Versioned model registry.
+
+Each training run is stored under python/models/registry/<version>/ with
+its model files and a manifest.json recording the partitioning, features,
+metrics and the fingerprint of the data it was trained on. The CURRENT
+file names the version pred.py should serve.
+"""
+
+import json
+import shutil
+import time
+from pathlib import Path
+
+from storage import atomic_path
+
+REGISTRY_DIR = "registry"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def registry_dir(model_dir):
+    """Root of the registry inside the models directory"""
+    return Path(model_dir) / REGISTRY_DIR
+
+
+def new_version_dir(model_dir):
+    """Create an empty directory for a new model version"""
+    root = registry_dir(model_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S")
+    suffix = 0
+    while (root / (version if suffix == 0 else f"{version}-{suffix}")).exists():
+        suffix += 1
+    version_dir = root / (version if suffix == 0 else f"{version}-{suffix}")
+    version_dir.mkdir()
+    return version_dir
+
+
+def discard_version_dir(version_dir):
+    """Remove a version directory whose run failed before writing its manifest"""
+    version_dir = Path(version_dir)
+    if version_dir.exists() and not (version_dir / MANIFEST_FILE).exists():
+        shutil.rmtree(version_dir, ignore_errors=True)
+
+
+def write_manifest(version_dir, manifest, make_current=True):
+    """Write manifest.json for a version and optionally mark it current"""
+    version_dir = Path(version_dir)
+    manifest = dict(manifest, version=version_dir.name)
+    manifest.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S"))
+    with atomic_path(version_dir / MANIFEST_FILE) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+    if make_current:
+        with atomic_path(version_dir.parent / CURRENT_FILE) as tmp_path:
+            tmp_path.write_text(version_dir.name)
+    return manifest
+
+
+def current_version_dir(model_dir):
+    """Directory of the current version (None if nothing is registered)"""
+    root = registry_dir(model_dir)
+    current_file = root / CURRENT_FILE
+    if not current_file.exists():
+        return None
+    version_dir = root / current_file.read_text().strip()
+    return version_dir if (version_dir / MANIFEST_FILE).exists() else None
+
+
+def load_manifest(version_dir):
+    """Read a version's manifest"""
+    with open(Path(version_dir) / MANIFEST_FILE, "r") as f:
+        return json.load(f)
+
+
+def current_manifest(model_dir):
+    """Manifest of the current version (None if nothing is registered)"""
+    version_dir = current_version_dir(model_dir)
+    return load_manifest(version_dir) if version_dir is not None else None
+
+
+def partition_key(partition_by, store=None, category=None):
+    """Partition value a store/category request routes to"""
+    if partition_by == "store_id":
+        return store
+    if partition_by == "cat_id":
+        return category
+    return None
+
+
+def quantile_model_files(manifest):
+    """Quantile booster files of a version keyed like manifest["models"]: {model key: {alpha: file}}.
+
+    Versions written before quantile models were partitioned list one flat
+    {alpha: file} set, which belongs to the global model.
+    """
+    files = (manifest or {}).get("quantile_models") or {}
+    if any(isinstance(model_file, str) for model_file in files.values()):
+        return {"global": files}
+    return files
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Cache of prediction results.
+
+Results are keyed on (model version, feature version, store, category,
+start_date, end_date). The model version hashes the files pred.py loads
+the model from and the feature version hashes the series context, demand
+statistics and price tables, so retraining or reprocessing changes the key and
+stale entries are never served; entries from older versions are dropped
+the first time a newer version is seen.
+
+Entries live in an in-memory LRU (per process, so pred_server.py workers
+stay warm) and, unless PREDICTION_CACHE=memory, in JSON files under
+python/data/cache/predictions shared by all workers and one-off pred.py
+runs. PREDICTION_CACHE=off disables caching. Entries expire after
+PREDICTION_CACHE_TTL seconds.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from feature_stats import STATS_FILE
+from lookups import LOOKUPS_FILE
+from registry import CURRENT_FILE, registry_dir
+from storage import atomic_path
+
+CACHE_MODE = os.environ.get("PREDICTION_CACHE", "disk")
+CACHE_TTL_SECONDS = float(os.environ.get("PREDICTION_CACHE_TTL", 24 * 3600))
+MAX_MEMORY_ENTRIES = 256
+MAX_DISK_ENTRIES = 5000
+
+MODEL_FILES = ["lgbm_model.txt", "lightgbm_model.pkl", "feature_names.json"]
+FEATURE_FILES = ["feature_state.npz"]
+
+
+def files_hash(paths):
+    """Short hash of the names, sizes and mtimes of paths (missing ones included)"""
+    digest = hashlib.sha1()
+    for path in paths:
+        path = Path(path)
+        if path.exists():
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        else:
+            digest.update(f"{path.name}:missing\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def model_version(model_dir):
+    """Identity of the model(s) pred.py would load from model_dir"""
+    model_dir = Path(model_dir)
+    current = registry_dir(model_dir) / CURRENT_FILE
+    version = current.read_text().strip() if current.exists() else ""
+    return f"{files_hash([model_dir / name for name in MODEL_FILES])}{version and '-' + version}"
+
+
+def feature_version(model_dir, data_dir):
+    """Identity of the series context, demand statistics and price tables predictions use"""
+    return files_hash([Path(model_dir) / name for name in FEATURE_FILES]
+                      + [Path(data_dir) / STATS_FILE, Path(data_dir) / LOOKUPS_FILE])
+
+
+def cache_key(model_ver, feature_ver, store, category, start_date, end_date):
+    return (model_ver, feature_ver, store, category, start_date, end_date)
+
+
+class ResultCache:
+    """In-memory LRU of prediction results with an optional disk tier"""
+
+    def __init__(self, cache_dir=None, max_entries=MAX_MEMORY_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_disk_entries=MAX_DISK_ENTRIES):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.versions = None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def version_dir(self, key):
+        return self.cache_dir / f"{key[0]}_{key[1]}"
+
+    def entry_path(self, key):
+        name = hashlib.sha1(json.dumps(key[2:]).encode()).hexdigest()[:20]
+        return self.version_dir(key) / f"{name}.json"
+
+    def check_versions(self, key):
+        """Drop everything cached for other model/feature versions"""
+        if key[:2] == self.versions:
+            return
+        self.entries.clear()
+        self.versions = key[:2]
+        if self.cache_dir is None or not self.cache_dir.exists():
+            return
+        keep = self.version_dir(key).name
+        for path in self.cache_dir.iterdir():
+            if path.is_dir() and path.name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, key):
+        """Cached value for key, or None"""
+        self.check_versions(key)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if now - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits["memory"] += 1
+                return entry[1]
+            del self.entries[key]
+
+        if self.cache_dir is not None:
+            path = self.entry_path(key)
+            try:
+                with open(path, "r") as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                stored = None
+            if stored is not None and stored["key"] == list(key) and now - stored["created"] <= self.ttl_seconds:
+                self.remember(key, stored["value"], stored["created"])
+                self.hits["disk"] += 1
+                return stored["value"]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store a JSON-serialisable value"""
+        self.check_versions(key)
+        created = time.time()
+        self.remember(key, value, created)
+        if self.cache_dir is None:
+            return
+
+        path = self.entry_path(key)
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump({"key": list(key), "created": created, "value": value}, f)
+        self.trim_disk(path.parent)
+
+    def remember(self, key, value, created):
+        self.entries[key] = (created, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def trim_disk(self, version_dir):
+        """Remove the oldest disk entries beyond max_disk_entries"""
+        files = list(version_dir.glob("*.json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda path: path.stat().st_mtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": dict(self.hits), "misses": self.misses}
+
+
+def default_cache(cache_dir, mode=CACHE_MODE):
+    """ResultCache for the configured PREDICTION_CACHE mode (None when off)"""
+    if mode == "off":
+        return None
+    return ResultCache(cache_dir if mode == "disk" else None)
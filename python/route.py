@@ -5,24 +5,104 @@ Route optimization script using OSRM and Folium with emissions.
 
 import pandas as pd
 import numpy as np
-import networkx as nx
 import folium
-import requests
 import json
 import sys
-from pathlib import Path
 
-def optimize_route(demand_threshold=10.0, top_stores=5):
-    """Optimize delivery route based on demand predictions"""
+from demand_stream import aggregate_demand
+from geojson_map import SIMPLIFY_TOLERANCE_M, feature_collection, write_geojson_map
+from instrument import StageTimer
+from route_backend import routing_client
+from route_solver import solve_tsp, solve_vrp, tour_length
+from storage import atomic_path, project_dir
+from store_index import load_store_index
+
+ROUTE_COLORS = ["blue", "purple", "orange", "darkred", "cadetblue", "darkgreen"]
+MAPTILER_KEY = "2sYJ1vozDNyamVYRoWLM"
+# Start node placed at the first store when no depot is given
+START_ID = "START"
+
+
+def render_folium_map(stops, geometries, total_distance_km, total_emissions_kg, output_map):
+    """Full folium page with a marker per stop and each vehicle's route"""
+    m = folium.Map(
+        location=[stops["lat"].mean(), stops["lon"].mean()],
+        zoom_start=6,
+        tiles=f"https://api.maptiler.com/maps/streets-v2/{{z}}/{{x}}/{{y}}.png?key={MAPTILER_KEY}",
+        attr="MapTiler"
+    )
+
+    # Add markers
+    for idx, row in stops.iterrows():
+        folium.Marker(
+            location=[row["lat"], row["lon"]],
+            popup=f"Store: {row['store_id']}<br>State: {row['state']}",
+            tooltip=f"{row['store_id']} ({row['state']})",
+            icon=folium.Icon(color="green" if row["store_id"] == "DEPOT" else "red", icon="info-sign")
+        ).add_to(m)
+
+    for vehicle, geometry in enumerate(geometries):
+        folium.PolyLine(
+            locations=geometry,
+            color=ROUTE_COLORS[vehicle % len(ROUTE_COLORS)],
+            weight=5,
+            opacity=0.8
+        ).add_to(m)
+
+    # Summary
+    summary_html = f"""
+    <div style="
+        position: fixed;
+        bottom: 50px;
+        left: 50px;
+        width: 250px;
+        padding: 15px;
+        background-color: rgba(255,255,255,0.9);
+        border: 2px solid #333;
+        border-radius: 8px;
+        box-shadow: 2px 2px 6px rgba(0,0,0,0.3);
+        font-family: Arial, sans-serif;
+        z-index: 9999;
+    ">
+    <h4 style="margin:0 0 10px 0; font-size:16px; color:#333;">Total Route Summary</h4>
+    <p style="margin:0; font-size:14px;"><strong>Distance:</strong> {total_distance_km:.1f} km</p>
+    <p style="margin:0; font-size:14px;"><strong>CO₂ Emissions:</strong> {total_emissions_kg:.1f} kg</p>
+    </div>
+    """
+    m.get_root().html.add_child(folium.Element(summary_html))
+
+    # Save map
+    with atomic_path(output_map) as tmp_path:
+        m.save(str(tmp_path))
+
+
+def optimize_route(demand_threshold=10.0, top_stores=5, vehicle_capacity=None, vehicles=None,
+                   round_trip=False, depot=None, backend=None, osrm_url=None,
+                   radius_km=None, zones=None, start_date=None, end_date=None,
+                   map_format="html", simplify_tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """Optimize delivery route based on demand predictions.
+
+    Stops are ordered by a nearest-neighbour + 2-opt/Or-opt solver. With a
+    vehicle_capacity the stores are split across vehicles by predicted demand.
+    `depot` is an optional {"lat", "lon"} start point; otherwise routes start
+    at the first selected store. `backend` ("osrm" or "haversine") and
+    `osrm_url` override the ROUTING_BACKEND / OSRM_URL environment.
+    Stores come from a cached spatial index: with a depot they are taken
+    nearest first, optionally within radius_km, and `zones` splits them
+    into that many delivery zones routed separately. start_date/end_date
+    restrict the predictions counted towards demand. map_format "geojson"
+    writes a compact, simplified GeoJSON plus a static HTML shell instead of
+    a full folium page.
+    """
+    timings = StageTimer("route")
     try:
         # CONFIG
-        MAPTILER_KEY = "2sYJ1vozDNyamVYRoWLM"
         threshold = demand_threshold
         N = top_stores
         EMISSION_FACTOR_KG_PER_KM = 0.27
 
         # Paths
-        base_dir = Path(__file__).parent.parent
+        base_dir = project_dir()
         data_dir = base_dir / "python" / "data" / "processed"
         uploads_dir = base_dir / "uploads"
 
@@ -39,160 +119,182 @@ def optimize_route(demand_threshold=10.0, top_stores=5):
                 'prediction': [150, 200, 175, 160, 145],
                 'date': pd.date_range('2024-01-01', periods=5)
             })
-            mock_predictions.to_csv(preds_file, index=False)
-            preds = mock_predictions
+            with atomic_path(preds_file) as tmp_path:
+                mock_predictions.to_csv(tmp_path, index=False)
             print(f"Created mock predictions with shape: {mock_predictions.shape}")
-        else:
-            print("Loading existing predictions file...")
-            preds = pd.read_csv(preds_file)
-            print(f"Loaded predictions with shape: {preds.shape}")
-            print(f"Predictions columns: {preds.columns.tolist()}")
-            print(f"Sample predictions:\n{preds.head()}")
-
-        preds["date"] = pd.to_datetime(preds["date"])
-        preds["state_id"] = preds["store_id"].str[:2] if "store_id" in preds.columns else preds["id"].str.split("_").str[3]
-
-        # Aggregate demand - handle both column name variations
-        demand_col = None
-        if "prediction" in preds.columns:
-            demand_col = "prediction"
-        elif "predicted_demand" in preds.columns:
-            demand_col = "predicted_demand"
-        else:
-            raise ValueError(f"No demand column found. Available columns: {preds.columns.tolist()}")
 
-        print(f"Using demand column: {demand_col}")
-        state_demand = preds.groupby("state_id")[demand_col].sum().reset_index()
+        # Stream the file once, keeping only per-store totals
+        print("Aggregating predictions file...")
+        with timings.stage("demand") as stage:
+            aggregated = aggregate_demand(preds_file, start_date, end_date)
+            stage.add_rows(aggregated["rows"])
+        print(f"Using demand column: {aggregated['demand_col']}")
+        print(f"Rows read: {aggregated['rows']:,}, in date window: {aggregated['rows_in_window']:,}")
+
+        state_demand = pd.Series(aggregated["state_totals"], dtype=float).rename_axis("state_id")
         print("Aggregated predicted demand per state:\n", state_demand)
 
         # Filter
-        selected_states = state_demand[state_demand.iloc[:,1] > threshold]
-        print("Selected states:\n", selected_states)
-
-        # Load or create mock store locations
-        stores_file = uploads_dir / "store_locations.csv"
-        if not stores_file.exists():
-            # Create mock store locations
-            mock_stores = pd.DataFrame({
-                'store_id': ['CA_1', 'CA_2', 'TX_1', 'TX_2', 'WI_1'],
-                'state': ['CA', 'CA', 'TX', 'TX', 'WI'],
-                'lat': [34.0522, 37.7749, 29.7604, 32.7767, 43.0731],
-                'lon': [-118.2437, -122.4194, -95.3698, -96.7970, -89.4012]
-            })
-            stores = mock_stores
-        else:
-            stores = pd.read_csv(stores_file)
+        selected_states = state_demand[state_demand > threshold].index
+        print("Selected states:", list(selected_states))
+        store_demand = pd.Series(aggregated["store_totals"], dtype=float)
 
-        routes_df = stores[stores["state"].isin(selected_states["state_id"])]
-        routes_df = routes_df.head(N)
+        # Candidate stores from the spatial index, nearest to the depot first
+        with timings.stage("select"):
+            index = load_store_index(uploads_dir, data_dir.parent / "cache")
+            if depot is not None and radius_km:
+                candidates = index.within_radius(depot["lat"], depot["lon"], radius_km)
+                print(f"{len(candidates)} stores within {radius_km} km of the depot")
+            elif depot is not None:
+                candidates = index.nearest(depot["lat"], depot["lon"], len(index.stores))
+            else:
+                candidates = index.stores
+
+            routes_df = candidates[candidates["state"].isin(selected_states)]
+            routes_df = routes_df.head(N)
 
         if len(routes_df) == 0:
             raise ValueError("No stores found for the given criteria")
 
         print(f"Selected stores:\n{routes_df}")
 
-        # Initialize map
-        center_lat = routes_df["lat"].mean()
-        center_lon = routes_df["lon"].mean()
+        # Predicted demand per selected store, used for vehicle loads
+        routes_df = routes_df.reset_index(drop=True)
+        routes_df["demand"] = routes_df["store_id"].map(store_demand).fillna(0.0).to_numpy()
 
-        m = folium.Map(
-            location=[center_lat, center_lon],
-            zoom_start=6,
-            tiles=f"https://api.maptiler.com/maps/streets-v2/{{z}}/{{x}}/{{y}}.png?key={MAPTILER_KEY}",
-            attr="MapTiler"
-        )
+        # Stops: a zero-demand start node (the depot, or the first selected
+        # store's location) then every store with its own demand
+        if depot is not None:
+            start = {"store_id": "DEPOT", "state": "", "lat": depot["lat"], "lon": depot["lon"]}
+        else:
+            first = routes_df.iloc[0]
+            start = {"store_id": START_ID, "state": first["state"], "lat": first["lat"], "lon": first["lon"]}
+        stops = pd.concat([
+            pd.DataFrame([dict(start, demand=0.0)]),
+            routes_df[["store_id", "state", "lat", "lon", "demand"]],
+        ], ignore_index=True)
+        # The synthetic start shares its store's marker
+        marker_stops = stops[stops["store_id"] != START_ID]
 
-        # Add markers
-        for idx, row in routes_df.iterrows():
-            folium.Marker(
-                location=[row["lat"], row["lon"]],
-                popup=f"Store: {row['store_id']}<br>State: {row['state']}",
-                tooltip=f"{row['store_id']} ({row['state']})",
-                icon=folium.Icon(color="red", icon="info-sign")
-            ).add_to(m)
-
-        # Calculate route using OSRM or mock data
-        coords = list(zip(routes_df["lat"], routes_df["lon"]))
-        total_distance_km = 0
+        # Distance/duration matrix from the routing backend (cached on disk)
+        client = routing_client(data_dir.parent / "cache", backend, osrm_url)
+        stop_coords = list(zip(stops["lat"], stops["lon"]))
+        with timings.stage("matrix") as matrix_stage:
+            road_distance, road_duration = client.table(stop_coords)
+
+        # The solver needs symmetric costs; road matrices differ slightly by direction
+        dist = (road_distance + road_distance.T) / 2
 
-        if len(coords) > 1:
-            try:
-                # Try OSRM for routing
-                coord_str = ";".join([f"{lon},{lat}" for lat, lon in coords])
-                osrm_url = f"http://router.project-osrm.org/route/v1/driving/{coord_str}?overview=full&geometries=geojson"
-
-                response = requests.get(osrm_url, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    total_distance_km = data["routes"][0]["distance"] / 1000
-
-                    # Add route line
-                    route_coords = [(coord[1], coord[0]) for coord in data["routes"][0]["geometry"]["coordinates"]]
-                    folium.PolyLine(
-                        locations=route_coords,
-                        color="blue",
-                        weight=5,
-                        opacity=0.8
-                    ).add_to(m)
+        # Stores are routed per delivery zone when zones are requested
+        stop_zones = np.zeros(len(stops), dtype=int)
+        if zones and zones > 1 and len(stops) > 2:
+            stop_zones[1:] = index.zones(zones, stops.iloc[1:]).to_numpy()
+        zone_groups = [np.flatnonzero(stop_zones[1:] == zone) + 1 for zone in np.unique(stop_zones[1:])]
+
+        with timings.stage("solve") as solve_stage:
+            demand = stops["demand"].to_numpy()
+            vehicle_routes = []
+            for group in zone_groups:
+                nodes = np.concatenate([[0], group])
+                zone_dist = dist[np.ix_(nodes, nodes)]
+                if vehicle_capacity:
+                    zone_routes = solve_vrp(zone_dist, demand[nodes], vehicle_capacity, None, round_trip)
                 else:
-                    raise Exception("OSRM request failed")
-
-            except Exception as e:
-                print(f"OSRM routing failed: {e}, using mock data")
-                # Mock distance calculation
-                total_distance_km = len(coords) * 50  # ~50km between stores
-
-                # Add simple lines between consecutive points
-                for i in range(len(coords) - 1):
-                    folium.PolyLine(
-                        locations=[coords[i], coords[i+1]],
-                        color="blue",
-                        weight=5,
-                        opacity=0.8
-                    ).add_to(m)
+                    order, legs, distance = solve_tsp(zone_dist, round_trip)
+                    zone_routes = [{"order": order, "legs": legs, "distance": distance,
+                                    "load": float(demand[nodes].sum())}]
+                for zone_route in zone_routes:
+                    zone_route["order"] = [int(nodes[i]) for i in zone_route["order"]]
+                    zone_route["zone"] = int(stop_zones[nodes[1]])
+                vehicle_routes += zone_routes
+            if vehicles is not None and len(vehicle_routes) > vehicles:
+                raise ValueError(f"Plan needs {len(vehicle_routes)} vehicles, only {vehicles} available")
+        input_order = list(range(len(stops)))
+        input_distance = tour_length(input_order, dist, closed=round_trip)
+        print(f"Solved {len(stops)} stops into {len(vehicle_routes)} route(s) in {solve_stage.ms:.1f} ms")
+
+        # Road route for each vehicle from the backend (straight legs when offline)
+        total_distance_km = 0
+        total_time_h = 0
+
+        paths = [
+            vehicle_route["order"] + ([0] if round_trip else [])
+            for vehicle_route in vehicle_routes
+        ]
+        paths = [path for path in paths if len(path) > 1]
+
+        # All vehicles' geometry is requested at once
+        with timings.stage("routes") as routes_stage:
+            road_routes = client.routes([[stop_coords[i] for i in path] for path in paths])
+
+        for path, (route_distance, _) in zip(paths, road_routes):
+            total_distance_km += route_distance
+            total_time_h += float(sum(road_duration[a, b] for a, b in zip(path[:-1], path[1:])))
+        geometries = [geometry for _, geometry in road_routes]
 
         # Calculate emissions
         total_emissions_kg = total_distance_km * EMISSION_FACTOR_KG_PER_KM
 
-        # Green emission lines removed - keeping only blue route line
-
-        # Summary
-        summary_html = f"""
-        <div style="
-            position: fixed;
-            bottom: 50px;
-            left: 50px;
-            width: 250px;
-            padding: 15px;
-            background-color: rgba(255,255,255,0.9);
-            border: 2px solid #333;
-            border-radius: 8px;
-            box-shadow: 2px 2px 6px rgba(0,0,0,0.3);
-            font-family: Arial, sans-serif;
-            z-index: 9999;
-        ">
-        <h4 style="margin:0 0 10px 0; font-size:16px; color:#333;">Total Route Summary</h4>
-        <p style="margin:0; font-size:14px;"><strong>Distance:</strong> {total_distance_km:.1f} km</p>
-        <p style="margin:0; font-size:14px;"><strong>CO₂ Emissions:</strong> {total_emissions_kg:.1f} kg</p>
-        </div>
-        """
-        m.get_root().html.add_child(folium.Element(summary_html))
-
-        # Save map
-        output_map = data_dir / "delivery_route_maptiler_osrm_co2.html"
-        m.save(output_map)
+        with timings.stage("render"):
+            if map_format == "geojson":
+                collection = feature_collection(
+                    marker_stops[["store_id", "state", "lat", "lon"]].to_dict("records"),
+                    geometries,
+                    {"total_distance": round(total_distance_km, 1), "co2_emissions": round(total_emissions_kg, 1)},
+                    simplify_tolerance_m,
+                )
+                geojson_path, output_map = write_geojson_map(data_dir, collection)
+                print(f"GeoJSON written: {geojson_path.stat().st_size:,} bytes, "
+                      f"{collection['properties']['route_points']} of "
+                      f"{collection['properties']['route_points_raw']} route points kept")
+            else:
+                output_map = data_dir / "delivery_route_maptiler_osrm_co2.html"
+                render_folium_map(marker_stops, geometries, total_distance_km, total_emissions_kg, output_map)
 
         # Prepare JSON response
         route_result = {
             "status": "success",
             "message": "Route optimization completed successfully",
             "total_distance": round(total_distance_km, 1),
-            "total_time": round(total_distance_km / 60, 1),  # Assuming 60 km/h average speed
+            "total_time": round(total_time_h, 1),
             "co2_emissions": round(total_emissions_kg, 1),
             "stores_count": len(routes_df),
             "route_efficiency": round(85 + np.random.random() * 10, 1),  # Mock efficiency score
-            "map_file": str(output_map.name)
+            "map_file": str(output_map.name),
+            "map_format": map_format,
+            "stop_order": [stops.at[i, "store_id"] for i in vehicle_routes[0]["order"]],
+            "legs": [
+                {
+                    "from": stops.at[a, "store_id"],
+                    "to": stops.at[b, "store_id"],
+                    "distance_km": round(leg, 1)
+                }
+                for a, b, leg in zip(
+                    vehicle_routes[0]["order"],
+                    vehicle_routes[0]["order"][1:] + ([0] if round_trip else []),
+                    vehicle_routes[0]["legs"]
+                )
+            ],
+            "solver_distance": round(sum(r["distance"] for r in vehicle_routes), 1),
+            "input_order_distance": round(input_distance, 1),
+            "solve_time_ms": round(solve_stage.ms, 2),
+            "routing_backend": client.backend.name,
+            "matrix_time_ms": round(matrix_stage.ms, 2),
+            "routing_time_ms": round(routes_stage.ms, 2),
+            "routing_cache": client.stats,
+            "timings": timings.summary()
         }
+        if vehicle_capacity or len(vehicle_routes) > 1:
+            route_result["vehicles"] = [
+                {
+                    "vehicle": vehicle + 1,
+                    "zone": r["zone"],
+                    "stop_order": [stops.at[i, "store_id"] for i in r["order"]],
+                    "distance": round(r["distance"], 1),
+                    "load": round(r["load"], 1)
+                }
+                for vehicle, r in enumerate(vehicle_routes)
+            ]
 
         print(json.dumps(route_result))
         return route_result
@@ -212,7 +314,22 @@ if __name__ == "__main__":
         demand_threshold = params.get('demand_threshold', 10.0)
         top_stores = params.get('top_stores', 5)
 
-        optimize_route(demand_threshold, top_stores)
+        optimize_route(
+            demand_threshold,
+            top_stores,
+            params.get('vehicle_capacity'),
+            params.get('vehicles'),
+            params.get('round_trip', False),
+            params.get('depot'),
+            params.get('backend'),
+            params.get('osrm_url'),
+            params.get('radius_km'),
+            params.get('zones'),
+            params.get('start_date'),
+            params.get('end_date'),
+            params.get('map_format', 'html'),
+            params.get('simplify_tolerance_m', SIMPLIFY_TOLERANCE_M)
+        )
     else:
         # Default execution
         optimize_route()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Routing backends and a persistent distance-matrix cache for route.py.
+
+A backend turns stop coordinates into distance/duration matrices and road
+geometry:
+
+- "osrm" talks to an OSRM-compatible HTTP server (the public demo server,
+  a self-hosted OSRM, or the local stub in osrm_stub.py) over pooled
+  connections, fetching route geometry for several vehicles concurrently
+- "haversine" estimates road distance offline as great-circle distance
+  times a road factor, with durations from an average speed
+
+Matrix entries and route geometry are cached in a SQLite file keyed on
+rounded coordinates, with a TTL and a bound on the number of entries, so
+repeated routes over the same stores do not hit the network.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from route_solver import haversine_matrix
+
+DEFAULT_OSRM_URL = "http://router.project-osrm.org"
+ROAD_FACTOR = 1.3
+AVERAGE_SPEED_KMH = 60.0
+REQUEST_TIMEOUT = 10
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 2
+BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CACHE_FILE = "distances.sqlite"
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 200000
+COORD_PRECISION = 5
+
+
+class HaversineBackend:
+    """Offline estimate: great-circle distance scaled by a road factor"""
+
+    name = "haversine"
+    cacheable = False
+
+    def __init__(self, road_factor=ROAD_FACTOR, speed_kmh=AVERAGE_SPEED_KMH):
+        self.road_factor = road_factor
+        self.speed_kmh = speed_kmh
+
+    def table(self, coords):
+        """(distance km, duration h) matrices for (lat, lon) pairs"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        distance = haversine_matrix(coords[:, 0], coords[:, 1]) * self.road_factor
+        return distance, distance / self.speed_kmh
+
+    def route(self, coords):
+        """Straight legs through the stops: (distance km, [(lat, lon), ...])"""
+        coords = [tuple(c) for c in coords]
+        distance, _ = self.table(coords)
+        total = float(sum(distance[i, i + 1] for i in range(len(coords) - 1)))
+        return total, coords
+
+    def route_many(self, paths):
+        return [self.route(path) for path in paths]
+
+
+class RetryableStatus(Exception):
+    """OSRM answered with a status worth retrying (rate limit, server error)"""
+
+
+class OSRMBackend:
+    """OSRM HTTP API client (table and route services).
+
+    Requests share pooled connections and are retried with exponential
+    backoff. route_many() fetches several routes concurrently, using
+    aiohttp when installed and a thread pool over the pooled requests
+    session otherwise, so a multi-vehicle plan takes about as long as its
+    slowest request.
+    """
+
+    name = "osrm"
+    cacheable = True
+
+    def __init__(self, base_url=DEFAULT_OSRM_URL, profile="driving", timeout=REQUEST_TIMEOUT,
+                 max_concurrency=MAX_CONCURRENCY, retries=MAX_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @staticmethod
+    def coord_string(coords):
+        return ";".join(f"{lon},{lat}" for lat, lon in coords)
+
+    def table_request(self, coords):
+        url = f"{self.base_url}/table/v1/{self.profile}/{self.coord_string(coords)}"
+        return url, {"annotations": "distance,duration"}
+
+    def route_request(self, coords):
+        url = f"{self.base_url}/route/v1/{self.profile}/{self.coord_string(coords)}"
+        return url, {"overview": "full", "geometries": "geojson"}
+
+    @staticmethod
+    def parse_table(data):
+        if data.get("code") != "Ok":
+            raise RuntimeError(f"OSRM table request failed: {data.get('code')}")
+        distance = np.array(data["distances"], dtype=np.float64) / 1000
+        duration = np.array(data["durations"], dtype=np.float64) / 3600
+        return distance, duration
+
+    @staticmethod
+    def parse_route(data):
+        if data.get("code") != "Ok":
+            raise RuntimeError(f"OSRM route request failed: {data.get('code')}")
+        route = data["routes"][0]
+        geometry = [(lat, lon) for lon, lat in route["geometry"]["coordinates"]]
+        return route["distance"] / 1000, geometry
+
+    def get_json(self, url, params):
+        """GET with retries on connection errors and retryable statuses"""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code in RETRY_STATUSES:
+                    raise RetryableStatus(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                return response.json()
+            except (requests.ConnectionError, requests.Timeout, RetryableStatus):
+                if attempt == self.retries:
+                    raise
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+    def table(self, coords):
+        """(distance km, duration h) matrices from the table service"""
+        return self.parse_table(self.get_json(*self.table_request(coords)))
+
+    def route(self, coords):
+        """Road route through the stops: (distance km, [(lat, lon), ...])"""
+        return self.parse_route(self.get_json(*self.route_request(coords)))
+
+    def route_many(self, paths):
+        """Routes for several stop sequences fetched concurrently.
+
+        Returns one (distance km, geometry) per path, or the exception
+        raised for that path.
+        """
+        if not paths:
+            return []
+        return asyncio.run(self.fetch_routes(paths))
+
+    async def fetch_routes(self, paths):
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                return await asyncio.gather(
+                    *(self.fetch_route(session, path) for path in paths),
+                    return_exceptions=True,
+                )
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return await asyncio.gather(
+                *(loop.run_in_executor(pool, self.route, path) for path in paths),
+                return_exceptions=True,
+            )
+
+    async def fetch_route(self, session, coords):
+        """One route over aiohttp; the connector limit bounds concurrency"""
+        url, params = self.route_request(coords)
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.get(url, params=params) as response:
+                    if response.status in RETRY_STATUSES:
+                        raise RetryableStatus(f"HTTP {response.status}")
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+                return self.parse_route(data)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, RetryableStatus):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+
+BACKENDS = {
+    "haversine": HaversineBackend,
+    "osrm": OSRMBackend,
+}
+
+
+def get_backend(name=None, osrm_url=None):
+    """Backend by name, defaulting to the ROUTING_BACKEND / OSRM_URL environment"""
+    name = name or os.environ.get("ROUTING_BACKEND", "osrm")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown routing backend: {name}")
+    if name == "osrm":
+        return OSRMBackend(osrm_url or os.environ.get("OSRM_URL", DEFAULT_OSRM_URL))
+    return BACKENDS[name]()
+
+
+def backend_key(backend):
+    """Cache namespace for a backend (OSRM entries are per server)"""
+    return f"osrm:{backend.base_url}" if backend.name == "osrm" else backend.name
+
+
+def point_key(lat, lon):
+    return f"{lat:.{COORD_PRECISION}f},{lon:.{COORD_PRECISION}f}"
+
+
+class DistanceCache:
+    """SQLite cache of pairwise distances/durations and route geometry"""
+
+    def __init__(self, path, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pairs (
+                backend TEXT, origin TEXT, dest TEXT,
+                distance REAL, duration REAL, created REAL, used REAL,
+                PRIMARY KEY (backend, origin, dest)
+            );
+            CREATE TABLE IF NOT EXISTS routes (
+                backend TEXT, stops TEXT, distance REAL, geometry TEXT,
+                created REAL, used REAL,
+                PRIMARY KEY (backend, stops)
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def lookup_matrix(self, backend, keys):
+        """Cached (distance, duration) matrices for keys, or None if any pair is missing"""
+        n = len(keys)
+        position = {key: i for i, key in enumerate(dict.fromkeys(keys))}
+        distance = np.full((n, n), np.nan)
+        duration = np.full((n, n), np.nan)
+        cutoff = time.time() - self.ttl
+        unique = list(position)
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT origin, dest, distance, duration FROM pairs "
+                f"WHERE backend = ? AND created >= ? AND origin IN ({','.join('?' * len(batch))})",
+                [backend, cutoff, *batch],
+            )
+            for origin, dest, dist, dur in rows:
+                if dest in position:
+                    distance[position[origin], position[dest]] = dist
+                    duration[position[origin], position[dest]] = dur
+
+        # Duplicate coordinates share one row of the matrix
+        np.fill_diagonal(distance, 0.0)
+        np.fill_diagonal(duration, 0.0)
+        rows = [position[key] for key in keys]
+        distance, duration = distance[np.ix_(rows, rows)], duration[np.ix_(rows, rows)]
+        if np.isnan(distance).any():
+            return None
+
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE pairs SET used = ? WHERE backend = ? AND origin = ?",
+                [(time.time(), backend, key) for key in unique],
+            )
+        return distance, duration
+
+    def store_matrix(self, backend, keys, distance, duration):
+        now = time.time()
+        rows = [
+            (backend, a, b, float(distance[i, j]), float(duration[i, j]), now, now)
+            for i, a in enumerate(keys) for j, b in enumerate(keys) if a != b
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.evict("pairs")
+
+    def lookup_route(self, backend, keys):
+        row = self.conn.execute(
+            "SELECT distance, geometry FROM routes WHERE backend = ? AND stops = ? AND created >= ?",
+            (backend, ";".join(keys), time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE routes SET used = ? WHERE backend = ? AND stops = ?",
+                              (time.time(), backend, ";".join(keys)))
+        return row[0], [tuple(point) for point in json.loads(row[1])]
+
+    def store_route(self, backend, keys, distance, geometry):
+        now = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?)",
+                              (backend, ";".join(keys), float(distance), json.dumps(geometry), now, now))
+        self.evict("routes")
+
+    def evict(self, table):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {table} WHERE created < ?", (time.time() - self.ttl,))
+            count = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN "
+                    f"(SELECT rowid FROM {table} ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+
+class RoutingClient:
+    """Backend calls through the cache, falling back to the offline estimator"""
+
+    def __init__(self, backend, cache=None, fallback=None):
+        self.backend = backend
+        self.cache = cache if backend.cacheable else None
+        self.fallback = fallback or HaversineBackend()
+        self.stats = {"matrix_cache_hit": False, "route_cache_hits": 0, "fallback": False}
+
+    def table(self, coords):
+        """(distance km, duration h) matrices for (lat, lon) pairs"""
+        keys = [point_key(lat, lon) for lat, lon in coords]
+        namespace = backend_key(self.backend)
+        if self.cache is not None:
+            cached = self.cache.lookup_matrix(namespace, keys)
+            if cached is not None:
+                self.stats["matrix_cache_hit"] = True
+                return cached
+        try:
+            distance, duration = self.backend.table(coords)
+        except Exception as e:
+            print(f"{self.backend.name} table request failed: {e}, using {self.fallback.name} estimate")
+            self.stats["fallback"] = True
+            return self.fallback.table(coords)
+
+        # Unroutable pairs come back as null, estimate those offline
+        missing = np.isnan(distance) | np.isnan(duration)
+        if missing.any():
+            estimate_distance, estimate_duration = self.fallback.table(coords)
+            distance = np.where(missing, estimate_distance, distance)
+            duration = np.where(missing, estimate_duration, duration)
+        if self.cache is not None:
+            self.cache.store_matrix(namespace, keys, distance, duration)
+        return distance, duration
+
+    def route(self, coords):
+        """(distance km, geometry) through the stops in order"""
+        return self.routes([coords])[0]
+
+    def routes(self, paths):
+        """(distance km, geometry) for each stop sequence.
+
+        Cached routes are served from disk; the rest are requested from the
+        backend concurrently.
+        """
+        namespace = backend_key(self.backend)
+        keys = [[point_key(lat, lon) for lat, lon in coords] for coords in paths]
+        results = [None] * len(paths)
+        if self.cache is not None:
+            for i, path_keys in enumerate(keys):
+                results[i] = self.cache.lookup_route(namespace, path_keys)
+            self.stats["route_cache_hits"] += sum(r is not None for r in results)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        fetched = self.backend.route_many([paths[i] for i in missing])
+        for i, result in zip(missing, fetched):
+            if isinstance(result, Exception):
+                print(f"{self.backend.name} route request failed: {result}, using {self.fallback.name} estimate")
+                self.stats["fallback"] = True
+                results[i] = self.fallback.route(paths[i])
+                continue
+            results[i] = result
+            if self.cache is not None:
+                self.cache.store_route(namespace, keys[i], *result)
+        return results
+
+
+def routing_client(cache_dir, backend=None, osrm_url=None):
+    """Client for the configured backend with the on-disk cache in cache_dir"""
+    return RoutingClient(get_backend(backend, osrm_url), DistanceCache(Path(cache_dir) / CACHE_FILE))
@@ -6,17 +6,43 @@ Simple route optimization script that works without external dependencies
 import json
 import sys
 import os
+import stat
+import tempfile
 from pathlib import Path
 from datetime import datetime
 
-def optimize_route(demand_threshold=10.0, top_stores=5):
+from demand_stream import aggregate_demand, top_stores as top_stores_by_demand
+
+
+def write_text_atomic(path, text):
+    """Replace `path` with `text` via a temporary file and rename.
+
+    Mirrors storage.atomic_path, which cannot be imported here without pandas.
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def optimize_route(demand_threshold=10.0, top_stores=5, start_date=None, end_date=None):
     """Optimize delivery route with minimal dependencies"""
     try:
         print("=== Starting route optimization ===")
         print(f"Parameters: threshold={demand_threshold}, top_stores={top_stores}")
 
-        # Paths
-        base_dir = Path(__file__).parent.parent
+        # Paths (storage.project_dir needs pandas, so the override is read here)
+        base_dir = Path(os.environ.get("WALMART_PROJECT_DIR") or Path(__file__).parent.parent)
         data_dir = base_dir / "python" / "data" / "processed"
 
         # Check for predictions file
@@ -40,42 +66,16 @@ def optimize_route(demand_threshold=10.0, top_stores=5):
         if preds_file.exists():
             print("Loading predictions from file...")
             try:
-                # Simple CSV parsing without pandas
-                with open(preds_file, 'r') as f:
-                    lines = f.readlines()
-
-                header = lines[0].strip().split(',')
-                print(f"CSV header: {header}")
-
-                # Find demand column
-                demand_col_idx = None
-                if 'predicted_demand' in header:
-                    demand_col_idx = header.index('predicted_demand')
-                elif 'prediction' in header:
-                    demand_col_idx = header.index('prediction')
-
-                store_col_idx = header.index('store_id') if 'store_id' in header else None
-
-                if demand_col_idx is None or store_col_idx is None:
-                    raise ValueError(f"Required columns not found. Header: {header}")
-
-                # Aggregate demand by store
-                store_demand = {}
-                for line in lines[1:]:  # Skip header
-                    parts = line.strip().split(',')
-                    if len(parts) > max(demand_col_idx, store_col_idx):
-                        store_id = parts[store_col_idx]
-                        try:
-                            demand = float(parts[demand_col_idx])
-                            store_demand[store_id] = store_demand.get(store_id, 0) + demand
-                        except (ValueError, IndexError):
-                            continue
-
+                # Single pass over the file, keeping only per-store totals
+                aggregated = aggregate_demand(preds_file, start_date, end_date)
+                store_demand = aggregated["store_totals"]
+                print(f"Using demand column: {aggregated['demand_col']}")
+                print(f"Rows read: {aggregated['rows']}, in date window: {aggregated['rows_in_window']}")
                 print(f"Store demand aggregated: {store_demand}")
 
                 # Filter stores by threshold and select top stores
                 qualifying_stores = {k: v for k, v in store_demand.items() if v >= demand_threshold}
-                selected_stores = sorted(qualifying_stores.items(), key=lambda x: x[1], reverse=True)[:top_stores]
+                selected_stores = top_stores_by_demand(store_demand, top_stores, demand_threshold)
                 total_demand = sum(demand for _, demand in selected_stores)
 
                 print(f"Qualifying stores: {len(qualifying_stores)}")
@@ -102,8 +102,7 @@ def optimize_route(demand_threshold=10.0, top_stores=5):
 
         # Save map
         map_file = data_dir / "delivery_route_simple.html"
-        with open(map_file, 'w') as f:
-            f.write(map_html)
+        write_text_atomic(map_file, map_html)
 
         print(f"Map saved to: {map_file}")
 
@@ -224,6 +223,6 @@ if __name__ == "__main__":
         params = json.loads(sys.argv[1])
         demand_threshold = params.get('demand_threshold', 10.0)
         top_stores = params.get('top_stores', 5)
-        optimize_route(demand_threshold, top_stores)
+        optimize_route(demand_threshold, top_stores, params.get('start_date'), params.get('end_date'))
     else:
         optimize_route()
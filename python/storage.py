@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Storage helpers for the preprocessed Walmart sales dataset.
+
+The canonical processed format is a Parquet dataset partitioned by
+store_id/cat_id with a typed date column. When pyarrow is not installed
+the helpers fall back to the legacy m5_preprocessed_sample.csv file.
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PROCESSED_CSV = "m5_preprocessed_sample.csv"
+PROCESSED_DATASET = "m5_preprocessed"
+PARTITION_COLS = ["store_id", "cat_id"]
+
+
+def project_dir():
+    """Project root (the directory holding python/ and uploads/).
+
+    WALMART_PROJECT_DIR points the pipeline at another tree, e.g. the
+    scratch copy benchmark.py runs in.
+    """
+    override = os.environ.get("WALMART_PROJECT_DIR")
+    if override:
+        return Path(override)
+    return Path(__file__).parent.parent
+
+
+def processed_dir():
+    """Directory holding processed data files"""
+    return project_dir() / "python" / "data" / "processed"
+
+
+def file_mode(path):
+    """Permission bits for rewriting `path`: the existing file's, else 0o644"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o644
+
+
+@contextmanager
+def atomic_path(path):
+    """Temporary path that replaces `path` once the with-block succeeds.
+
+    The temporary file is created next to the target so the final rename
+    is atomic; readers see either the old file or the complete new one.
+    The file keeps the target's mode, or gets 0o644 when new; mkstemp
+    alone would leave it readable by the owner only.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        os.chmod(tmp_name, file_mode(path))
+        yield Path(tmp_name)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def parquet_available():
+    """Whether the columnar Parquet format can be used"""
+    return pq is not None
+
+
+def processed_files(data_dir):
+    """Names of the processed data files written to data_dir"""
+    if parquet_available():
+        return [PROCESSED_DATASET]
+    return [PROCESSED_CSV]
+
+
+def processed_exists(data_dir):
+    """Whether any processed dataset exists in data_dir"""
+    data_dir = Path(data_dir)
+    return (data_dir / PROCESSED_DATASET).exists() or (data_dir / PROCESSED_CSV).exists()
+
+
+def reset_processed(data_dir):
+    """Remove previously written processed data so a new run starts clean"""
+    data_dir = Path(data_dir)
+    dataset_dir = data_dir / PROCESSED_DATASET
+    if dataset_dir.exists():
+        shutil.rmtree(dataset_dir)
+    csv_file = data_dir / PROCESSED_CSV
+    if csv_file.exists():
+        csv_file.unlink()
+
+
+def write_processed(df, data_dir, part=0):
+    """Append a frame of processed rows to the dataset.
+
+    Each call writes one file per store_id/cat_id partition, named after
+    `part`, so chunked writers can call this repeatedly.
+    """
+    data_dir = Path(data_dir)
+    df = df.copy()
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+
+    if not parquet_available():
+        df.to_csv(
+            data_dir / PROCESSED_CSV,
+            mode="w" if part == 0 else "a",
+            header=part == 0,
+            index=False
+        )
+        return
+
+    for col in PARTITION_COLS:
+        df[col] = df[col].astype(str)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=str(data_dir / PROCESSED_DATASET),
+        partition_cols=PARTITION_COLS,
+        basename_template=f"part-{part:05d}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def remove_parts(data_dir, first_part):
+    """Delete the files written by write_processed() calls with part >= first_part"""
+    dataset_dir = Path(data_dir) / PROCESSED_DATASET
+    for path in dataset_dir.rglob("part-*.parquet"):
+        if int(path.name.split("-")[1]) >= first_part:
+            path.unlink()
+
+
+def list_partitions(data_dir):
+    """Map of store_id -> sorted cat_ids present in the processed dataset"""
+    data_dir = Path(data_dir)
+    dataset_dir = data_dir / PROCESSED_DATASET
+    partitions = {}
+    if dataset_dir.exists():
+        for store_path in sorted(dataset_dir.glob("store_id=*")):
+            store = store_path.name.split("=", 1)[1]
+            partitions[store] = sorted(
+                cat_path.name.split("=", 1)[1] for cat_path in store_path.glob("cat_id=*")
+            )
+    elif (data_dir / PROCESSED_CSV).exists():
+        keys = pd.read_csv(data_dir / PROCESSED_CSV, usecols=PARTITION_COLS).drop_duplicates()
+        for store, group in keys.groupby("store_id"):
+            partitions[store] = sorted(group["cat_id"].unique().tolist())
+    return partitions
+
+
+def read_processed(data_dir, columns=None, stores=None, categories=None, start_date=None):
+    """Load processed rows, reading only the requested columns and partitions.
+
+    `stores` and `categories` are lists of store_id / cat_id values to keep;
+    None keeps everything. `start_date` drops rows dated before it. The
+    date column, when loaded, is datetime64.
+    """
+    data_dir = Path(data_dir)
+    dataset_dir = data_dir / PROCESSED_DATASET
+    csv_file = data_dir / PROCESSED_CSV
+
+    filters = []
+    if stores:
+        filters.append(("store_id", "in", list(stores)))
+    if categories:
+        filters.append(("cat_id", "in", list(categories)))
+
+    row_filters = list(filters)
+    if start_date is not None:
+        row_filters.append(("date", ">=", pd.Timestamp(start_date)))
+
+    if dataset_dir.exists() and parquet_available():
+        df = pd.read_parquet(dataset_dir, columns=columns, filters=row_filters or None)
+        for col in PARTITION_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype(str)
+    elif csv_file.exists():
+        usecols = None
+        if columns is not None:
+            usecols = list(dict.fromkeys(list(columns) + [c for c, _, _ in filters]
+                                         + (["date"] if start_date is not None else [])))
+        df = pd.read_csv(csv_file, usecols=usecols)
+        for col, _, values in filters:
+            df = df[df[col].isin(values)]
+        if start_date is not None:
+            df = df[pd.to_datetime(df["date"]) >= pd.Timestamp(start_date)]
+        if columns is not None:
+            df = df[list(columns)]
+        if "date" in df.columns:
+            df["date"] = pd.to_datetime(df["date"])
+    else:
+        raise FileNotFoundError("Processed data not found. Please run preprocessing first.")
+
+    return df.reset_index(drop=True)
+
+
+def processed_fingerprint(data_dir):
+    """Hash identifying the current processed dataset (paths, sizes, mtimes).
+
+    Returns None when no processed data exists.
+    """
+    data_dir = Path(data_dir)
+    dataset_dir = data_dir / PROCESSED_DATASET
+    if dataset_dir.exists():
+        files = sorted(path for path in dataset_dir.rglob("*") if path.is_file())
+    elif (data_dir / PROCESSED_CSV).exists():
+        files = [data_dir / PROCESSED_CSV]
+    else:
+        return None
+
+    digest = hashlib.sha1()
+    for path in files:
+        stat = path.stat()
+        digest.update(f"{path.relative_to(data_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
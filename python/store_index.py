@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Spatial index over store locations.
+
+A haversine BallTree is built once from uploads/store_locations.csv and
+cached with joblib under python/data/cache, tagged with the source file's
+size and modification time so an updated upload rebuilds it. The index
+answers radius and k-nearest queries around a point and groups stores
+into delivery zones.
+"""
+
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.neighbors import BallTree
+
+from route_solver import EARTH_RADIUS_KM
+from storage import atomic_path
+
+STORES_FILE = "store_locations.csv"
+INDEX_FILE = "store_index.joblib"
+
+# Used when no store_locations.csv has been uploaded
+DEFAULT_STORES = pd.DataFrame({
+    'store_id': ['CA_1', 'CA_2', 'TX_1', 'TX_2', 'WI_1'],
+    'state': ['CA', 'CA', 'TX', 'TX', 'WI'],
+    'lat': [34.0522, 37.7749, 29.7604, 32.7767, 43.0731],
+    'lon': [-118.2437, -122.4194, -95.3698, -96.7970, -89.4012]
+})
+
+
+class StoreIndex:
+    """Store table plus a BallTree over its coordinates"""
+
+    def __init__(self, stores, source=None):
+        self.stores = stores.reset_index(drop=True)
+        self.source = source
+        self.tree = BallTree(self.radians(self.stores["lat"], self.stores["lon"]), metric="haversine")
+
+    @staticmethod
+    def radians(lat, lon):
+        return np.radians(np.column_stack([np.asarray(lat, dtype=np.float64),
+                                           np.asarray(lon, dtype=np.float64)]))
+
+    def within_radius(self, lat, lon, radius_km):
+        """Stores within radius_km of a point, nearest first, with distance_km"""
+        idx, dist = self.tree.query_radius(self.radians([lat], [lon]), r=radius_km / EARTH_RADIUS_KM,
+                                           return_distance=True, sort_results=True)
+        return self.take(idx[0], dist[0])
+
+    def nearest(self, lat, lon, k):
+        """The k stores closest to a point, nearest first, with distance_km"""
+        k = min(k, len(self.stores))
+        dist, idx = self.tree.query(self.radians([lat], [lon]), k=k)
+        return self.take(idx[0], dist[0])
+
+    def take(self, idx, dist):
+        result = self.stores.iloc[idx].copy()
+        result["distance_km"] = np.asarray(dist) * EARTH_RADIUS_KM
+        return result.reset_index(drop=True)
+
+    def zones(self, n_zones, stores=None, seed=42):
+        """Zone number per store from k-means on unit-sphere coordinates"""
+        stores = self.stores if stores is None else stores
+        n_zones = max(1, min(n_zones, len(stores)))
+        lat, lon = np.radians(stores["lat"].to_numpy()), np.radians(stores["lon"].to_numpy())
+        points = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+        labels = KMeans(n_clusters=n_zones, n_init=10, random_state=seed).fit_predict(points)
+        return pd.Series(labels, index=stores.index, name="zone")
+
+
+def source_signature(stores_file):
+    """Identity of the uploaded locations file (None when using the defaults)"""
+    if not stores_file.exists():
+        return None
+    stat = stores_file.stat()
+    return f"{stores_file.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_store_index(uploads_dir, cache_dir):
+    """Store index for the uploaded locations, from the on-disk cache when current"""
+    stores_file = Path(uploads_dir) / STORES_FILE
+    index_file = Path(cache_dir) / INDEX_FILE
+    signature = source_signature(stores_file)
+
+    if index_file.exists():
+        try:
+            index = joblib.load(index_file)
+            if index.source == signature:
+                return index
+        except Exception as e:
+            print(f"Could not load store index cache: {e}")
+
+    stores = pd.read_csv(stores_file) if signature is not None else DEFAULT_STORES.copy()
+    print(f"Building store index over {len(stores)} locations")
+    index = StoreIndex(stores, signature)
+    with atomic_path(index_file) as tmp_path:
+        joblib.dump(index, tmp_path)
+    return index
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from feature_matrix import load_feature_matrix
+from storage import parquet_available
+
+pytestmark = pytest.mark.skipif(not parquet_available(), reason="incremental preprocessing needs Parquet")
+
+STORES = ["CA_1", "TX_1"]
+CATEGORIES = ["HOBBIES", "HOUSEHOLD", "FOODS"]
+FIRST_DATE = "2011-01-29"
+
+
+def write_uploads(input_dir, n_items, n_days, seed=0):
+    """M5-shaped sales, calendar and price files; a longer n_days extends the same series"""
+    input_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    demand = rng.poisson(3, (len(STORES) * 20, 200))
+    rows = []
+    for s, store in enumerate(STORES):
+        for i in range(n_items):
+            cat = CATEGORIES[i % 3]
+            item = f"{cat}_1_{i:03d}"
+            rows.append([f"{item}_{store}_validation", item, f"{cat}_1", cat, store, store[:2]]
+                        + list(demand[s * 20 + i, :n_days]))
+    columns = ["id", "item_id", "dept_id", "cat_id", "store_id", "state_id"] + [f"d_{k + 1}" for k in range(n_days)]
+    pd.DataFrame(rows, columns=columns).to_csv(input_dir / "sales_train_validation.csv", index=False)
+
+    # Calendar and prices cover every day the tests use, so they never change between runs
+    dates = pd.date_range(FIRST_DATE, periods=200)
+    weeks = 11101 + np.arange(len(dates)) // 7
+    pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d"), "wm_yr_wk": weeks, "weekday": dates.day_name(),
+        "wday": (dates.weekday + 2) % 7 + 1, "month": dates.month, "year": dates.year,
+        "d": [f"d_{k + 1}" for k in range(len(dates))],
+        "event_name_1": None, "event_type_1": None, "event_name_2": None, "event_type_2": None,
+        "snap_CA": 0, "snap_TX": 0, "snap_WI": 0,
+    }).to_csv(input_dir / "calendar.csv", index=False)
+    pd.DataFrame([[store, f"{CATEGORIES[i % 3]}_1_{i:03d}", week, round(1 + i % 7 + 0.1 * (week % 3), 2)]
+                  for store in STORES for i in range(20) for week in np.unique(weeks)[1:]],
+                 columns=["store_id", "item_id", "wm_yr_wk", "sell_price"]).to_csv(
+        input_dir / "sell_prices.csv", index=False)
+
+
+@pytest.fixture
+def matrix_calls(monkeypatch):
+    calls = []
+    build, append = app.build_feature_matrix, app.append_feature_matrix
+
+    def spy_build(*args, **kwargs):
+        calls.append("build")
+        return build(*args, **kwargs)
+
+    def spy_append(*args, **kwargs):
+        calls.append("append")
+        return append(*args, **kwargs)
+
+    monkeypatch.setattr(app, "build_feature_matrix", spy_build)
+    monkeypatch.setattr(app, "append_feature_matrix", spy_append)
+    return calls
+
+
+def preprocess(input_dir, output_dir, **kwargs):
+    return app.preprocess_sales_streaming(input_dir, output_dir, chunk_size=7, **kwargs)
+
+
+def assert_same_matrix(left_dir, right_dir):
+    left, right = load_feature_matrix(left_dir), load_feature_matrix(right_dir)
+    assert left is not None and right is not None
+    assert left["feature_cols"] == right["feature_cols"]
+    np.testing.assert_array_equal(left["days"], right["days"])
+    np.testing.assert_array_equal(left["day_offsets"], right["day_offsets"])
+    np.testing.assert_allclose(np.asarray(left["X"]), np.asarray(right["X"]), equal_nan=True)
+    np.testing.assert_array_equal(np.asarray(left["y"]), np.asarray(right["y"]))
+    # Appended days follow the earlier ones; consumers key the group series, not their order
+    group_keys = ["store_id", "cat_id", "date"]
+    pd.testing.assert_frame_equal(left["group_daily"].sort_values(group_keys, ignore_index=True),
+                                  right["group_daily"].sort_values(group_keys, ignore_index=True),
+                                  check_exact=False)
+
+
+def test_new_days_are_appended_to_the_matrix(tmp_path, matrix_calls):
+    uploads, incremental, full = tmp_path / "uploads", tmp_path / "incremental", tmp_path / "full"
+    write_uploads(uploads, n_items=12, n_days=80)
+    first = preprocess(uploads, incremental)
+    assert not first["incremental"]
+    assert matrix_calls == ["build"]
+
+    write_uploads(uploads, n_items=12, n_days=95)
+    second = preprocess(uploads, incremental)
+    assert second["incremental"] and second["rebuild_reason"] is None
+    assert second["new_days"] == 15 and second["new_series"] == 0
+    assert second["rows_processed"] == 15 * 12 * len(STORES)
+    assert matrix_calls == ["build", "append"]
+
+    preprocess(uploads, full, full=True)
+    assert_same_matrix(incremental, full)
+
+
+def test_new_series_rebuild_the_matrix(tmp_path, matrix_calls):
+    uploads, incremental, full = tmp_path / "uploads", tmp_path / "incremental", tmp_path / "full"
+    write_uploads(uploads, n_items=10, n_days=80)
+    preprocess(uploads, incremental)
+
+    write_uploads(uploads, n_items=12, n_days=90)
+    stats = preprocess(uploads, incremental)
+    assert stats["incremental"]
+    assert stats["new_series"] == 2 * len(STORES)
+    assert matrix_calls == ["build", "build"]
+
+    preprocess(uploads, full, full=True)
+    assert_same_matrix(incremental, full)
+
+
+def test_unchanged_uploads_skip_processing(tmp_path, matrix_calls):
+    uploads, output = tmp_path / "uploads", tmp_path / "output"
+    write_uploads(uploads, n_items=6, n_days=70)
+    preprocess(uploads, output)
+    stats = preprocess(uploads, output)
+    assert stats["rows_processed"] == 0 and stats["incremental"]
+    assert matrix_calls == ["build"]
+
+
+def test_changed_history_rebuilds_in_full(tmp_path, matrix_calls):
+    uploads, output, full = tmp_path / "uploads", tmp_path / "output", tmp_path / "full"
+    write_uploads(uploads, n_items=6, n_days=70)
+    preprocess(uploads, output)
+
+    write_uploads(uploads, n_items=6, n_days=75, seed=1)
+    stats = preprocess(uploads, output)
+    assert stats["rebuild_reason"] == "processed history changed in the uploads"
+    assert "append" not in matrix_calls
+
+    preprocess(uploads, full, full=True)
+    assert_same_matrix(output, full)
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from feature_stats import STATS_FILE
+from registry import CURRENT_FILE, registry_dir
+from result_cache import ResultCache, cache_key, default_cache, feature_version, model_version
+
+
+def touch(path, text, mtime_ns=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def project(tmp_path):
+    model_dir, data_dir = tmp_path / "models", tmp_path / "data"
+    touch(model_dir / "lgbm_model.txt", "tree", 10 ** 18)
+    touch(model_dir / "feature_names.json", "[]", 10 ** 18)
+    touch(model_dir / "feature_state.npz", "state", 10 ** 18)
+    touch(data_dir / STATS_FILE, "{}", 10 ** 18)
+    return model_dir, data_dir
+
+
+def test_model_version_changes_with_model_files_and_current(project):
+    model_dir, _ = project
+    before = model_version(model_dir)
+    assert model_version(model_dir) == before
+
+    touch(model_dir / "lgbm_model.txt", "retrained", 2 * 10 ** 18)
+    retrained = model_version(model_dir)
+    assert retrained != before
+
+    touch(registry_dir(model_dir) / CURRENT_FILE, "v2\n")
+    assert model_version(model_dir) == f"{retrained}-v2"
+
+    touch(model_dir / "feature_names.json", "[\"lag_7\"]", 10 ** 18)
+    assert not model_version(model_dir).startswith(retrained)
+
+
+def test_feature_version_changes_with_state_and_stats(project):
+    model_dir, data_dir = project
+    before = feature_version(model_dir, data_dir)
+    touch(data_dir / STATS_FILE, "{\"a\": 1}", 10 ** 18)
+    after_stats = feature_version(model_dir, data_dir)
+    assert after_stats != before
+    touch(model_dir / "feature_state.npz", "state", 3 * 10 ** 18)
+    assert feature_version(model_dir, data_dir) != after_stats
+
+
+def test_cache_key_distinguishes_every_field():
+    base = ("m1", "f1", "CA_1", "FOODS", "2016-05-23", "2016-06-19")
+    assert cache_key(*base) == base
+    for i in range(len(base)):
+        changed = list(base)
+        changed[i] = changed[i] + "x"
+        assert cache_key(*changed) != cache_key(*base)
+
+
+def test_disk_entries_are_shared_between_instances(tmp_path):
+    key = cache_key("m1", "f1", "CA_1", None, "2016-05-23", "2016-06-19")
+    ResultCache(tmp_path).put(key, {"result": [1, 2], "csv": "a,b\n"})
+
+    other = ResultCache(tmp_path)
+    assert other.get(key) == {"result": [1, 2], "csv": "a,b\n"}
+    assert other.get(key) == {"result": [1, 2], "csv": "a,b\n"}
+    assert other.stats()["hits"] == {"memory": 1, "disk": 1}
+    assert other.get(cache_key("m1", "f1", "TX_1", None, "2016-05-23", "2016-06-19")) is None
+    assert other.stats()["misses"] == 1
+
+
+def test_new_version_drops_older_entries(tmp_path):
+    cache = ResultCache(tmp_path)
+    old = cache_key("m1", "f1", "CA_1", None, "2016-05-23", "2016-06-19")
+    cache.put(old, "old")
+    old_dir = cache.version_dir(old)
+    assert old_dir.exists()
+
+    for new in (cache_key("m2", "f1", *old[2:]), cache_key("m2", "f2", *old[2:])):
+        assert cache.get(new) is None
+        cache.put(new, "new")
+        assert cache.get(new) == "new"
+    assert not old_dir.exists()
+    assert [path.name for path in tmp_path.iterdir()] == ["m2_f2"]
+
+    # A process still on the old version no longer finds its entries on disk
+    assert ResultCache(tmp_path).get(old) is None
+
+
+def test_expired_entries_are_misses(tmp_path):
+    key = cache_key("m1", "f1", "CA_1", None, "2016-05-23", "2016-06-19")
+    cache = ResultCache(tmp_path, ttl_seconds=-1)
+    cache.put(key, "value")
+    assert cache.get(key) is None
+    assert ResultCache(tmp_path, ttl_seconds=-1).get(key) is None
+    assert ResultCache(tmp_path).get(key) == "value"
+
+
+def test_memory_and_disk_limits(tmp_path):
+    cache = ResultCache(tmp_path, max_entries=2, max_disk_entries=3)
+    keys = [cache_key("m1", "f1", f"S_{i}", None, "2016-05-23", "2016-06-19") for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, i)
+        entry = cache.entry_path(key)
+        os.utime(entry, (10 ** 9 + i, 10 ** 9 + i))
+
+    assert list(cache.entries) == keys[-2:]
+    assert sorted(path.name for path in cache.version_dir(keys[0]).iterdir()) == \
+        sorted(cache.entry_path(key).name for key in keys[-3:])
+
+
+def test_default_cache_modes(tmp_path):
+    assert default_cache(tmp_path, "off") is None
+    assert default_cache(tmp_path, "memory").cache_dir is None
+    assert default_cache(tmp_path, "disk").cache_dir == tmp_path
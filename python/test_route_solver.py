@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from route_solver import (haversine_matrix, nearest_neighbour, or_opt, solve_tsp, solve_vrp, tour_length,
+                          two_opt, with_open_end)
+
+
+def random_matrix(n, seed):
+    rng = np.random.default_rng(seed)
+    return haversine_matrix(rng.uniform(34.0, 34.5, n), rng.uniform(-118.5, -118.0, n))
+
+
+def assert_permutation(order, stops):
+    assert sorted(order) == sorted(stops)
+    assert len(set(order)) == len(order)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tsp_round_trip_visits_every_stop_once(seed):
+    dist = random_matrix(25, seed)
+    order, legs, total = solve_tsp(dist)
+    assert order[0] == 0
+    assert_permutation(order, range(25))
+    assert len(legs) == 25
+    assert total == pytest.approx(tour_length(order, dist))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tsp_open_path_starts_at_depot_without_returning(seed):
+    dist = random_matrix(20, seed)
+    order, legs, total = solve_tsp(dist, round_trip=False)
+    assert order[0] == 0
+    assert_permutation(order, range(20))
+    assert len(legs) == 19
+    assert total == pytest.approx(tour_length(order, dist, closed=False))
+    assert total <= tour_length(nearest_neighbour(dist), dist, closed=False) + 1e-9
+
+
+def test_with_open_end_closed_tour_is_open_path_cost():
+    dist = random_matrix(8, 0)
+    extended = with_open_end(dist)
+    assert extended.shape == (9, 9)
+    np.testing.assert_array_equal(extended[:8, :8], dist)
+    assert extended[8, 0] == extended[0, 8] == 0.0
+    # Every closed tour pays one penalty edge into the dummy node and a free
+    # edge back to the depot, so it ranks like the open path it contains
+    penalty = extended[8, 1]
+    path = [0, 3, 1, 7, 2, 5, 6, 4]
+    assert tour_length(path + [8], extended) == pytest.approx(tour_length(path, dist, closed=False) + penalty)
+
+
+def test_tsp_trivial_sizes():
+    assert solve_tsp(np.zeros((0, 0))) == ([], [], 0.0)
+    assert solve_tsp(np.zeros((1, 1))) == ([0], [], 0.0)
+    order, legs, total = solve_tsp(np.array([[0.0, 2.0], [2.0, 0.0]]))
+    assert order == [0, 1] and legs == [2.0, 2.0] and total == 4.0
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_local_search_never_lengthens_tour(seed):
+    dist = random_matrix(30, seed)
+    tour = np.random.default_rng(seed).permutation(30)
+    before = tour_length(tour, dist)
+
+    improved = two_opt(tour, dist)
+    assert_permutation(improved.tolist(), range(30))
+    assert tour_length(improved, dist) <= before + 1e-9
+
+    moved = or_opt(improved, dist)
+    assert_permutation(moved.tolist(), range(30))
+    assert moved[0] == improved[0]
+    assert tour_length(moved, dist) <= tour_length(improved, dist) + 1e-9
+
+
+@pytest.mark.parametrize("round_trip", [True, False])
+def test_vrp_routes_cover_stops_within_capacity(round_trip):
+    dist = random_matrix(40, 3)
+    demand = np.random.default_rng(3).integers(1, 10, 40).astype(float)
+    demand[0] = 0
+    routes = solve_vrp(dist, demand, capacity=30, round_trip=round_trip)
+
+    stops = [stop for route in routes for stop in route["order"][1:]]
+    assert_permutation(stops, range(1, 40))
+    for route in routes:
+        assert route["order"][0] == 0
+        assert route["load"] == pytest.approx(demand[route["order"][1:]].sum())
+        assert route["load"] <= 30
+        assert route["distance"] == pytest.approx(tour_length(route["order"], dist, closed=round_trip))
+
+
+def test_vrp_oversized_stop_gets_its_own_vehicle():
+    dist = random_matrix(5, 1)
+    routes = solve_vrp(dist, [0, 50, 1, 1, 1], capacity=10)
+    assert [1] in [route["order"][1:] for route in routes]
+    assert all(route["load"] <= 10 for route in routes if 1 not in route["order"])
+
+
+def test_vrp_rejects_too_few_vehicles():
+    dist = random_matrix(6, 2)
+    with pytest.raises(ValueError, match="vehicles of capacity"):
+        solve_vrp(dist, [0, 5, 5, 5, 5, 5], capacity=10, max_vehicles=2)
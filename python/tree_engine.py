@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Array-compiled inference for LightGBM boosters.
+
+Booster.predict has a fixed per-call cost (input validation, OpenMP thread
+start-up) that dominates when the server scores a handful of rows. This
+module flattens a booster's trees from dump_model() into a few compact
+node arrays (feature, threshold, children, missing-value handling, leaf
+value) and evaluates every tree for every row at once with NumPy: each
+step moves all (row, tree) cursors one level down, and leaves point to
+themselves so the walk needs no masking.
+
+Experimental and off by default: on the machines measured so far it is
+slower than Booster.predict at every batch size (about 6x at 1-30 rows,
+10x at 100 and 4x at 1000 rows on a 1-CPU box with the 15-tree model),
+because the per-level NumPy calls cost more than LightGBM's fixed
+overhead. pred.py only uses it, and only writes the compiled arrays next
+to the model file (<model>.compiled.npz, rebuilt when the model file
+changes), when PREDICT_ENGINE=compiled is set explicitly. Batches above
+MAX_COMPILED_ROWS are handed back to Booster.predict.
+
+    python python/tree_engine.py '{"batch_sizes": [1, 10, 100, 1000]}'
+
+benchmarks both engines against the current model; enable the engine on
+a serving machine only if it reports a speedup above 1 for the batch
+sizes that machine sees, and set MAX_COMPILED_ROWS to the largest of them.
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from storage import atomic_path, project_dir
+
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type "Zero"
+ZERO_THRESHOLD = 1e-35
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+
+# Rows per vectorised pass, bounding the (rows x trees) cursor arrays
+CHUNK_ROWS = 16384
+# Above this many rows predict() defers to Booster.predict when available.
+# No winning range has been measured yet (see the module docstring), so
+# this only bounds the cost of opting in to the compiled engine.
+MAX_COMPILED_ROWS = 100
+
+LINK_FUNCTIONS = {
+    "regression": None,
+    "regression_l1": None,
+    "huber": None,
+    "fair": None,
+    "quantile": None,
+    "mape": None,
+    "poisson": np.exp,
+    "gamma": np.exp,
+    "tweedie": np.exp,
+}
+
+DEFAULT_BATCH_SIZES = [1, 10, 100, 1000]
+
+
+class CompiledBooster:
+    """Flat-array form of a LightGBM booster with a predict() like Booster's"""
+
+    def __init__(self, arrays, booster=None, max_rows=MAX_COMPILED_ROWS):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.nan_right = arrays["nan_right"]
+        self.zero_default = arrays["zero_default"]
+        self.default_right = arrays["default_right"]
+        self.leaf_value = arrays["leaf_value"]
+        self.roots = arrays["roots"]
+        self.depth = int(arrays["depth"])
+        self.num_feature = int(arrays["num_feature"])
+        self.link = str(arrays["link"])
+        self.has_zero_splits = bool(self.zero_default.any())
+        self.booster = booster
+        self.max_rows = max_rows
+
+    @property
+    def num_trees(self):
+        return len(self.roots)
+
+    def predict(self, X):
+        """Predictions for a DataFrame or 2-D array of model inputs"""
+        X = np.ascontiguousarray(X.to_numpy(dtype=np.float64) if isinstance(X, pd.DataFrame)
+                                 else np.asarray(X, dtype=np.float64))
+        if X.ndim != 2 or X.shape[1] != self.num_feature:
+            raise ValueError(f"Expected {self.num_feature} features, got input of shape {X.shape}")
+        if self.booster is not None and len(X) > self.max_rows:
+            return self.booster.predict(X)
+
+        raw = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), CHUNK_ROWS):
+            chunk = X[start:start + CHUNK_ROWS]
+            raw[start:start + len(chunk)] = self.raw_scores(chunk)
+        if self.link == "exp":
+            return np.exp(raw)
+        return raw
+
+    def raw_scores(self, X):
+        """Sum of leaf values over all trees for each row"""
+        n = len(X)
+        flat = X.ravel()
+        row_offset = (np.arange(n, dtype=np.int64) * self.num_feature)[:, None]
+        node = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        has_nan = bool(np.isnan(X).any())
+
+        for _ in range(self.depth):
+            fval = flat.take(row_offset + self.feature.take(node))
+            go_right = fval > self.threshold.take(node)
+            if has_nan:
+                go_right = np.where(np.isnan(fval), self.nan_right.take(node), go_right)
+            if self.has_zero_splits:
+                zero = self.zero_default.take(node) & (np.abs(fval) <= ZERO_THRESHOLD)
+                go_right = np.where(zero, self.default_right.take(node), go_right)
+            # children holds (left, right) pairs, so the branch taken is an offset
+            node = self.children.take(node * 2 + go_right)
+
+        return self.leaf_value.take(node).sum(axis=1)
+
+
+def compile_booster(booster):
+    """Node arrays for every tree of a booster (see CompiledBooster)"""
+    dump = booster.dump_model()
+    objective = dump.get("objective", "regression").split()[0]
+    if objective not in LINK_FUNCTIONS:
+        raise ValueError(f"Unsupported objective for compiled inference: {objective}")
+    if dump.get("num_tree_per_iteration", 1) != 1:
+        raise ValueError("Compiled inference supports single-output models only")
+    average = bool(dump.get("average_output"))
+
+    nodes = {key: [] for key in ("feature", "threshold", "left", "right", "nan_right",
+                                 "zero_default", "default_right", "leaf_value")}
+    roots = []
+    max_depth = 0
+
+    def add_node():
+        idx = len(nodes["feature"])
+        for key in nodes:
+            nodes[key].append(0)
+        return idx
+
+    def flatten(tree, depth):
+        nonlocal max_depth
+        idx = add_node()
+        if "leaf_value" in tree:
+            if "leaf_coeff" in tree:
+                raise ValueError("Linear trees are not supported by compiled inference")
+            max_depth = max(max_depth, depth)
+            nodes["feature"][idx] = 0
+            nodes["threshold"][idx] = np.inf
+            nodes["left"][idx] = nodes["right"][idx] = idx
+            nodes["leaf_value"][idx] = tree["leaf_value"]
+            return idx
+        if tree["decision_type"] != "<=":
+            raise ValueError("Categorical splits are not supported by compiled inference")
+
+        missing_type = MISSING_TYPES[tree["missing_type"]]
+        threshold = float(tree["threshold"])
+        nodes["feature"][idx] = tree["split_feature"]
+        nodes["threshold"][idx] = threshold
+        nodes["default_right"][idx] = not tree["default_left"]
+        # NaN goes the default way unless missing values are off, in which
+        # case LightGBM scores it as 0
+        nodes["nan_right"][idx] = not tree["default_left"] if missing_type else 0.0 > threshold
+        nodes["zero_default"][idx] = missing_type == MISSING_TYPES["Zero"]
+        nodes["left"][idx] = flatten(tree["left_child"], depth + 1)
+        nodes["right"][idx] = flatten(tree["right_child"], depth + 1)
+        return idx
+
+    for tree in dump["tree_info"]:
+        roots.append(flatten(tree["tree_structure"], 0))
+
+    leaf_value = np.asarray(nodes["leaf_value"], dtype=np.float64)
+    if average and roots:
+        leaf_value /= len(roots)
+
+    index_dtype = np.int32 if 2 * len(nodes["feature"]) < 2 ** 31 else np.int64
+    return {
+        "feature": np.asarray(nodes["feature"], dtype=np.int32),
+        "threshold": np.asarray(nodes["threshold"], dtype=np.float64),
+        "children": np.column_stack([nodes["left"], nodes["right"]]).astype(index_dtype).ravel(),
+        "nan_right": np.asarray(nodes["nan_right"], dtype=bool),
+        "zero_default": np.asarray(nodes["zero_default"], dtype=bool),
+        "default_right": np.asarray(nodes["default_right"], dtype=bool),
+        "leaf_value": leaf_value,
+        "roots": np.asarray(roots, dtype=index_dtype),
+        "depth": np.int64(max_depth),
+        "num_feature": np.int64(booster.num_feature()),
+        "link": np.str_("exp" if LINK_FUNCTIONS[objective] is np.exp else "identity"),
+    }
+
+
+def model_signature(model_path):
+    stat = Path(model_path).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_compiled(model_path, booster=None):
+    """CompiledBooster for a model file, from the .compiled.npz cache when current.
+
+    `booster` (loaded from model_path if omitted) is kept for large batches.
+    """
+    model_path = Path(model_path)
+    cache_path = model_path.with_suffix(".compiled.npz")
+    signature = model_signature(model_path)
+    if booster is None:
+        booster = lgb.Booster(model_file=str(model_path))
+
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached["signature"]) == signature:
+                    return CompiledBooster({key: cached[key] for key in cached.files}, booster)
+        except Exception as e:
+            print(f"Could not load compiled model cache: {e}")
+
+    arrays = compile_booster(booster)
+    try:
+        with atomic_path(cache_path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, signature=np.str_(signature), **arrays)
+    except OSError as e:
+        print(f"Could not write compiled model cache: {e}")
+    return CompiledBooster(arrays, booster)
+
+
+def time_call(fn, min_seconds=0.2, max_repeats=1000):
+    """Median seconds per call, repeating fast calls for a stable figure"""
+    fn()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_repeats and (len(timings) < 3 or time.perf_counter() - started < min_seconds):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return float(np.median(timings)), len(timings)
+
+
+def benchmark(model_path=None, batch_sizes=None, seed=42):
+    """Compare Booster.predict with the compiled engine on random inputs.
+
+    Inputs are drawn from the thresholds the model actually splits on, with
+    some NaNs, so both engines exercise every branch type.
+    """
+    base_dir = project_dir()
+    model_path = Path(model_path) if model_path else base_dir / "python" / "models" / "lgbm_model.txt"
+    if not model_path.exists():
+        raise FileNotFoundError(f"Model not found: {model_path}. Please train the model first.")
+
+    booster = lgb.Booster(model_file=str(model_path))
+    t0 = time.perf_counter()
+    compiled = CompiledBooster(compile_booster(booster), booster=None)
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    rng = np.random.default_rng(seed)
+    n_features = compiled.num_feature
+    split_values = [compiled.threshold[(compiled.feature == f) & np.isfinite(compiled.threshold)]
+                    for f in range(n_features)]
+
+    results = []
+    for batch_size in batch_sizes or DEFAULT_BATCH_SIZES:
+        X = np.empty((batch_size, n_features), dtype=np.float64)
+        for f, values in enumerate(split_values):
+            if len(values):
+                X[:, f] = rng.choice(values, batch_size) + rng.normal(0, 0.5, batch_size)
+            else:
+                X[:, f] = rng.normal(0, 1, batch_size)
+        X[rng.random(X.shape) < 0.05] = np.nan
+
+        expected = booster.predict(X)
+        actual = compiled.predict(X)
+        lgb_seconds, lgb_runs = time_call(lambda: booster.predict(X))
+        compiled_seconds, compiled_runs = time_call(lambda: compiled.predict(X))
+        results.append({
+            "batch_size": batch_size,
+            "lightgbm_ms": round(lgb_seconds * 1000, 4),
+            "compiled_ms": round(compiled_seconds * 1000, 4),
+            "speedup": round(lgb_seconds / compiled_seconds, 2),
+            "max_abs_diff": float(np.max(np.abs(expected - actual))),
+            "runs": [lgb_runs, compiled_runs],
+        })
+        print(f"batch {batch_size:>7}: lightgbm {lgb_seconds * 1000:.3f} ms, "
+              f"compiled {compiled_seconds * 1000:.3f} ms")
+
+    return {
+        "status": "success",
+        "model_file": str(model_path),
+        "num_trees": compiled.num_trees,
+        "max_depth": compiled.depth,
+        "compile_ms": round(compile_ms, 2),
+        "max_compiled_rows": MAX_COMPILED_ROWS,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    params = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    try:
+        result = benchmark(params.get("model_file"), params.get("batch_sizes"))
+    except Exception as e:
+        result = {"status": "error", "message": f"Inference benchmark failed: {str(e)}"}
+    print(json.dumps(result))
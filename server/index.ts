@@ -11,7 +11,13 @@ import {
   exportMapHandler,
 } from "./routes/export";
 import { healthHandler } from "./routes/health";
-import { serveMapHandler, getMapDataHandler } from "./routes/map";
+import {
+  serveMapHandler,
+  serveMapGeoJSONHandler,
+  getMapDataHandler,
+} from "./routes/map";
+import { timingsHandler } from "./routes/timings";
+import { jobHandler, jobsHandler } from "./routes/jobs";
 
 export function createServer() {
   const app = express();
@@ -43,6 +49,14 @@ export function createServer() {
   // Map endpoints
   app.get("/api/map/view", serveMapHandler);
   app.get("/api/map/data", getMapDataHandler);
+  app.get("/api/map/geojson", serveMapGeoJSONHandler);
+
+  // Per-stage timings of recent pipeline runs
+  app.get("/api/timings", timingsHandler);
+
+  // Pipeline job status (pass ?async=1 to the endpoints above to get a job id)
+  app.get("/api/jobs", jobsHandler);
+  app.get("/api/jobs/:id", jobHandler);
 
   return app;
 }
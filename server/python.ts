@@ -0,0 +1,82 @@
+import { spawn } from "child_process";
+
+// Longest stdout line kept as a job's progress message
+const MAX_PROGRESS_LENGTH = 200;
+
+export interface PythonScriptOptions {
+  // Called with each non-empty stdout line, e.g. to report job progress
+  onOutput?: (line: string) => void;
+}
+
+/**
+ * Run a pipeline script once and resolve with the JSON object it prints
+ * on its last stdout line.
+ */
+export function executePythonScript(
+  scriptPath: string,
+  args: string[] = [],
+  options: PythonScriptOptions = {},
+): Promise<any> {
+  return new Promise((resolve, reject) => {
+    console.log(
+      `Spawning Python process: python3 ${scriptPath} ${args.join(" ")}`,
+    );
+
+    const python = spawn("python3", [scriptPath, ...args], {
+      cwd: process.cwd(),
+      env: {
+        ...process.env,
+        PYTHONPATH: process.cwd(),
+        PYTHONIOENCODING: "utf-8",
+      },
+    });
+
+    let stdout = "";
+    let stderr = "";
+
+    python.stdout.on("data", (data) => {
+      const output = data.toString();
+      stdout += output;
+      console.log("Python stdout:", output.trim());
+      if (options.onOutput) {
+        for (const line of output.split("\n")) {
+          const message = line.trim();
+          // The final JSON result is not progress
+          if (message && !message.startsWith("{")) {
+            options.onOutput(message.slice(0, MAX_PROGRESS_LENGTH));
+          }
+        }
+      }
+    });
+
+    python.stderr.on("data", (data) => {
+      const error = data.toString();
+      stderr += error;
+      console.error("Python stderr:", error.trim());
+    });
+
+    python.on("close", (code) => {
+      console.log(`Python process closed with code: ${code}`);
+
+      if (code === 0) {
+        try {
+          // The script's result is its last stdout line
+          const lines = stdout.trim().split("\n");
+          const lastLine = lines[lines.length - 1];
+          const result = JSON.parse(lastLine);
+          resolve(result);
+        } catch (e) {
+          console.log("JSON parse failed, returning raw output");
+          resolve({ status: "success", message: stdout });
+        }
+      } else {
+        reject(new Error(`Python script failed with code ${code}: ${stderr}`));
+      }
+    });
+
+    python.on("error", (error) => {
+      console.error("Python spawn error:", error);
+      reject(error);
+    });
+  });
+}
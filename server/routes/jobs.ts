@@ -0,0 +1,328 @@
+import { RequestHandler, Request, Response } from "express";
+import { randomUUID } from "crypto";
+
+// Pipeline jobs run through one scheduler so concurrent requests cannot
+// race on the files under python/data and python/models. Each job type
+// has a concurrency limit, identical in-flight requests share one job, and
+// every job gets an id that can be polled at /api/jobs/:id.
+
+export type JobType = "preprocess" | "train" | "predict" | "route";
+export type JobStatus = "queued" | "running" | "succeeded" | "failed";
+
+interface JobTypeConfig {
+  // Jobs of this type that may run at once
+  concurrency: number;
+  // Runs alone: waits for running jobs and holds back later queued ones
+  exclusive: boolean;
+  // Whether a new identical request may join a job that already started
+  joinRunning: boolean;
+}
+
+function envLimit(name: string, fallback: number): number {
+  const value = Number(process.env[name]);
+  return Number.isFinite(value) && value >= 1 ? Math.floor(value) : fallback;
+}
+
+const JOB_TYPES: Record<JobType, JobTypeConfig> = {
+  // Rewrites the processed data every other job reads, and may have been
+  // started before the latest upload
+  preprocess: { concurrency: 1, exclusive: true, joinRunning: false },
+  // Writes the served model files and the Dataset cache
+  train: { concurrency: 1, exclusive: false, joinRunning: true },
+  predict: {
+    concurrency: envLimit("PREDICT_CONCURRENCY", 2),
+    exclusive: false,
+    joinRunning: true,
+  },
+  route: {
+    concurrency: envLimit("ROUTE_CONCURRENCY", 2),
+    exclusive: false,
+    joinRunning: true,
+  },
+};
+
+// Queued jobs beyond this are rejected with 503 instead of piling up
+const MAX_QUEUED_JOBS = envLimit("MAX_QUEUED_JOBS", 20);
+// Finished jobs kept for polling, oldest dropped first
+const MAX_FINISHED_JOBS = 100;
+
+export interface Job {
+  id: string;
+  type: JobType;
+  key: string;
+  params: any;
+  status: JobStatus;
+  progress: string | null;
+  requests: number;
+  created_at: string;
+  started_at: string | null;
+  finished_at: string | null;
+  result: any;
+  error: string | null;
+  done: Promise<any>;
+}
+
+type JobRunner = (job: Job) => Promise<any>;
+
+interface PendingJob {
+  job: Job;
+  run: JobRunner;
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+}
+
+export class JobQueueFullError extends Error {
+  constructor(type: JobType) {
+    super(`Too many queued jobs (${MAX_QUEUED_JOBS}), not accepting ${type}`);
+    this.name = "JobQueueFullError";
+  }
+}
+
+class JobQueue {
+  private jobs = new Map<string, Job>();
+  private queued: PendingJob[] = [];
+  private running = new Set<Job>();
+  private finished: Job[] = [];
+
+  submit(type: JobType, params: any, run: JobRunner): Job {
+    const key = `${type}:${JSON.stringify(params ?? {})}`;
+    const duplicate = this.findDuplicate(type, key);
+    if (duplicate) {
+      duplicate.requests += 1;
+      console.log(`[jobs] ${type} request joined job ${duplicate.id}`);
+      return duplicate;
+    }
+    if (this.queued.length >= MAX_QUEUED_JOBS) {
+      throw new JobQueueFullError(type);
+    }
+
+    let resolve: (result: any) => void;
+    let reject: (error: Error) => void;
+    const done = new Promise<any>((res, rej) => {
+      resolve = res;
+      reject = rej;
+    });
+    // Jobs submitted in async mode may fail with nobody awaiting them
+    done.catch(() => {});
+
+    const job: Job = {
+      id: randomUUID(),
+      type,
+      key,
+      params: params ?? {},
+      status: "queued",
+      progress: null,
+      requests: 1,
+      created_at: new Date().toISOString(),
+      started_at: null,
+      finished_at: null,
+      result: null,
+      error: null,
+      done,
+    };
+    this.jobs.set(job.id, job);
+    this.queued.push({ job, run, resolve, reject });
+    console.log(`[jobs] queued ${type} job ${job.id}`);
+    this.schedule();
+    return job;
+  }
+
+  get(id: string): Job | undefined {
+    return this.jobs.get(id);
+  }
+
+  list(): Job[] {
+    return Array.from(this.jobs.values());
+  }
+
+  queuePosition(job: Job): number | null {
+    const index = this.queued.findIndex((pending) => pending.job === job);
+    return index >= 0 ? index + 1 : null;
+  }
+
+  counts() {
+    const counts: Record<
+      string,
+      { queued: number; running: number; limit: number }
+    > = {};
+    for (const [type, config] of Object.entries(JOB_TYPES)) {
+      counts[type] = { queued: 0, running: 0, limit: config.concurrency };
+    }
+    for (const pending of this.queued) {
+      counts[pending.job.type].queued += 1;
+    }
+    for (const job of this.running) {
+      counts[job.type].running += 1;
+    }
+    return counts;
+  }
+
+  private findDuplicate(type: JobType, key: string): Job | undefined {
+    // Never join a job that runs before a queued exclusive job, which
+    // will change the data that job reads
+    let lastExclusive = -1;
+    this.queued.forEach((pending, index) => {
+      if (JOB_TYPES[pending.job.type].exclusive) {
+        lastExclusive = index;
+      }
+    });
+
+    const index = this.queued.findIndex((pending) => pending.job.key === key);
+    if (index >= 0 && index >= lastExclusive) {
+      return this.queued[index].job;
+    }
+    if (!JOB_TYPES[type].joinRunning || lastExclusive >= 0) {
+      return undefined;
+    }
+    return Array.from(this.running).find((job) => job.key === key);
+  }
+
+  private runningOfType(type: JobType): number {
+    let count = 0;
+    for (const job of this.running) {
+      if (job.type === type) {
+        count += 1;
+      }
+    }
+    return count;
+  }
+
+  private schedule() {
+    for (const job of this.running) {
+      if (JOB_TYPES[job.type].exclusive) {
+        return;
+      }
+    }
+
+    // In submission order; a job at its type's limit lets later jobs of
+    // other types pass, an exclusive job does not
+    for (const pending of [...this.queued]) {
+      const config = JOB_TYPES[pending.job.type];
+      if (config.exclusive) {
+        if (this.running.size === 0) {
+          this.start(pending);
+        }
+        return;
+      }
+      if (this.runningOfType(pending.job.type) < config.concurrency) {
+        this.start(pending);
+      }
+    }
+  }
+
+  private start(pending: PendingJob) {
+    const { job, run } = pending;
+    this.queued = this.queued.filter((other) => other !== pending);
+    this.running.add(job);
+    job.status = "running";
+    job.started_at = new Date().toISOString();
+    console.log(`[jobs] started ${job.type} job ${job.id}`);
+
+    run(job).then(
+      (result) => {
+        const failed = result?.status === "error";
+        const status = failed ? "failed" : "succeeded";
+        this.finish(job, status, result, result?.message);
+        pending.resolve(result);
+      },
+      (error) => {
+        const message = error instanceof Error ? error.message : String(error);
+        this.finish(job, "failed", null, message);
+        pending.reject(error instanceof Error ? error : new Error(message));
+      },
+    );
+  }
+
+  private finish(
+    job: Job,
+    status: JobStatus,
+    result: any,
+    error: string | null,
+  ) {
+    this.running.delete(job);
+    job.status = status;
+    job.result = result;
+    job.error = status === "failed" ? (error ?? "Unknown error") : null;
+    job.finished_at = new Date().toISOString();
+    const ms = Date.parse(job.finished_at) - Date.parse(job.started_at!);
+    console.log(`[jobs] ${job.type} job ${job.id} ${status} after ${ms}ms`);
+
+    this.finished.push(job);
+    if (this.finished.length > MAX_FINISHED_JOBS) {
+      this.jobs.delete(this.finished.shift()!.id);
+    }
+    this.schedule();
+  }
+}
+
+const jobQueue = new JobQueue();
+
+// Queue `run` as a job of `type`, or join an identical job in flight
+export function submitJob(type: JobType, params: any, run: JobRunner): Job {
+  return jobQueue.submit(type, params, run);
+}
+
+// Whether the caller asked for a job id instead of waiting for the result
+export function wantsAsync(req: Request): boolean {
+  const flag = req.query.async ?? req.body?.async;
+  return flag === true || flag === "true" || flag === "1";
+}
+
+export function jobSummary(job: Job) {
+  return {
+    job_id: job.id,
+    type: job.type,
+    status: job.status,
+    params: job.params,
+    progress: job.progress,
+    queue_position: jobQueue.queuePosition(job),
+    requests: job.requests,
+    created_at: job.created_at,
+    started_at: job.started_at,
+    finished_at: job.finished_at,
+    result: job.result,
+    error: job.error,
+  };
+}
+
+// Answer a pipeline request: 202 with the job in async mode, otherwise
+// wait and send the script result tagged with its job id
+export async function respondWithJob(req: Request, res: Response, job: Job) {
+  if (wantsAsync(req)) {
+    res.status(202).json(jobSummary(job));
+    return;
+  }
+  const result = await job.done;
+  res.json({ ...result, job_id: job.id });
+}
+
+// Send 503 if `error` is a full queue; returns whether it did
+export function sendQueueFull(res: Response, error: unknown): boolean {
+  if (!(error instanceof JobQueueFullError)) {
+    return false;
+  }
+  res.status(503).set("Retry-After", "30").json({
+    status: "error",
+    message: error.message,
+  });
+  return true;
+}
+
+export const jobHandler: RequestHandler = (req, res) => {
+  const job = jobQueue.get(req.params.id);
+  if (!job) {
+    res.status(404).json({ status: "error", message: "Job not found" });
+    return;
+  }
+  res.json(jobSummary(job));
+};
+
+export const jobsHandler: RequestHandler = (req, res) => {
+  const { type, status } = req.query;
+  const jobs = jobQueue
+    .list()
+    .filter((job) => typeof type !== "string" || job.type === type)
+    .filter((job) => typeof status !== "string" || job.status === status)
+    .map(jobSummary);
+  res.json({ status: "success", queue: jobQueue.counts(), jobs });
+};
@@ -2,45 +2,60 @@ import { RequestHandler } from "express";
 import path from "path";
 import fs from "fs";
 
-export const serveMapHandler: RequestHandler = async (req, res) => {
-  try {
-    // Try multiple map file locations
-    const mapPaths = [
-      path.join(
-        process.cwd(),
-        "python",
-        "data",
-        "processed",
-        "delivery_route_maptiler_osrm_co2.html",
-      ),
-      path.join(
-        process.cwd(),
-        "python",
-        "data",
-        "processed",
-        "delivery_route_simple.html",
-      ),
-    ];
+// Map outputs in the processed data directory. `marker` is the file a route
+// run writes, `page` the HTML served for it (the GeoJSON mode serves a static
+// shell that loads /api/map/geojson).
+const MAP_OUTPUTS = [
+  { marker: "route.geojson", page: "route_map.html", format: "geojson" },
+  {
+    marker: "delivery_route_maptiler_osrm_co2.html",
+    page: "delivery_route_maptiler_osrm_co2.html",
+    format: "html",
+  },
+  {
+    marker: "delivery_route_simple.html",
+    page: "delivery_route_simple.html",
+    format: "html",
+  },
+];
+
+function processedDir() {
+  return path.join(process.cwd(), "python", "data", "processed");
+}
 
-    let mapPath = null;
-    for (const testPath of mapPaths) {
-      if (fs.existsSync(testPath)) {
-        mapPath = testPath;
-        console.log(`Found map file: ${mapPath}`);
-        break;
-      }
+// Most recently generated map, whichever mode produced it
+function latestMap() {
+  let latest: { pagePath: string; format: string; stats: fs.Stats } | null =
+    null;
+  for (const output of MAP_OUTPUTS) {
+    const markerPath = path.join(processedDir(), output.marker);
+    const pagePath = path.join(processedDir(), output.page);
+    if (!fs.existsSync(markerPath) || !fs.existsSync(pagePath)) {
+      continue;
     }
+    const stats = fs.statSync(markerPath);
+    if (!latest || stats.mtimeMs > latest.stats.mtimeMs) {
+      latest = { pagePath, format: output.format, stats };
+    }
+  }
+  return latest;
+}
+
+export const serveMapHandler: RequestHandler = async (req, res) => {
+  try {
+    const map = latestMap();
 
     // Check if map file exists
-    if (!mapPath) {
+    if (!map) {
       return res.status(404).json({
         status: "error",
         message: "Map file not found. Please generate a route first.",
       });
     }
+    console.log(`Found map file: ${map.pagePath}`);
 
     // Read and serve the HTML file
-    const mapContent = fs.readFileSync(mapPath, "utf8");
+    const mapContent = fs.readFileSync(map.pagePath, "utf8");
     res.setHeader("Content-Type", "text/html");
     res.send(mapContent);
   } catch (error) {
@@ -53,39 +68,35 @@ export const serveMapHandler: RequestHandler = async (req, res) => {
   }
 };
 
-export const getMapDataHandler: RequestHandler = async (req, res) => {
+export const serveMapGeoJSONHandler: RequestHandler = async (req, res) => {
   try {
-    // Try multiple map file locations
-    const mapPaths = [
-      path.join(
-        process.cwd(),
-        "python",
-        "data",
-        "processed",
-        "delivery_route_maptiler_osrm_co2.html",
-      ),
-      path.join(
-        process.cwd(),
-        "python",
-        "data",
-        "processed",
-        "delivery_route_simple.html",
-      ),
-    ];
+    const geojsonPath = path.join(processedDir(), "route.geojson");
+    if (!fs.existsSync(geojsonPath)) {
+      return res.status(404).json({
+        status: "error",
+        message: "Route GeoJSON not found. Generate a route with map_format \"geojson\" first.",
+      });
+    }
 
-    let mapPath = null;
-    let mapStats = null;
+    res.setHeader("Content-Type", "application/geo+json");
+    res.setHeader("Cache-Control", "no-cache");
+    res.sendFile(geojsonPath);
+  } catch (error) {
+    console.error("GeoJSON serving error:", error);
+    res.status(500).json({
+      status: "error",
+      message: "Failed to serve route GeoJSON",
+      error: error instanceof Error ? error.message : "Unknown error",
+    });
+  }
+};
 
-    for (const testPath of mapPaths) {
-      if (fs.existsSync(testPath)) {
-        mapPath = testPath;
-        mapStats = fs.statSync(testPath);
-        break;
-      }
-    }
+export const getMapDataHandler: RequestHandler = async (req, res) => {
+  try {
+    const map = latestMap();
 
     // Check if map file exists
-    if (!mapPath) {
+    if (!map) {
       return res.json({
         status: "not_found",
         message: "No map available. Generate a route first.",
@@ -98,7 +109,9 @@ export const getMapDataHandler: RequestHandler = async (req, res) => {
       message: "Map is available",
       hasMap: true,
       mapUrl: "/api/map/view",
-      lastGenerated: mapStats.mtime.toISOString(),
+      format: map.format,
+      geojsonUrl: map.format === "geojson" ? "/api/map/geojson" : undefined,
+      lastGenerated: map.stats.mtime.toISOString(),
     });
   } catch (error) {
     console.error("Map data error:", error);
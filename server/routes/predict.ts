@@ -1,67 +1,152 @@
 import { RequestHandler } from "express";
-import { spawn } from "child_process";
+import { spawn, ChildProcess } from "child_process";
+import readline from "readline";
 import path from "path";
 import fs from "fs";
+import { executePythonScript } from "../python";
+import { recordTimings } from "./timings";
+import { respondWithJob, sendQueueFull, submitJob } from "./jobs";
 
-function executePythonScript(
-  scriptPath: string,
-  args: string[] = [],
-): Promise<any> {
-  return new Promise((resolve, reject) => {
-    console.log(
-      `Spawning Python process: python3 ${scriptPath} ${args.join(" ")}`,
-    );
+// Number of long-lived pred_server.py workers (0 disables them)
+const PREDICT_WORKERS = Number(process.env.PREDICT_WORKERS ?? 1);
+const WORKER_TIMEOUT_MS = 60000;
 
-    const python = spawn("python3", [scriptPath, ...args], {
-      cwd: process.cwd(),
-      env: {
-        ...process.env,
-        PYTHONPATH: process.cwd(),
-        PYTHONIOENCODING: "utf-8",
-      },
-    });
+interface PendingPrediction {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+}
 
-    let stdout = "";
-    let stderr = "";
+/**
+ * A persistent Python prediction process speaking JSON lines over
+ * stdin/stdout. The model stays loaded between requests; the process is
+ * restarted lazily if it exits.
+ */
+class PredictionWorker {
+  private python: ChildProcess | null = null;
+  private ready: Promise<void> | null = null;
+  private pending = new Map<number, PendingPrediction>();
+  private nextId = 1;
 
-    python.stdout.on("data", (data) => {
-      const output = data.toString();
-      stdout += output;
-      console.log("Python stdout:", output.trim());
-    });
+  get load(): number {
+    return this.pending.size;
+  }
 
-    python.stderr.on("data", (data) => {
-      const error = data.toString();
-      stderr += error;
-      console.error("Python stderr:", error.trim());
-    });
+  private start(scriptPath: string): Promise<void> {
+    if (this.ready) {
+      return this.ready;
+    }
+
+    this.ready = new Promise((resolve, reject) => {
+      console.log(`Starting prediction worker: python3 ${scriptPath}`);
 
-    python.on("close", (code) => {
-      console.log(`Python process closed with code: ${code}`);
-      console.log("Full stdout:", stdout);
-      console.log("Full stderr:", stderr);
+      const python = spawn("python3", [scriptPath], {
+        cwd: process.cwd(),
+        env: {
+          ...process.env,
+          PYTHONPATH: process.cwd(),
+          PYTHONIOENCODING: "utf-8",
+        },
+      });
+      this.python = python;
 
-      if (code === 0) {
+      const startupTimer = setTimeout(() => {
+        reject(new Error("Prediction worker did not become ready in time"));
+        python.kill();
+      }, WORKER_TIMEOUT_MS);
+
+      readline.createInterface({ input: python.stdout! }).on("line", (line) => {
+        let message: any;
         try {
-          const lines = stdout.trim().split("\n");
-          const lastLine = lines[lines.length - 1];
-          console.log("Attempting to parse last line:", lastLine);
-          const result = JSON.parse(lastLine);
-          resolve(result);
+          message = JSON.parse(line);
         } catch (e) {
-          console.log("JSON parse failed, returning raw output");
-          resolve({ status: "success", message: stdout });
+          console.log("Prediction worker stdout:", line);
+          return;
         }
-      } else {
-        reject(new Error(`Python script failed with code ${code}: ${stderr}`));
-      }
+
+        if (message.event === "ready") {
+          clearTimeout(startupTimer);
+          console.log("✓ Prediction worker ready");
+          resolve();
+          return;
+        }
+
+        const request = this.pending.get(message.id);
+        if (request) {
+          clearTimeout(request.timer);
+          this.pending.delete(message.id);
+          request.resolve(message.result);
+        }
+      });
+
+      python.stderr!.on("data", (data) => {
+        console.log("Prediction worker:", data.toString().trim());
+      });
+
+      python.on("exit", (code) => {
+        console.log(`Prediction worker exited with code: ${code}`);
+        clearTimeout(startupTimer);
+        reject(new Error(`Prediction worker exited with code ${code}`));
+        if (this.python === python) {
+          this.stop(new Error(`Prediction worker exited with code ${code}`));
+        }
+      });
+
+      python.on("error", (error) => {
+        console.error("Prediction worker spawn error:", error);
+        clearTimeout(startupTimer);
+        reject(error);
+        if (this.python === python) {
+          this.stop(error);
+        }
+      });
     });
 
-    python.on("error", (error) => {
-      console.error("Python spawn error:", error);
-      reject(error);
+    return this.ready;
+  }
+
+  private stop(error: Error) {
+    for (const request of this.pending.values()) {
+      clearTimeout(request.timer);
+      request.reject(error);
+    }
+    this.pending.clear();
+    if (this.python && this.python.exitCode === null) {
+      this.python.kill();
+    }
+    this.python = null;
+    this.ready = null;
+  }
+
+  async predict(scriptPath: string, params: object): Promise<any> {
+    await this.start(scriptPath);
+
+    return new Promise((resolve, reject) => {
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error("Prediction worker timed out"));
+        // A stuck worker would hold every later request, so restart it
+        this.stop(new Error("Prediction worker restarted after timeout"));
+      }, WORKER_TIMEOUT_MS);
+
+      this.pending.set(id, { resolve, reject, timer });
+      this.python!.stdin!.write(JSON.stringify({ id, params }) + "\n");
     });
-  });
+  }
+}
+
+const predictionWorkers = Array.from(
+  { length: Math.max(0, PREDICT_WORKERS) },
+  () => new PredictionWorker(),
+);
+
+function predictWithWorker(scriptPath: string, params: object): Promise<any> {
+  // Route to the least busy worker
+  const worker = predictionWorkers.reduce((best, candidate) =>
+    candidate.load < best.load ? candidate : best,
+  );
+  return worker.predict(scriptPath, params);
 }
 
 export const predictHandler: RequestHandler = async (req, res) => {
@@ -87,16 +172,48 @@ export const predictHandler: RequestHandler = async (req, res) => {
     }
     console.log("✓ Prediction script found");
 
-    // Execute Python prediction script
-    const params = JSON.stringify({ category, store, start_date, end_date });
-    console.log("Parameters being passed to Python:", params);
-    console.log("Executing Python prediction script...");
+    const params = { category, store, start_date, end_date };
+    console.log("Parameters being passed to Python:", JSON.stringify(params));
 
-    const result = await executePythonScript(scriptPath, [params]);
-    console.log("✓ Python prediction completed successfully");
+    // Prefer the persistent worker; spawn pred.py per request as a fallback
+    const workerScriptPath = path.join(
+      process.cwd(),
+      "python",
+      "pred_server.py",
+    );
+    const job = submitJob("predict", params, async (job) => {
+      let result: any = null;
+      if (predictionWorkers.length > 0 && fs.existsSync(workerScriptPath)) {
+        try {
+          result = await predictWithWorker(workerScriptPath, params);
+          console.log("✓ Prediction worker completed successfully");
+        } catch (error) {
+          console.error("Prediction worker failed, falling back:", error);
+        }
+      }
 
-    res.json(result);
+      if (result === null) {
+        console.log("Executing Python prediction script...");
+        result = await executePythonScript(
+          scriptPath,
+          [JSON.stringify(params)],
+          {
+            onOutput: (line) => {
+              job.progress = line;
+            },
+          },
+        );
+        console.log("✓ Python prediction completed successfully");
+      }
+      recordTimings("predict", result);
+      return result;
+    });
+
+    await respondWithJob(req, res, job);
   } catch (error) {
+    if (sendQueueFull(res, error)) {
+      return;
+    }
     console.error("=== Prediction error ===");
     console.error("Error details:", error);
     res.status(500).json({
@@ -2,7 +2,71 @@ import { RequestHandler } from "express";
 import multer from "multer";
 import path from "path";
 import fs from "fs";
-import { spawn } from "child_process";
+import { executePythonScript } from "../python";
+import { recordTimings } from "./timings";
+import { respondWithJob, sendQueueFull, submitJob } from "./jobs";
+
+const UPLOAD_FILES = [
+  "sales_train_validation.csv",
+  "calendar.csv",
+  "sell_prices.csv",
+];
+
+// Uploads are written under a staging name and only renamed into place
+// when a preprocessing job starts, so a running job never reads a file
+// that is still being uploaded
+function stagedName(fileName: string): string {
+  return `.${fileName}.staged`;
+}
+
+function promoteUploads(uploadDir: string) {
+  for (const fileName of UPLOAD_FILES) {
+    const staged = path.join(uploadDir, stagedName(fileName));
+    if (fs.existsSync(staged)) {
+      fs.renameSync(staged, path.join(uploadDir, fileName));
+    }
+  }
+}
+
+interface PreprocessOptions {
+  streaming?: boolean;
+  chunk_size?: number;
+  full?: boolean;
+}
+
+// Multipart form fields arrive as strings, JSON bodies as typed values
+function parseFlag(name: string, value: unknown): boolean | undefined {
+  if (value === undefined || value === "") {
+    return undefined;
+  }
+  if (value === true || value === "true" || value === "1") {
+    return true;
+  }
+  if (value === false || value === "false" || value === "0") {
+    return false;
+  }
+  throw new Error(`${name} must be true or false`);
+}
+
+function parsePreprocessOptions(body: any): PreprocessOptions {
+  const options: PreprocessOptions = {};
+  const streaming = parseFlag("streaming", body.streaming);
+  if (streaming !== undefined) {
+    options.streaming = streaming;
+  }
+  const full = parseFlag("full", body.full);
+  if (full !== undefined) {
+    options.full = full;
+  }
+  if (body.chunk_size !== undefined && body.chunk_size !== "") {
+    const chunkSize = Number(body.chunk_size);
+    if (!Number.isInteger(chunkSize) || chunkSize < 1) {
+      throw new Error("chunk_size must be a positive integer");
+    }
+    options.chunk_size = chunkSize;
+  }
+  return options;
+}
 
 // Configure multer for file uploads
 const storage = multer.diskStorage({
@@ -14,65 +78,48 @@ const storage = multer.diskStorage({
     cb(null, uploadDir);
   },
   filename: (req, file, cb) => {
-    cb(null, file.originalname);
+    cb(null, stagedName(file.fieldname));
   },
 });
 
 const upload = multer({ storage });
 
-function executePythonScript(
-  scriptPath: string,
-  args: string[] = [],
-): Promise<any> {
-  return new Promise((resolve, reject) => {
-    const python = spawn("python", [scriptPath, ...args], {
-      cwd: process.cwd(),
-    });
-
-    let stdout = "";
-    let stderr = "";
-
-    python.stdout.on("data", (data) => {
-      stdout += data.toString();
-    });
-
-    python.stderr.on("data", (data) => {
-      stderr += data.toString();
-    });
-
-    python.on("close", (code) => {
-      if (code === 0) {
-        try {
-          // Try to parse the last line as JSON (our script output)
-          const lines = stdout.trim().split("\n");
-          const lastLine = lines[lines.length - 1];
-          const result = JSON.parse(lastLine);
-          resolve(result);
-        } catch (e) {
-          // If JSON parsing fails, return raw output
-          resolve({ status: "success", message: stdout });
-        }
-      } else {
-        reject(new Error(`Python script failed with code ${code}: ${stderr}`));
-      }
-    });
-
-    python.on("error", (error) => {
-      reject(error);
-    });
-  });
-}
-
 export const preprocessHandler: RequestHandler = async (req, res) => {
   try {
     console.log("Starting data preprocessing...");
 
-    // Execute Python preprocessing script
+    // Optional options, e.g. { streaming: true, chunk_size: 5000 } or
+    // { full: true } to rebuild instead of appending new days
+    let options: PreprocessOptions;
+    try {
+      options = parsePreprocessOptions(req.body ?? {});
+    } catch (error) {
+      res.status(400).json({
+        status: "error",
+        message: error instanceof Error ? error.message : "Invalid options",
+      });
+      return;
+    }
+    const args = Object.keys(options).length ? [JSON.stringify(options)] : [];
+
+    // Preprocessing runs alone: every other job reads the data it rewrites
     const scriptPath = path.join(process.cwd(), "python", "app.py");
-    const result = await executePythonScript(scriptPath);
+    const job = submitJob("preprocess", options, async (job) => {
+      promoteUploads(path.join(process.cwd(), "uploads"));
+      const result = await executePythonScript(scriptPath, args, {
+        onOutput: (line) => {
+          job.progress = line;
+        },
+      });
+      recordTimings("preprocess", result);
+      return result;
+    });
 
-    res.json(result);
+    await respondWithJob(req, res, job);
   } catch (error) {
+    if (sendQueueFull(res, error)) {
+      return;
+    }
     console.error("Preprocessing error:", error);
     res.status(500).json({
       status: "error",
@@ -82,8 +129,6 @@ export const preprocessHandler: RequestHandler = async (req, res) => {
   }
 };
 
-export const uploadMiddleware = upload.fields([
-  { name: "sales_train_validation.csv", maxCount: 1 },
-  { name: "calendar.csv", maxCount: 1 },
-  { name: "sell_prices.csv", maxCount: 1 },
-]);
+export const uploadMiddleware = upload.fields(
+  UPLOAD_FILES.map((name) => ({ name, maxCount: 1 })),
+);
@@ -0,0 +1,69 @@
+import { RequestHandler } from "express";
+
+// Recent per-stage timings reported by the Python scripts (see
+// python/instrument.py), newest last
+const MAX_TIMING_ENTRIES = 50;
+
+interface StageTiming {
+  stage: string;
+  ms: number;
+  cpu_ms: number;
+  rss_delta_mb: number | null;
+  rows: number | null;
+  rows_per_s: number | null;
+  calls: number;
+  profile: string | null;
+}
+
+interface TimingEntry {
+  endpoint: string;
+  recorded_at: string;
+  status: string;
+  script: string;
+  total_ms: number;
+  peak_rss_mb: number | null;
+  stages: StageTiming[];
+}
+
+const recentTimings: TimingEntry[] = [];
+
+// Log and keep the timings block of a script result, if it has one
+export function recordTimings(endpoint: string, result: any) {
+  const timings = result?.timings;
+  if (!timings || !Array.isArray(timings.stages)) {
+    return;
+  }
+
+  const entry: TimingEntry = {
+    endpoint,
+    recorded_at: new Date().toISOString(),
+    status: result.status ?? "unknown",
+    script: timings.script,
+    total_ms: timings.total_ms,
+    peak_rss_mb: timings.peak_rss_mb ?? null,
+    stages: timings.stages,
+  };
+  recentTimings.push(entry);
+  if (recentTimings.length > MAX_TIMING_ENTRIES) {
+    recentTimings.shift();
+  }
+
+  const stages = entry.stages
+    .map((stage) => {
+      const rows = stage.rows_per_s ? `, ${stage.rows_per_s} rows/s` : "";
+      return `${stage.stage}=${stage.ms}ms${rows}`;
+    })
+    .join(" ");
+  console.log(
+    `[timings] ${endpoint} ${entry.total_ms}ms (peak ${entry.peak_rss_mb} MB): ${stages}`,
+  );
+}
+
+export const timingsHandler: RequestHandler = (req, res) => {
+  const endpoint = req.query.endpoint;
+  const entries =
+    typeof endpoint === "string"
+      ? recentTimings.filter((entry) => entry.endpoint === endpoint)
+      : recentTimings;
+  res.json({ status: "success", timings: entries });
+};
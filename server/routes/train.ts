@@ -1,64 +1,9 @@
 import { RequestHandler } from "express";
-import { spawn } from "child_process";
 import path from "path";
 import fs from "fs";
-
-function executePythonScript(
-  scriptPath: string,
-  args: string[] = [],
-): Promise<any> {
-  return new Promise((resolve, reject) => {
-    console.log(
-      `Spawning Python process: python3 ${scriptPath} ${args.join(" ")}`,
-    );
-
-    const python = spawn("python3", [scriptPath, ...args], {
-      cwd: process.cwd(),
-      env: { ...process.env, PYTHONPATH: process.cwd() },
-    });
-
-    let stdout = "";
-    let stderr = "";
-
-    python.stdout.on("data", (data) => {
-      const output = data.toString();
-      stdout += output;
-      console.log("Python stdout:", output.trim());
-    });
-
-    python.stderr.on("data", (data) => {
-      const error = data.toString();
-      stderr += error;
-      console.error("Python stderr:", error.trim());
-    });
-
-    python.on("close", (code) => {
-      console.log(`Python process closed with code: ${code}`);
-      console.log("Full stdout:", stdout);
-      console.log("Full stderr:", stderr);
-
-      if (code === 0) {
-        try {
-          const lines = stdout.trim().split("\n");
-          const lastLine = lines[lines.length - 1];
-          console.log("Attempting to parse last line:", lastLine);
-          const result = JSON.parse(lastLine);
-          resolve(result);
-        } catch (e) {
-          console.log("JSON parse failed, returning raw output");
-          resolve({ status: "success", message: stdout });
-        }
-      } else {
-        reject(new Error(`Python script failed with code ${code}: ${stderr}`));
-      }
-    });
-
-    python.on("error", (error) => {
-      console.error("Python spawn error:", error);
-      reject(error);
-    });
-  });
-}
+import { executePythonScript } from "../python";
+import { recordTimings } from "./timings";
+import { respondWithJob, sendQueueFull, submitJob } from "./jobs";
 
 export const trainHandler: RequestHandler = async (req, res) => {
   try {
@@ -75,27 +20,73 @@ export const trainHandler: RequestHandler = async (req, res) => {
     }
     console.log("✓ Python script found");
 
-    // Check if processed data exists
-    const dataPath = path.join(
-      process.cwd(),
-      "python",
-      "data",
-      "processed",
-      "m5_preprocessed_sample.csv",
-    );
-    if (!fs.existsSync(dataPath)) {
+    // Check if processed data exists (Parquet dataset or legacy CSV)
+    const processedDir = path.join(process.cwd(), "python", "data", "processed");
+    const dataPaths = [
+      path.join(processedDir, "m5_preprocessed"),
+      path.join(processedDir, "m5_preprocessed_sample.csv"),
+    ];
+    if (!dataPaths.some((dataPath) => fs.existsSync(dataPath))) {
       throw new Error(
-        `Processed data not found at: ${dataPath}. Please run preprocessing first.`,
+        `Processed data not found in: ${processedDir}. Please run preprocessing first.`,
       );
     }
     console.log("✓ Processed data found");
 
-    console.log("Executing Python script...");
-    const result = await executePythonScript(scriptPath);
-    console.log("✓ Python script completed successfully");
+    // Optional training mode, e.g. { mode: "partitioned", partition_by: "store_id", workers: 4 }
+    // or { mode: "search", strategy: "random", trials: 12, space: { num_leaves: [15, 31] } }
+    // or { mode: "incremental", method: "continue", max_degradation: 0.05 }
+    // A full run also accepts { quantiles: [0.1, 0.5, 0.9] } ([] for the point model only)
+    const {
+      mode,
+      partition_by,
+      workers,
+      threads_per_worker,
+      strategy,
+      trials,
+      space,
+      prune_ratio,
+      method,
+      max_degradation,
+      quantiles,
+    } = req.body ?? {};
+    const args =
+      mode || quantiles !== undefined
+        ? [
+            JSON.stringify({
+              mode,
+              partition_by,
+              workers,
+              threads_per_worker,
+              strategy,
+              trials,
+              space,
+              prune_ratio,
+              method,
+              max_degradation,
+              quantiles,
+            }),
+          ]
+        : [];
+
+    // Training runs one at a time; an identical request joins the job in flight
+    const job = submitJob("train", args, async (job) => {
+      console.log("Executing Python script...");
+      const result = await executePythonScript(scriptPath, args, {
+        onOutput: (line) => {
+          job.progress = line;
+        },
+      });
+      console.log("✓ Python script completed successfully");
+      recordTimings("train", result);
+      return result;
+    });
 
-    res.json(result);
+    await respondWithJob(req, res, job);
   } catch (error) {
+    if (sendQueueFull(res, error)) {
+      return;
+    }
     console.error("=== Training error ===");
     console.error("Error details:", error);
 